@@ -0,0 +1,253 @@
+"""PPO optimizer that loads the train batch of each policy into the graph once per iteration.
+
+Every minibatch step then only feeds the minibatch index: the batch is kept in variables on /cpu:0 and each
+minibatch is gathered in graph from a permutation of the rows that is reshuffled every epoch, so unlike rllib's
+LocalMultiGPUOptimizer the minibatches are different in every epoch. All the loss inputs of the policy are loaded,
+which includes the kj_* columns of the kl reward and the is_active part of the adversary observations.
+
+The losses of the policies are independent (the adversaries are masked by their own is_active), so with
+num_parallel_policies > 1 the sgd of the policies runs concurrently in a thread pool. session.run releases the GIL, so
+the threads run the train ops of different policies in parallel. Policy k runs in the inter op thread pool
+k % num_parallel_policies of the session, see thread_pool_session_args, and the stats are merged in the order of the
+policy ids whatever order the policies finish in.
+
+Recurrent policies are not supported since the rows of a sequence have to stay together.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import ray
+import tensorflow as tf
+from ray.rllib.evaluation.metrics import LEARNER_STATS_KEY
+from ray.rllib.optimizers.policy_optimizer import PolicyOptimizer
+from ray.rllib.optimizers.rollout import collect_samples
+from ray.rllib.policy.sample_batch import SampleBatch, DEFAULT_POLICY_ID, MultiAgentBatch
+from ray.rllib.utils.timer import TimerStat
+
+
+class PreloadedPolicyBatch(object):
+    """The train batch of one policy, kept in the graph, and the sgd step on a minibatch of it.
+
+    Parameters
+    ----------
+    policy: (TFPolicy)
+        The policy to train
+    minibatch_size: (int)
+        Rows per sgd step
+    thread_pool: (int or None)
+        Index of the inter op thread pool of the session the policy runs in
+    """
+
+    def __init__(self, policy, minibatch_size, thread_pool=None):
+        self.minibatch_size = minibatch_size
+        self.run_options = tf.RunOptions(inter_op_thread_pool=thread_pool) if thread_pool is not None else None
+        self.names = [name for name, _ in policy._loss_inputs]
+        placeholders = [placeholder for _, placeholder in policy._loss_inputs]
+        with tf.device('/cpu:0'):
+            self.load_placeholders = [tf.placeholder(placeholder.dtype, placeholder.shape, name='load_' + name)
+                                      for name, placeholder in zip(self.names, placeholders)]
+            self.buffers = [tf.Variable(tf.zeros([0] + [dim or 0 for dim in placeholder.shape.as_list()[1:]],
+                                                 dtype=placeholder.dtype),
+                                        trainable=False, validate_shape=False, name='buffer_' + name)
+                            for name, placeholder in zip(self.names, placeholders)]
+            self.load_op = tf.group(*[tf.assign(buffer, load_placeholder, validate_shape=False)
+                                      for buffer, load_placeholder in zip(self.buffers, self.load_placeholders)])
+            self.permutation = tf.Variable(tf.zeros([0], dtype=tf.int32), trainable=False, validate_shape=False,
+                                           name='permutation')
+            self.shuffle_op = tf.assign(self.permutation, tf.random.shuffle(tf.range(tf.shape(self.buffers[0])[0])),
+                                        validate_shape=False)
+            self.batch_index = tf.placeholder(tf.int32, (), name='batch_index')
+            indices = self.permutation[self.batch_index * minibatch_size:(self.batch_index + 1) * minibatch_size]
+            minibatch = []
+            for buffer, placeholder in zip(self.buffers, placeholders):
+                rows = tf.gather(buffer, indices)
+                rows.set_shape(placeholder.shape)
+                minibatch.append(rows)
+            # a copy of the loss built on the minibatch, sharing the variables of the policy
+            self.tower = policy.copy(list(zip(self.names, minibatch)))
+            grads_and_vars = self.tower.gradients(policy._optimizer, self.tower._loss)
+            self.train_op = policy._optimizer.apply_gradients(
+                [(grad, var) for grad, var in grads_and_vars if grad is not None])
+        self.fetches = self.tower._get_grad_and_stats_fetches()
+        self.num_batches = 0
+
+    def load_data(self, sess, batch):
+        """Copy batch into the graph. Returns the number of minibatches per epoch"""
+        sess.run(self.load_op, feed_dict={load_placeholder: batch[name]
+                                          for name, load_placeholder in zip(self.names, self.load_placeholders)},
+                 options=self.run_options)
+        self.num_batches = max(1, batch.count // self.minibatch_size)
+        return self.num_batches
+
+    def shuffle(self, sess):
+        sess.run(self.shuffle_op, options=self.run_options)
+
+    def optimize(self, sess, batch_index):
+        feed_dict = {self.batch_index: batch_index}
+        feed_dict.update(self.tower.extra_compute_grad_feed_dict())
+        return sess.run([self.train_op, self.fetches], feed_dict=feed_dict, options=self.run_options)[1]
+
+
+class PreloadedSGDOptimizer(PolicyOptimizer):
+    """Samples like rllib's LocalMultiGPUOptimizer on a single cpu device and trains every policy with a
+    PreloadedPolicyBatch.
+
+    Parameters
+    ----------
+    workers: (WorkerSet)
+        The workers of the trainer
+    sgd_batch_size: (int)
+        Minibatch size
+    num_sgd_iter: (int)
+        Epochs over the train batch
+    sample_batch_size: (int)
+        Fragment length of the workers
+    num_envs_per_worker: (int)
+        Envs per worker
+    train_batch_size: (int)
+        Steps per train batch
+    standardize_fields: (list)
+        Columns that are standardized before the batch is loaded
+    num_parallel_policies: (int)
+        Number of policies trained at the same time. If more than 1, the session of the local worker needs as many
+        inter op thread pools, see thread_pool_session_args
+    """
+
+    def __init__(self, workers, sgd_batch_size=128, num_sgd_iter=10, sample_batch_size=200, num_envs_per_worker=1,
+                 train_batch_size=1024, standardize_fields=(), num_parallel_policies=1):
+        PolicyOptimizer.__init__(self, workers)
+        self.sgd_batch_size = sgd_batch_size
+        self.num_sgd_iter = num_sgd_iter
+        self.sample_batch_size = sample_batch_size
+        self.num_envs_per_worker = num_envs_per_worker
+        self.train_batch_size = train_batch_size
+        self.standardize_fields = standardize_fields
+        self.sample_timer = TimerStat()
+        self.load_timer = TimerStat()
+        self.grad_timer = TimerStat()
+        self.update_weights_timer = TimerStat()
+        self.learner_stats = {}
+        self.pool = ThreadPoolExecutor(num_parallel_policies) if num_parallel_policies > 1 else None
+
+        self.policies = dict(self.workers.local_worker().foreach_trainable_policy(lambda p, i: (i, p)))
+        self.sess = self.workers.local_worker().tf_sess
+        self.optimizers = {}
+        with self.sess.graph.as_default(), self.sess.as_default():
+            for i, policy_id in enumerate(sorted(self.policies.keys())):
+                policy = self.policies[policy_id]
+                if policy._state_inputs:
+                    raise ValueError('The preloaded sgd optimizer does not support recurrent policies')
+                thread_pool = i % num_parallel_policies if self.pool is not None else None
+                with tf.variable_scope(policy_id, reuse=tf.AUTO_REUSE):
+                    self.optimizers[policy_id] = PreloadedPolicyBatch(policy, sgd_batch_size, thread_pool)
+            # the same as LocalMultiGPUOptimizer, the weights are sent to the workers before they first sample
+            self.sess.run(tf.global_variables_initializer())
+
+    def sample(self):
+        with self.update_weights_timer:
+            if self.workers.remote_workers():
+                weights = ray.put(self.workers.local_worker().get_weights())
+                for worker in self.workers.remote_workers():
+                    worker.set_weights.remote(weights)
+
+        with self.sample_timer:
+            if self.workers.remote_workers():
+                samples = collect_samples(self.workers.remote_workers(), self.sample_batch_size,
+                                          self.num_envs_per_worker, self.train_batch_size)
+            else:
+                samples = []
+                while sum(sample.count for sample in samples) < self.train_batch_size:
+                    samples.append(self.workers.local_worker().sample())
+                samples = SampleBatch.concat_samples(samples)
+            self.sample_timer.push_units_processed(samples.count)
+        if isinstance(samples, SampleBatch):
+            samples = MultiAgentBatch({DEFAULT_POLICY_ID: samples}, samples.count)
+        return samples
+
+    def step(self):
+        samples = self.sample()
+
+        num_batches = {}
+        with self.load_timer:
+            for policy_id, batch in samples.policy_batches.items():
+                if policy_id not in self.policies:
+                    continue
+                for field in self.standardize_fields:
+                    value = batch[field]
+                    batch[field] = (value - value.mean()) / max(1e-4, value.std())
+                num_batches[policy_id] = self.optimizers[policy_id].load_data(self.sess, batch)
+
+        policy_ids = sorted(num_batches.keys())
+        with self.grad_timer:
+            if self.pool is None:
+                policy_stats = [self.train_policy(policy_id, num_batches[policy_id]) for policy_id in policy_ids]
+            else:
+                # map returns the results in the order of policy_ids
+                policy_stats = list(self.pool.map(lambda policy_id: self.train_policy(policy_id,
+                                                                                      num_batches[policy_id]),
+                                                  policy_ids))
+        fetches = dict(zip(policy_ids, policy_stats))
+        self.learner_stats = fetches
+
+        self.num_steps_sampled += samples.count
+        self.num_steps_trained += sum(batches * self.sgd_batch_size for batches in num_batches.values())
+        return fetches
+
+    def train_policy(self, policy_id, num_batches):
+        """Run the epochs of one policy on its loaded batch and return the mean stats of the last epoch, as
+        LocalMultiGPUOptimizer does"""
+        optimizer = self.optimizers[policy_id]
+        for _ in range(self.num_sgd_iter):
+            optimizer.shuffle(self.sess)
+            epoch_stats = []
+            for batch_index in range(num_batches):
+                epoch_stats.append(optimizer.optimize(self.sess, batch_index)[LEARNER_STATS_KEY])
+        return {key: np.mean([stats[key] for stats in epoch_stats]) for key in epoch_stats[0]}
+
+    def stop(self):
+        """Called by the trainer when it stops, shuts down the threads of the parallel policies"""
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def stats(self):
+        return dict(PolicyOptimizer.stats(self), **{
+            'sample_time_ms': round(1000 * self.sample_timer.mean, 3),
+            'load_time_ms': round(1000 * self.load_timer.mean, 3),
+            'grad_time_ms': round(1000 * self.grad_timer.mean, 3),
+            'update_time_ms': round(1000 * self.update_weights_timer.mean, 3),
+            'learner': self.learner_stats,
+        })
+
+
+def thread_pool_session_args(num_parallel_policies, num_cores):
+    """Session args of the local worker for num_parallel_policies concurrent policies on num_cores cores. Each
+    policy gets its own inter op pool with num_cores // num_parallel_policies threads. The intra op pool is shared by
+    all the runs of a session in tf 1, so it keeps num_cores threads, which bounds the threads running ops at once
+    instead of giving every policy its own full pool"""
+    threads_per_policy = max(1, num_cores // num_parallel_policies)
+    return {
+        'intra_op_parallelism_threads': num_cores,
+        'inter_op_parallelism_threads': threads_per_policy,
+        'session_inter_op_thread_pool': [{'num_threads': threads_per_policy} for _ in range(num_parallel_policies)],
+    }
+
+
+def make_preloaded_optimizer(workers, config, num_parallel_policies=1):
+    return PreloadedSGDOptimizer(
+        workers,
+        sgd_batch_size=config['sgd_minibatch_size'],
+        num_sgd_iter=config['num_sgd_iter'],
+        sample_batch_size=config['sample_batch_size'],
+        num_envs_per_worker=config['num_envs_per_worker'],
+        train_batch_size=config['train_batch_size'],
+        standardize_fields=['advantages'],
+        num_parallel_policies=num_parallel_policies)
+
+
+def with_preloaded_sgd(trainer_cls, num_parallel_policies=1):
+    """A version of the PPO trainer trainer_cls (built with build_trainer) that trains with PreloadedSGDOptimizer.
+    With num_parallel_policies > 1 the config also needs local_tf_session_args from thread_pool_session_args"""
+    return trainer_cls.with_updates(make_policy_optimizer=partial(make_preloaded_optimizer,
+                                                                  num_parallel_policies=num_parallel_policies))
@@ -0,0 +1,59 @@
+"""Compare benchmark results against a stored baseline"""
+
+import json
+
+import numpy as np
+
+
+def higher_is_better(metric):
+    """Rates (..._per_s) should go up, durations (..._s) should go down"""
+    return metric.endswith('_per_s')
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)['results']
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1):
+    """Compare every numeric metric that is in both results and baseline.
+
+    Parameters
+    ----------
+    results: (dict)
+        Map from benchmark name to its metrics
+    baseline: (dict)
+        The same for the baseline
+    tolerance: (float)
+        Relative change in the bad direction that counts as a regression. Benchmarks are noisy, keep it well above
+        the run to run variation of the machine
+
+    Returns
+    -------
+    rows: (list)
+        A dict per metric with the benchmark name, the metric, the baseline and current values, the relative change
+        and whether it regressed
+    """
+    rows = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in metrics.items():
+            base_value = baseline[name].get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)) \
+                    or isinstance(value, bool) or base_value == 0 or not np.isfinite(value):
+                continue
+            change = (value - base_value) / abs(base_value)
+            regressed = change < -tolerance if higher_is_better(metric) else change > tolerance
+            rows.append({'name': name, 'metric': metric, 'baseline': base_value, 'current': value,
+                         'change': change, 'regressed': regressed})
+    return rows
+
+
+def print_comparison(rows):
+    for row in rows:
+        print('{:<50} {:<32} {:>12.3f} -> {:>12.3f} {:>+7.1%}{}'.format(
+            row['name'], row['metric'], row['baseline'], row['current'], row['change'],
+            '  REGRESSION' if row['regressed'] else ''))
+    num_regressed = sum(row['regressed'] for row in rows)
+    print('{} of {} metrics regressed'.format(num_regressed, len(rows)))
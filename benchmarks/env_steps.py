@@ -0,0 +1,80 @@
+"""Raw steps per second of the adversarial envs under the flag combinations that change the cost of a step"""
+
+from collections import OrderedDict
+import time
+
+from run_scripts.mujoco.run_adv_mujoco import setup_exps
+
+ENV_NAMES = ['hopper', 'cheetah', 'ant', 'pendulum']
+
+# name of the case -> env_config keys it overrides. The reward flags are set on the env config directly since
+# setup_exps refuses the l2 reward together with the MeanStdFilter of its PPO config
+FLAG_CASES = OrderedDict([
+    ('base', {}),
+    ('kl_reward', {'kl_reward': True}),
+    ('l2_reward', {'l2_reward': True}),
+    ('l2_reward_in_tranche', {'l2_reward': True, 'l2_in_tranche': True}),
+    ('l2_memory', {'l2_reward': True, 'l2_memory': True}),
+    ('l2_memory_in_tranche', {'l2_reward': True, 'l2_memory': True, 'l2_in_tranche': True}),
+    ('l2_memory_sketch', {'l2_reward': True, 'l2_memory': True, 'l2_memory_type': 'sketch'}),
+    ('concat_actions', {'concat_actions': True}),
+    ('num_concat_states_4', {'num_concat_states': 4}),
+])
+
+# the pendulum has no kl or l2 reward
+PENDULUM_CASES = ['base', 'concat_actions', 'num_concat_states_4']
+
+ADVERSARY_COUNTS = [1, 5, 10, 30]
+
+
+def make_env(env_name, num_adversaries, flags):
+    """Build the env the way run_adv_mujoco does, with num_adversaries adversaries at one strength level"""
+    exp_dict, args = setup_exps(['--env_name', env_name, '--num_adv_strengths', '1',
+                                 '--advs_per_strength', str(num_adversaries),
+                                 '--num_adv_rews', '1', '--advs_per_rew', str(num_adversaries)])
+    env_config = exp_dict['config']['env_config']
+    env_config.update(flags)
+    from visualize.mujoco.run_rollout import get_env_creator
+    return get_env_creator(exp_dict['config']['env'])(env_config)
+
+
+def random_actions(env, obs):
+    actions = {}
+    for agent_id in obs.keys():
+        if agent_id == 'agent':
+            actions[agent_id] = env.action_space.sample()
+        else:
+            actions[agent_id] = env.adv_action_space.sample()
+    return actions
+
+
+def bench_env(env_name, num_adversaries, flags, num_steps=2000):
+    """Step the env with random actions for every agent that gets an observation. Returns steps per second"""
+    env = make_env(env_name, num_adversaries, flags)
+    obs = env.reset()
+    # the first steps pay for lazy initialization in mujoco
+    for _ in range(10):
+        obs, _, done, _ = env.step(random_actions(env, obs))
+        if done['__all__']:
+            obs = env.reset()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        obs, _, done, _ = env.step(random_actions(env, obs))
+        if done['__all__']:
+            obs = env.reset()
+    elapsed = time.perf_counter() - start
+    return {'steps_per_s': num_steps / elapsed}
+
+
+def run_env_benchmarks(env_names=ENV_NAMES, cases=None, adversary_counts=ADVERSARY_COUNTS, num_steps=2000):
+    """Returns a map from 'env/<env>/<case>/advs=<n>' to its metrics"""
+    results = OrderedDict()
+    for env_name in env_names:
+        for case, flags in FLAG_CASES.items():
+            if (cases is not None and case not in cases) or (env_name == 'pendulum' and case not in PENDULUM_CASES):
+                continue
+            for num_adversaries in adversary_counts:
+                name = 'env/{}/{}/advs={}'.format(env_name, case, num_adversaries)
+                results[name] = bench_env(env_name, num_adversaries, flags, num_steps)
+                print('{:<50} {:>10.1f} steps/s'.format(name, results[name]['steps_per_s']))
+    return results
@@ -0,0 +1,94 @@
+"""Sampling, postprocessing and SGD throughput of the trainer and policy optimizer run_adv_mujoco builds, on a
+single local worker"""
+
+from collections import OrderedDict
+import time
+
+import ray
+try:
+    from ray.rllib.agents.agent import get_agent_class
+except ImportError:
+    from ray.rllib.agents.registry import get_agent_class
+
+from run_scripts.mujoco.run_adv_mujoco import setup_exps
+from utils.timing import OPTIMIZER_TIMERS, instrument_policies, pop_postprocess_times
+
+# name of the case -> extra run_adv_mujoco arguments. kl_reward selects CustomPPOTrainer and its CustomPPOPolicy
+LEARNER_CASES = OrderedDict([
+    ('ppo', []),
+    ('ppo_kl_reward', ['--kl_reward']),
+    ('ppo_preloaded', ['--preloaded_sgd']),
+    ('ppo_preloaded_parallel', ['--preloaded_sgd', '--parallel_policy_learners', '4']),
+])
+
+ADVERSARY_COUNTS = [1, 5, 10]
+
+
+def make_trainer(env_name, num_adversaries, extra_args, train_batch_size):
+    exp_dict, args = setup_exps(['--env_name', env_name, '--num_adv_strengths', '1',
+                                 '--advs_per_strength', str(num_adversaries),
+                                 '--num_adv_rews', '1', '--advs_per_rew', str(num_adversaries),
+                                 '--train_batch_size', str(train_batch_size)] + extra_args)
+    config = exp_dict['config']
+    config['num_workers'] = 0
+    config['callbacks'] = {}
+    runner = exp_dict['run_or_experiment']
+    trainer_cls = get_agent_class(runner) if isinstance(runner, str) else runner
+    return trainer_cls(env=config['env'], config=config)
+
+
+def timer_totals(optimizer):
+    """Running total of every timer of the optimizer, see utils/timing.py"""
+    return {name: getattr(optimizer, attr)._total_time for attr, name in OPTIMIZER_TIMERS
+            if hasattr(optimizer, attr)}
+
+
+def bench_learner(env_name, num_adversaries, extra_args, train_batch_size=4000, num_iters=3):
+    """Run num_iters optimizer steps of the trainer, so sampling and SGD go through the optimizer the trainer would
+    use (num_sgd_iter epochs of minibatches, or the preloaded sgd). Returns the env steps per second of sampling
+    (which includes postprocessing), of SGD (loading the batch and the epochs), of the whole step, and of the
+    postprocessing of every policy, which is timed where the sampler runs it"""
+    trainer = make_trainer(env_name, num_adversaries, extra_args, train_batch_size)
+    optimizer = trainer.optimizer
+    instrument_policies(trainer.workers.local_worker().policy_map)
+    pop_postprocess_times()
+    step_s = 0.0
+    postprocess_s = {}
+    start_steps = optimizer.num_steps_sampled
+    start_totals = timer_totals(optimizer)
+    for _ in range(num_iters):
+        start = time.perf_counter()
+        optimizer.step()
+        step_s += time.perf_counter() - start
+        for policy_id, policy_time in pop_postprocess_times().items():
+            postprocess_s[policy_id] = postprocess_s.get(policy_id, 0.0) + policy_time
+    totals = timer_totals(optimizer)
+    num_steps = optimizer.num_steps_sampled - start_steps
+    sample_s = totals['sample_s'] - start_totals['sample_s']
+    learn_s = sum(totals[name] - start_totals[name] for name in ['load_s', 'learn_s'] if name in totals)
+    trainer.stop()
+    return {
+        'sample_steps_per_s': num_steps / sample_s,
+        'learn_steps_per_s': num_steps / learn_s,
+        'step_steps_per_s': num_steps / step_s,
+        'postprocess_steps_per_s': num_steps / max(sum(postprocess_s.values()), 1e-9),
+        'agent_postprocess_steps_per_s': num_steps / max(postprocess_s.get('agent', 0), 1e-9),
+    }
+
+
+def run_learner_benchmarks(env_name='hopper', cases=None, adversary_counts=ADVERSARY_COUNTS, train_batch_size=4000,
+                           num_iters=3):
+    """Returns a map from 'learner/<env>/<case>/advs=<n>' to its metrics"""
+    if not ray.is_initialized():
+        ray.init()
+    results = OrderedDict()
+    for case, extra_args in LEARNER_CASES.items():
+        if cases is not None and case not in cases:
+            continue
+        for num_adversaries in adversary_counts:
+            name = 'learner/{}/{}/advs={}'.format(env_name, case, num_adversaries)
+            results[name] = bench_learner(env_name, num_adversaries, extra_args, train_batch_size, num_iters)
+            print('{:<50} sample {:>9.1f} learn {:>9.1f} step {:>9.1f} postprocess {:>9.1f} steps/s'.format(
+                name, results[name]['sample_steps_per_s'], results[name]['learn_steps_per_s'],
+                results[name]['step_steps_per_s'], results[name]['postprocess_steps_per_s']))
+    return results
@@ -0,0 +1,96 @@
+"""Run the benchmark suites, save their results as json and compare them with a baseline.
+
+There is no stored baseline in the repo since the numbers only mean something on the machine they were measured on.
+Save one with --save_baseline before starting optimization work and pass it with --baseline afterwards.
+
+Usage:
+    python -m benchmarks.run_benchmarks --suites env startup --output bench.json --save_baseline baseline.json
+    python -m benchmarks.run_benchmarks --suites env startup --output bench.json --baseline baseline.json
+"""
+
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from benchmarks.compare import compare_to_baseline, load_results, print_comparison
+
+SUITES = ['env', 'learner', 'transfer', 'startup']
+
+
+def machine_info():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+                                         stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.now().isoformat(),
+        'commit': commit,
+        'host': platform.node(),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump({'meta': machine_info(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Run the throughput benchmarks')
+    parser.add_argument('--suites', type=str, nargs='+', default=['env', 'startup'], choices=SUITES)
+    parser.add_argument('--env_names', type=str, nargs='+', default=None,
+                        help='Envs of the env suite, all of them by default')
+    parser.add_argument('--cases', type=str, nargs='+', default=None,
+                        help='Flag cases of the env and learner suites, all of them by default')
+    parser.add_argument('--adversary_counts', type=int, nargs='+', default=None)
+    parser.add_argument('--num_steps', type=int, default=2000, help='Steps per env benchmark')
+    parser.add_argument('--learner_env', type=str, default='hopper')
+    parser.add_argument('--train_batch_size', type=int, default=4000)
+    parser.add_argument('--num_iters', type=int, default=3, help='Iterations per learner benchmark')
+    parser.add_argument('--trial_dir', type=str, default=None, help='Trial dir of the checkpoint the transfer '
+                                                                    'suite evaluates')
+    parser.add_argument('--checkpoint_num', type=str, default=None)
+    parser.add_argument('--num_evaluators', type=int, default=2)
+    parser.add_argument('--startup_repeats', type=int, default=5)
+    parser.add_argument('--output', type=str, default='benchmark_results.json')
+    parser.add_argument('--baseline', type=str, default=None, help='Results json to compare against')
+    parser.add_argument('--save_baseline', type=str, default=None, help='Also save the results to this path')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative change in the bad direction that counts as a regression')
+    args = parser.parse_args()
+
+    results = OrderedDict()
+    if 'env' in args.suites:
+        from benchmarks.env_steps import run_env_benchmarks, ENV_NAMES, ADVERSARY_COUNTS
+        results.update(run_env_benchmarks(args.env_names or ENV_NAMES, args.cases,
+                                          args.adversary_counts or ADVERSARY_COUNTS, args.num_steps))
+    if 'learner' in args.suites:
+        from benchmarks.learner import run_learner_benchmarks, ADVERSARY_COUNTS
+        results.update(run_learner_benchmarks(args.learner_env, args.cases, args.adversary_counts or ADVERSARY_COUNTS,
+                                              args.train_batch_size, args.num_iters))
+    if 'transfer' in args.suites:
+        if args.trial_dir is None or args.checkpoint_num is None:
+            sys.exit('The transfer suite needs --trial_dir and --checkpoint_num')
+        from benchmarks.transfer import run_transfer_benchmarks
+        results.update(run_transfer_benchmarks(args.trial_dir, args.checkpoint_num, num_evaluators=args.num_evaluators))
+    if 'startup' in args.suites:
+        from benchmarks.startup import run_startup_benchmark
+        results.update(('startup/' + name, metrics) for name, metrics
+                       in run_startup_benchmark(repeats=args.startup_repeats).items())
+
+    save_results(args.output, results)
+    if args.save_baseline is not None:
+        save_results(args.save_baseline, results)
+
+    if args.baseline is not None:
+        rows = compare_to_baseline(results, load_results(args.baseline), args.tolerance)
+        print_comparison(rows)
+        if any(row['regressed'] for row in rows):
+            sys.exit(1)
@@ -0,0 +1,96 @@
+"""Cold start time of the entry points of the repo.
+
+Every module is imported in a fresh python process, the way a ray worker or a short eval job starts, and we record
+the wall time of the whole process, the time of the import itself and which of the heavy dependencies it loaded.
+
+Usage: python -m benchmarks.startup --repeats 5 --output startup.json
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# name of the entry point -> module it imports
+ENTRY_POINTS = OrderedDict([
+    ('driver', 'run_scripts.mujoco.run_adv_mujoco'),
+    ('worker_hopper', 'envs.mujoco.adv_hopper'),
+    ('worker_cheetah', 'envs.mujoco.adv_cheetah'),
+    ('worker_ant', 'envs.mujoco.adv_ant'),
+    ('worker_pendulum', 'envs.mujoco.adv_inverted_pendulum_env'),
+    ('eval_actor', 'visualize.mujoco.transfer_tests'),
+    ('plots', 'visualize.final_results.generate_all_plots'),
+])
+
+HEAVY_MODULES = ['tensorflow', 'matplotlib', 'ray.rllib', 'ray.tune', 'gym', 'mujoco_py', 'scipy']
+
+IMPORT_SCRIPT = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+error = None
+try:
+    importlib.import_module({module!r})
+except Exception as e:
+    error = '{{}}: {{}}'.format(type(e).__name__, e)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import_s': elapsed, 'error': error,
+                  'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def time_import(module, python=sys.executable):
+    """Import module in a new process and return the process time, the import time, the heavy modules it loaded
+    and the error if the import failed"""
+    script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_ROOT, os.environ.get('PYTHONPATH', '')]))
+    start = time.perf_counter()
+    output = subprocess.run([python, '-c', script], cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    process_s = time.perf_counter() - start
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result['process_s'] = process_s
+    return result
+
+
+def run_startup_benchmark(entry_points=ENTRY_POINTS, repeats=5):
+    """Returns, for every entry point, the median and min process and import time over repeats cold starts"""
+    results = OrderedDict()
+    for name, module in entry_points.items():
+        runs = [time_import(module) for _ in range(repeats)]
+        results[name] = {
+            'module': module,
+            'process_s_median': float(np.median([run['process_s'] for run in runs])),
+            'process_s_min': float(np.min([run['process_s'] for run in runs])),
+            'import_s_median': float(np.median([run['import_s'] for run in runs])),
+            'import_s_min': float(np.min([run['import_s'] for run in runs])),
+            'loaded': runs[-1]['loaded'],
+            'error': runs[-1]['error'],
+        }
+        print('{:<16} process {:.3f}s import {:.3f}s loaded {}{}'.format(
+            name, results[name]['process_s_median'], results[name]['import_s_median'],
+            ', '.join(results[name]['loaded']) or '-',
+            '' if results[name]['error'] is None else ' FAILED ({})'.format(results[name]['error'])))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Measure the cold start time of the driver, worker and eval entry points')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', type=str, nargs='+', default=None, choices=list(ENTRY_POINTS.keys()),
+                        help='Only time these entry points')
+    parser.add_argument('--output', type=str, default=None, help='If set, the results are saved to this json file')
+    args = parser.parse_args()
+
+    entry_points = OrderedDict((name, module) for name, module in ENTRY_POINTS.items()
+                               if args.only is None or name in args.only)
+    results = run_startup_benchmark(entry_points, args.repeats)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,52 @@
+"""Throughput of the transfer tests, on the evaluator actors the sweeps use"""
+
+from collections import OrderedDict
+import time
+
+import ray
+
+from utils.rllib_utils import get_config_from_path
+from visualize.mujoco.transfer_tests import load_checkpoint_files, make_evaluator_pool, run_tests_on_pool, \
+    transfer_lists
+
+
+def bench_transfer(rllib_config, checkpoint_path, num_tests=11, num_rollouts=2, num_evaluators=2):
+    """Run the first num_tests tests of the env's run list from checkpoint_path twice. Returns env steps and tests per
+    second of the second pass and an estimate of the time it takes to start the evaluators"""
+    run_list, _ = transfer_lists[rllib_config['env']]
+    tests = run_list[:num_tests]
+    # the run list only needs the agent, as in run_transfer_tests
+    checkpoint_name, checkpoint_files = load_checkpoint_files(checkpoint_path, ['agent'])
+    num_steps = [0]
+
+    def count_steps(spec, rewards, step_nums):
+        num_steps[0] += int(sum(step_nums))
+
+    evaluators = make_evaluator_pool(rllib_config, checkpoint_name, checkpoint_files, num_evaluators, ['agent'])
+    # the first pass also waits for the evaluators to start and restore the checkpoint
+    start = time.perf_counter()
+    run_tests_on_pool(evaluators, tests, num_rollouts, count_steps)
+    first_pass_s = time.perf_counter() - start
+
+    num_steps[0] = 0
+    start = time.perf_counter()
+    run_tests_on_pool(evaluators, tests, num_rollouts, count_steps)
+    elapsed = time.perf_counter() - start
+    return {
+        'startup_s': first_pass_s - elapsed,
+        'tests_per_s': len(tests) / elapsed,
+        'steps_per_s': num_steps[0] / elapsed,
+    }
+
+
+def run_transfer_benchmarks(trial_dir, checkpoint_num, num_tests=11, num_rollouts=2, num_evaluators=2):
+    """Returns a map from 'transfer/<env>/evaluators=<n>' to its metrics"""
+    if not ray.is_initialized():
+        ray.init()
+    rllib_config, checkpoint_path = get_config_from_path(trial_dir, str(checkpoint_num))
+    name = 'transfer/{}/evaluators={}'.format(rllib_config['env'], num_evaluators)
+    results = OrderedDict([(name, bench_transfer(rllib_config, checkpoint_path, num_tests, num_rollouts,
+                                                 num_evaluators))])
+    print('{:<50} {:>8.2f} tests/s {:>10.1f} steps/s (startup {:.1f}s)'.format(
+        name, results[name]['tests_per_s'], results[name]['steps_per_s'], results[name]['startup_s']))
+    return results
@@ -6,7 +6,8 @@ from gym.spaces import Box, Discrete, Dict
 import numpy as np
 from os import path
 from ray.rllib.env.multi_agent_env import MultiAgentEnv
-from visualize.plot_heatmap import cheetah_friction_sweep, cheetah_mass_sweep
+from envs.mujoco.l2_memory import L2Memory, SketchMemory
+from envs.mujoco.sweeps import cheetah_friction_sweep, cheetah_mass_sweep
 from copy import deepcopy
 class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
     def __init__(self, config):
@@ -22,6 +23,9 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
 
         # This sets whether we should use adversaries across a reward range
         self.reward_range = config["reward_range"]
+        # if true, the adversaries also observe the step and the reward so far, which their reward_range reward
+        # depends on. This makes truncated fragments self-contained for the value function
+        self.adv_obs_reward_state = self.reward_range and config.get('adv_obs_reward_state', False)
         # This sets the adversaries low reward range
         self.low_reward = config["low_reward"]
         # This sets wthe adversaries high reward range
@@ -48,6 +52,10 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
         self.l2_in_tranche = config['l2_in_tranche']
         self.l2_memory = config['l2_memory']
         self.l2_memory_target_coeff = config['l2_memory_target_coeff']
+        # older configs have no l2_memory_type, they used the per time step mean
+        self.l2_memory_type = config.get('l2_memory_type', 'mean')
+        self.l2_sketch_size = config.get('l2_sketch_size', 256)
+        self.l2_sketch_feature_dim = config.get('l2_sketch_feature_dim', 16)
         self.l2_reward_coeff = config['l2_reward_coeff']
         self.kl_reward_coeff = config['kl_reward_coeff']
         self.no_end_if_fall = config['no_end_if_fall']
@@ -69,8 +77,14 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
             self.adversary_range = 0
         else:
             self.adversary_range = self.num_adv_strengths * self.advs_per_strength
+        # every sub-env of a vectorized env has its own stream, it is reproducible if the trainer seed is set
+        self.rng = np.random.RandomState([np.random.randint(2 ** 31), getattr(config, 'worker_index', 0),
+                                          getattr(config, 'vector_index', 0)])
+        # the adversary and dynamics of every episode are only redrawn in training, the evaluation envs keep the ones
+        # they are set up with for all their rollouts, see transfer_tests.reset_env
+        self.train_episodes = True
         if self.adversary_range > 0:
-            self.curr_adversary = np.random.randint(low=0, high=self.adversary_range)
+            self.curr_adversary = self.rng.randint(low=0, high=self.adversary_range)
         else:
             self.curr_adversary = 0
 
@@ -122,12 +136,13 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
         self.observation_space = Box(low=low, high=high, dtype=np.float32)
 
         # instantiate the l2 memory tracker
-        if self.adversary_range > 0 and self.l2_memory:
-            self.global_l2_memory_array = np.zeros(
-                (self.adversary_range, self.adv_action_space.low.shape[0], self.horizon + 1))
-            self.local_l2_memory_array = np.zeros(
-                (self.adversary_range, self.adv_action_space.low.shape[0], self.horizon + 1))
-            self.local_num_observed_l2_samples = np.zeros(self.adversary_range)
+        if self.adversary_range > 0 and self.l2_memory and self.l2_memory_type == 'sketch':
+            self.l2_memory_tracker = SketchMemory(self.adversary_range, self.observation_space.shape[0],
+                                                  self.adv_action_space.low.shape[0], self.l2_sketch_size,
+                                                  self.l2_sketch_feature_dim)
+        elif self.adversary_range > 0 and self.l2_memory:
+            self.l2_memory_tracker = L2Memory(self.adversary_range, self.adv_action_space.low.shape[0],
+                                              self.horizon, self.l2_memory_target_coeff)
 
     @property
     def adv_action_space(self):
@@ -144,12 +159,23 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
 
     @property
     def adv_observation_space(self):
+        if self.adv_obs_reward_state:
+            obs_space = Box(low=np.concatenate((self.observation_space.low, [0.0, -np.inf])),
+                            high=np.concatenate((self.observation_space.high, [1.0, np.inf])), dtype=np.float32)
+        else:
+            obs_space = self.observation_space
         if self.kl_reward or (self.l2_reward and not self.l2_memory):
-            dict_space = Dict({'obs': self.observation_space,
+            dict_space = Dict({'obs': obs_space,
                                'is_active': Box(low=-1.0, high=1.0, shape=(1,), dtype=np.int32)})
             return dict_space
         else:
-            return self.observation_space
+            return obs_space
+
+    def get_adv_obs(self):
+        if self.adv_obs_reward_state:
+            return np.concatenate((self.observed_states,
+                                   [float(self.step_num) / self.horizon, self.total_reward / self.horizon]))
+        return self.observed_states
 
     def _adv_to_xfrc(self, adv_act):      
         self.sim.data.xfrc_applied[self._adv_bindex[0]][0] = adv_act[0]
@@ -171,32 +197,54 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
                 self.adversary_range = min(self.adversary_range, self.num_adv_strengths * self.advs_per_strength)
 
     def get_observed_samples(self):
-        return self.local_l2_memory_array, self.local_num_observed_l2_samples
-
-    def update_global_action_mean(self, mean_array):
-        """Use polyak averaging to generate an estimate of the current mean actions at each time step"""
-        self.global_l2_memory_array = (1 - self.l2_memory_target_coeff) * self.global_l2_memory_array + self.l2_memory_target_coeff * mean_array
-        self.local_l2_memory_array = np.zeros(self.local_l2_memory_array.shape)
-        self.local_num_observed_l2_samples = np.zeros(self.adversary_range)
+        return self.l2_memory_tracker.export()
+
+    def update_global_action_mean(self, mean):
+        """Use polyak averaging to generate an estimate of the current mean actions at each time step, or replace the
+        global reservoirs if l2_memory_type is sketch"""
+        self.l2_memory_tracker.update_global(mean)
+
+    def apply_control(self, msg):
+        """Apply the per iteration control message of the driver, see utils/env_control.py. Returns the l2 memory
+        statistics collected since the previous message"""
+        if 'mean_rew' in msg:
+            self.update_curriculum(msg['mean_rew'])
+        if not (self.l2_memory and hasattr(self, 'l2_memory_tracker')):
+            return None
+        stats = self.get_observed_samples()
+        if msg.get('global_l2_memory') is not None:
+            self.update_global_action_mean(msg['global_l2_memory'])
+        return stats
+
+    def prepare_next_episode(self):
+        """Pick the adversary and the dynamics of the next episode. The env calls it itself on the last step of an
+        episode, so that every sub-env of a vectorized or remote env gets its own"""
+        if not self.train_episodes:
+            return
+        self.select_new_adversary()
+        if self.domain_randomization:
+            self.randomize_domain()
+        elif self.extreme_domain_randomization:
+            self.extreme_randomize_domain()
 
     def select_new_adversary(self):
         if self.adversary_range > 0:
             # the -1 corresponds to not having any adversary on at all
-            self.curr_adversary = np.random.randint(low=0, high=self.adversary_range)
+            self.curr_adversary = self.rng.randint(low=0, high=self.adversary_range)
 
     def extreme_randomize_domain(self):
         num_geoms = len(self.model.geom_friction)
         num_masses = len(self.model.body_mass)
 
-        self.friction_coef = np.random.choice(cheetah_friction_sweep, num_geoms)[:, np.newaxis]
-        self.mass_coef = np.random.choice(cheetah_mass_sweep, num_masses)
+        self.friction_coef = self.rng.choice(cheetah_friction_sweep, num_geoms)[:, np.newaxis]
+        self.mass_coef = self.rng.choice(cheetah_mass_sweep, num_masses)
 
         self.model.body_mass[:] = (self.original_mass_all * self.mass_coef)
         self.model.geom_friction[:] = (self.original_friction * self.friction_coef)
 
     def randomize_domain(self):
-        self.friction_coef = np.random.choice(cheetah_friction_sweep)
-        self.mass_coef = np.random.choice(cheetah_mass_sweep)
+        self.friction_coef = self.rng.choice(cheetah_friction_sweep)
+        self.mass_coef = self.rng.choice(cheetah_mass_sweep)
 
         self.model.body_mass[self.dr_bindex] = (self.original_mass * self.mass_coef)
         self.model.geom_friction[:] = (self.original_friction * self.friction_coef)[:]
@@ -236,8 +284,13 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
         # keep track of the action that was taken
         if self.l2_memory and self.l2_reward and isinstance(actions, dict) and 'adversary{}'.format(
                 self.curr_adversary) in actions.keys():
-            self.local_l2_memory_array[self.curr_adversary, :, self.step_num] += actions[
-                'adversary{}'.format(self.curr_adversary)]
+            recorded_action = actions['adversary{}'.format(self.curr_adversary)]
+            if self.l2_memory_type == 'sketch':
+                # the observation the adversary acted on, update_observed_obs replaces self.observed_states
+                adv_obs = self.observed_states
+                self.l2_memory_tracker.record(self.curr_adversary, adv_obs, recorded_action)
+            else:
+                self.l2_memory_tracker.record(self.curr_adversary, self.step_num, recorded_action)
 
         xposbefore = self.sim.data.qpos[0] # note this is different than the RARL version
         self.do_simulation(cheetah_action, self.frame_skip)
@@ -259,21 +312,22 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
 
         self.total_reward += reward
         if isinstance(actions, dict):
-            info = {'agent': {'agent_reward': reward}}
+            info = {'agent': {'agent_reward': reward, 'num_active_advs': self.adversary_range}}
             obs_dict = {'agent': self.observed_states}
             reward_dict = {'agent': reward}
 
             if self.adversary_range > 0 and self.curr_adversary >= 0:
                 # to do the kl or l2 reward we have to get actions from all the agents and so we need
                 # to pass them all obs
+                next_adv_obs = self.get_adv_obs()
                 if self.kl_reward or (self.l2_reward and not self.l2_memory):
                     is_active = [1 if i == self.curr_adversary else 0 for i in range(self.adversary_range)]
                     obs_dict.update({
-                        'adversary{}'.format(i): {"obs": self.observed_states, "is_active": np.array([is_active[i]])}
+                        'adversary{}'.format(i): {"obs": next_adv_obs, "is_active": np.array([is_active[i]])}
                         for i in range(self.adversary_range)})
                 else:
                     obs_dict.update({
-                        'adversary{}'.format(self.curr_adversary): self.observed_states
+                        'adversary{}'.format(self.curr_adversary): next_adv_obs
                     })
 
                 if self.reward_range:
@@ -312,16 +366,20 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
                         l2_dists_mean = np.sum(l2_dists, axis=-1)
                     # here we approximate the l2 reward by diffing against the average action other agents took
                     # at this timestep
-                    if self.l2_reward and self.l2_memory:
+                    if self.l2_reward and self.l2_memory and self.l2_memory_type == 'sketch':
+                        # diff against the actions the other agents took in the most similar states they saw
+                        low, high = self.comp_adversaries[self.curr_adversary] if self.l2_in_tranche else (0, None)
+                        l2_dists_mean = np.sum(self.l2_memory_tracker.distances(adv_obs, recorded_action, low, high))
+                    elif self.l2_reward and self.l2_memory:
                         action_list = [actions['adversary{}'.format(self.curr_adversary)]]
                         if self.l2_in_tranche:
                             l2_dists = np.array(
                                 [[np.linalg.norm(action_i - action_j) for action_j in
-                                  self.global_l2_memory_array[self.comp_adversaries[i][0]: self.comp_adversaries[i][1], :, self.step_num]]
+                                  self.l2_memory_tracker.global_mean[self.comp_adversaries[i][0]: self.comp_adversaries[i][1], :, self.step_num]]
                                  for i, action_i in enumerate(action_list)])
                         else:
                             l2_dists = np.array(
-                                [[np.linalg.norm(action_i - action_j) for action_j in self.global_l2_memory_array[:, :, self.step_num]]
+                                [[np.linalg.norm(action_i - action_j) for action_j in self.l2_memory_tracker.global_mean[:, :, self.step_num]]
                                  for action_i in action_list])
                         l2_dists_mean = np.sum(l2_dists)
 
@@ -341,6 +399,8 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
                     reward_dict.update({'adversary{}'.format(self.curr_adversary): adv_reward[self.curr_adversary]})
 
             done_dict = {'__all__': done}
+            if done:
+                self.prepare_next_episode()
             return obs_dict, reward_dict, done_dict, info
         else:
             return ob, reward, done, {}
@@ -358,20 +418,17 @@ class AdvMAHalfCheetahEnv(HalfCheetahEnv, MultiAgentEnv):
 
         curr_obs = {'agent': self.observed_states}
         if self.adversary_range > 0 and self.curr_adversary >= 0:
+            adv_obs = self.get_adv_obs()
             if self.kl_reward or (self.l2_reward and not self.l2_memory):
                 is_active = [1 if i == self.curr_adversary else 0 for i in range(self.adversary_range)]
                 curr_obs.update({
-                    'adversary{}'.format(i): {"obs": self.observed_states, "is_active": np.array([is_active[i]])}
+                    'adversary{}'.format(i): {"obs": adv_obs, "is_active": np.array([is_active[i]])}
                     for i in range(self.adversary_range)})
             else:
                 curr_obs.update({
-                    'adversary{}'.format(self.curr_adversary): self.observed_states
+                    'adversary{}'.format(self.curr_adversary): adv_obs
                 })
 
-            # track how many times each adversary was used
-            if self.l2_memory:
-                self.local_num_observed_l2_samples[self.curr_adversary] += 1
-
         return curr_obs
 
 def cheetah_env_creator(env_config):
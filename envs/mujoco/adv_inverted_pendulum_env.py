@@ -45,8 +45,14 @@ class AdvMAPendulumEnv(InvertedPendulumEnv, MultiAgentEnv):
             self.adversary_range = 0
         else:
             self.adversary_range = self.num_adv_strengths * self.advs_per_strength
+        # every sub-env of a vectorized env has its own stream, it is reproducible if the trainer seed is set
+        self.rng = np.random.RandomState([np.random.randint(2 ** 31), getattr(config, 'worker_index', 0),
+                                          getattr(config, 'vector_index', 0)])
+        # the adversary and dynamics of every episode are only redrawn in training, the evaluation envs keep the ones
+        # they are set up with for all their rollouts, see transfer_tests.reset_env
+        self.train_episodes = True
         if self.adversary_range > 0:
-            self.curr_adversary = np.random.randint(low=0, high=self.adversary_range)
+            self.curr_adversary = self.rng.randint(low=0, high=self.adversary_range)
         else:
             self.curr_adversary = 0
 
@@ -110,10 +116,23 @@ class AdvMAPendulumEnv(InvertedPendulumEnv, MultiAgentEnv):
                 self.adversary_range += 1
                 self.adversary_range = min(self.adversary_range, self.num_adv_strengths * self.advs_per_strength)
 
+    def apply_control(self, msg):
+        """Apply the per iteration control message of the driver, see utils/env_control.py"""
+        if 'mean_rew' in msg:
+            self.update_curriculum(msg['mean_rew'])
+        return None
+
+    def prepare_next_episode(self):
+        """Pick the adversary and the dynamics of the next episode. The env calls it itself on the last step of an
+        episode, so that every sub-env of a vectorized or remote env gets its own"""
+        if not self.train_episodes:
+            return
+        self.select_new_adversary()
+
     def select_new_adversary(self):
         if self.adversary_range > 0:
             # the -1 corresponds to not having any adversary on at all
-            self.curr_adversary = np.random.randint(low=0, high=self.adversary_range)
+            self.curr_adversary = self.rng.randint(low=0, high=self.adversary_range)
 
     def step(self, actions):
         self.step_num += 1
@@ -142,7 +161,7 @@ class AdvMAPendulumEnv(InvertedPendulumEnv, MultiAgentEnv):
         done = not np.isfinite(ob).all() or np.abs(ob[1]) > .2 or self.step_num > self.horizon
         
         if isinstance(actions, dict):
-            info = {'agent': {'agent_reward': reward}}
+            info = {'agent': {'agent_reward': reward, 'num_active_advs': self.adversary_range}}
             obs_dict = {'agent': self.observed_states}
             reward_dict = {'agent': reward}
 
@@ -154,6 +173,8 @@ class AdvMAPendulumEnv(InvertedPendulumEnv, MultiAgentEnv):
                 reward_dict.update({'adversary{}'.format(self.curr_adversary): -reward})
 
             done_dict = {'__all__': done}
+            if done:
+                self.prepare_next_episode()
             return obs_dict, reward_dict, done_dict, info
         else:
             return ob, reward, done, {}     
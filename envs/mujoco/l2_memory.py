@@ -0,0 +1,207 @@
+import numpy as np
+
+# the global mean of every L2Memory shape in this process, see L2Memory
+shared_global_means = {}
+
+
+class L2Memory(object):
+    """Estimate of the mean action of every adversary at every time step, used by the l2 memory reward.
+
+    The env adds every adversary action to a local sum and count for its (adversary, time step). Once per iteration
+    only the touched (adversary, time step) slices are exported to the driver and reset in place. The driver sends
+    back their count weighted mean, which is polyak averaged into the global mean. Cells no adversary visited keep
+    their previous estimate. Everything is stored in float32.
+
+    The global mean is the same for every env, so the envs of a process share a single copy of it. Only the local
+    sums and counts are kept per env. All the envs of a worker are handed the same update, which is applied once.
+
+    Parameters
+    ----------
+    num_adversaries: (int)
+        Number of adversaries
+    action_dim: (int)
+        Dimension of the adversary actions
+    horizon: (int)
+        Maximum episode length, steps are counted from 1
+    target_coeff: (float)
+        Weight of the new mean in the polyak average
+    """
+
+    def __init__(self, num_adversaries, action_dim, horizon, target_coeff):
+        self.target_coeff = target_coeff
+        key = (num_adversaries, action_dim, horizon, target_coeff)
+        if key not in shared_global_means:
+            # indexed as (adversary, action, step) since the reward compares against every adversary at one step
+            shared_global_means[key] = {'global_mean': np.zeros((num_adversaries, action_dim, horizon + 1),
+                                                                dtype=np.float32),
+                                        'last_update': None}
+        self.shared = shared_global_means[key]
+        self.global_mean = self.shared['global_mean']
+        # indexed as (adversary, step, action) so that a touched slice is contiguous
+        self.action_sums = np.zeros((num_adversaries, horizon + 1, action_dim), dtype=np.float32)
+        self.counts = np.zeros((num_adversaries, horizon + 1), dtype=np.int32)
+
+    def record(self, adversary, step_num, action):
+        self.action_sums[adversary, step_num] += action
+        self.counts[adversary, step_num] += 1
+
+    def export(self):
+        """Return the touched slices as (flat (adversary, step) indices, action sums, counts) and reset them"""
+        flat_idx = np.flatnonzero(self.counts)
+        action_sums = self.action_sums.reshape(-1, self.action_sums.shape[-1])
+        counts = self.counts.reshape(-1)
+        stats = (flat_idx.astype(np.int32), action_sums[flat_idx], counts[flat_idx])
+        action_sums[flat_idx] = 0.0
+        counts[flat_idx] = 0
+        return stats
+
+    def update_global(self, mean):
+        """Polyak average the (flat (adversary, step) indices, mean actions) sent by the driver into the global mean"""
+        # another env of this process was handed the same update and already applied it. The reference to the last
+        # update is kept, so a new update can not be a different object at the same address
+        if mean is self.shared['last_update']:
+            return
+        self.shared['last_update'] = mean
+        flat_idx, mean_actions = mean
+        if len(flat_idx) == 0:
+            return
+        adversary, step = np.unravel_index(flat_idx, self.counts.shape)
+        self.global_mean[adversary, :, step] = (1 - self.target_coeff) * self.global_mean[adversary, :, step] \
+            + self.target_coeff * mean_actions
+
+
+class SketchMemory(object):
+    """Bounded memory of what every adversary did in which state, used by the l2 memory reward when
+    l2_memory_type is 'sketch'.
+
+    For every adversary it keeps a reservoir of reservoir_size (observation feature, action) pairs, where the feature
+    is a fixed random projection of the observation to feature_dim dimensions. The reward of the active adversary is
+    the distance of its action to the action each other adversary took at the most similar observation in its
+    reservoir, so unlike L2Memory it compares behavior in similar states instead of at the same time step. Memory and
+    query cost are O(num_adversaries * reservoir_size * (feature_dim + action_dim)) and do not depend on the horizon.
+
+    Each env fills a local reservoir with Algorithm R. The driver merges the local reservoirs of all the envs (see
+    merge_sketch_stats) and mixes them into the global reservoir the rewards are computed against.
+
+    Parameters
+    ----------
+    num_adversaries: (int)
+        Number of adversaries
+    obs_dim: (int)
+        Dimension of the adversary observations
+    action_dim: (int)
+        Dimension of the adversary actions
+    reservoir_size: (int)
+        Number of (feature, action) pairs kept per adversary
+    feature_dim: (int)
+        Dimension of the observation features
+    seed: (int)
+        Seed of the projection, it has to be the same in every env
+    """
+
+    def __init__(self, num_adversaries, obs_dim, action_dim, reservoir_size=256, feature_dim=16, seed=0):
+        self.reservoir_size = reservoir_size
+        self.projection = (np.random.RandomState(seed).normal(size=(obs_dim, feature_dim))
+                           / np.sqrt(feature_dim)).astype(np.float32)
+        self.global_features = np.zeros((num_adversaries, reservoir_size, feature_dim), dtype=np.float32)
+        self.global_actions = np.zeros((num_adversaries, reservoir_size, action_dim), dtype=np.float32)
+        self.global_sizes = np.zeros(num_adversaries, dtype=np.int64)
+        self.local_features = np.zeros((num_adversaries, reservoir_size, feature_dim), dtype=np.float32)
+        self.local_actions = np.zeros((num_adversaries, reservoir_size, action_dim), dtype=np.float32)
+        self.local_seen = np.zeros(num_adversaries, dtype=np.int64)
+        self.rng = np.random.RandomState()
+        self.slots = np.arange(reservoir_size)
+
+    def features(self, obs):
+        return np.asarray(obs, dtype=np.float32).dot(self.projection)
+
+    def record(self, adversary, obs, action):
+        num_seen = self.local_seen[adversary]
+        self.local_seen[adversary] += 1
+        if num_seen < self.reservoir_size:
+            slot = num_seen
+        else:
+            slot = self.rng.randint(num_seen + 1)
+            if slot >= self.reservoir_size:
+                return
+        self.local_features[adversary, slot] = self.features(obs)
+        self.local_actions[adversary, slot] = action
+
+    def distances(self, obs, action, low=0, high=None):
+        """Distance of action to the action of each adversary in [low, high) at its nearest observation to obs.
+        Adversaries with an empty reservoir are at distance 0."""
+        features = self.global_features[low:high]
+        sq_dists = np.sum((features - self.features(obs)) ** 2, axis=-1)
+        sq_dists[self.slots >= self.global_sizes[low:high, np.newaxis]] = np.inf
+        nearest = np.argmin(sq_dists, axis=1)
+        nearest_actions = self.global_actions[low:high][np.arange(len(features)), nearest]
+        dists = np.linalg.norm(nearest_actions - action, axis=-1)
+        return np.where(self.global_sizes[low:high] > 0, dists, 0.0)
+
+    def export(self):
+        """Return the local reservoirs as (features, actions, number of samples seen) and reset them in place"""
+        stats = (self.local_features.copy(), self.local_actions.copy(), self.local_seen.copy())
+        self.local_seen[:] = 0
+        return stats
+
+    def update_global(self, reservoir):
+        """Replace the global reservoirs with the (features, actions, sizes) sent by the driver"""
+        features, actions, sizes = reservoir
+        self.global_features[:] = features
+        self.global_actions[:] = actions
+        self.global_sizes[:] = sizes
+
+
+def merge_sketch_stats(*stats):
+    """Merge the local reservoirs of several envs into one reservoir per adversary that is a uniform sample of all
+    their samples. Each entry of a reservoir stands for seen / size samples of its stream."""
+    stats = [stat for stat in stats if stat is not None]
+    if len(stats) == 0:
+        return None
+    num_adversaries, reservoir_size = stats[0][0].shape[:2]
+    features = np.zeros_like(stats[0][0])
+    actions = np.zeros_like(stats[0][1])
+    seen = np.sum([stat[2] for stat in stats], axis=0)
+    for adversary in range(num_adversaries):
+        sizes = [min(stat[2][adversary], reservoir_size) for stat in stats]
+        if sum(sizes) == 0:
+            continue
+        candidate_features = np.concatenate([stat[0][adversary, :size] for stat, size in zip(stats, sizes)])
+        candidate_actions = np.concatenate([stat[1][adversary, :size] for stat, size in zip(stats, sizes)])
+        weights = np.concatenate([np.full(size, stat[2][adversary] / size) for stat, size in zip(stats, sizes)
+                                  if size > 0])
+        num_chosen = min(reservoir_size, len(candidate_features))
+        chosen = np.random.choice(len(candidate_features), num_chosen, replace=False, p=weights / np.sum(weights))
+        features[adversary, :num_chosen] = candidate_features[chosen]
+        actions[adversary, :num_chosen] = candidate_actions[chosen]
+    return features, actions, seen
+
+
+def update_sketch_reservoir(previous, stats, target_coeff):
+    """Mix the merged reservoirs of the last iteration into the global ones. Empty slots are filled first, then a
+    target_coeff fraction of the global entries is replaced, the reservoir version of polyak averaging.
+
+    Returns the new global (features, actions, sizes)
+    """
+    if stats is None:
+        return previous
+    new_features, new_actions, new_seen = stats
+    reservoir_size = new_features.shape[1]
+    new_sizes = np.minimum(new_seen, reservoir_size)
+    if previous is None:
+        return new_features, new_actions, new_sizes
+    features, actions, sizes = [np.copy(array) for array in previous]
+    for adversary in range(len(sizes)):
+        if new_sizes[adversary] == 0:
+            continue
+        num_empty = reservoir_size - sizes[adversary]
+        num_replaced = min(new_sizes[adversary],
+                           num_empty + max(1, int(round(target_coeff * sizes[adversary]))))
+        # the empty slots are at the end of the reservoir
+        slots = np.concatenate((np.arange(sizes[adversary], reservoir_size),
+                                np.random.permutation(sizes[adversary])))[:num_replaced]
+        chosen = np.random.choice(new_sizes[adversary], num_replaced, replace=False)
+        features[adversary, slots] = new_features[adversary, chosen]
+        actions[adversary, slots] = new_actions[adversary, chosen]
+        sizes[adversary] = min(reservoir_size, sizes[adversary] + max(0, min(num_replaced, num_empty)))
+    return features, actions, sizes
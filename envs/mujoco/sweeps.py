@@ -0,0 +1,14 @@
+"""Mass and friction coefficients of the transfer test grids. They are kept apart from the plotting code so that
+the envs can use them without importing matplotlib"""
+
+import numpy as np
+
+hopper_mass_sweep = np.linspace(.7, 1.3, 11)
+hopper_friction_sweep = np.linspace(0.7, 1.3, 11)
+
+cheetah_mass_sweep = np.linspace(.5, 1.5, 11)
+cheetah_friction_sweep_good = np.linspace(0.5, 1.5, 11)
+cheetah_friction_sweep = np.linspace(0.1, 0.9, 11)
+
+ant_mass_sweep = np.linspace(.5, 1.5, 11)
+ant_friction_sweep = np.linspace(0.1, 0.9, 11)
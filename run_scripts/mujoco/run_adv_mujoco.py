@@ -1,6 +1,7 @@
 from copy import deepcopy
 import errno
 from datetime import datetime
+from functools import partial
 import os
 import subprocess
 import sys
@@ -11,12 +12,12 @@ import pytz
 import ray
 from ray.rllib.agents.ppo.ppo_policy import PPOTFPolicy
 from ray.rllib.agents.ppo.ppo import PPOTrainer, DEFAULT_CONFIG as DEFAULT_PPO_CONFIG
-from ray.rllib.agents.sac.sac import DEFAULT_CONFIG as DEFAULT_SAC_CONFIG
-
-from ray.rllib.agents.ddpg.td3 import TD3_DEFAULT_CONFIG as DEFAULT_TD3_CONFIG
-from ray.rllib.agents.ddpg.ddpg_policy import DDPGTFPolicy
 
 from ray.rllib.models import ModelCatalog
+try:
+    from ray.rllib.agents.agent import get_agent_class
+except ImportError:
+    from ray.rllib.agents.registry import get_agent_class
 from ray import tune
 from ray.tune import Trainable
 from ray.tune.logger import pretty_print
@@ -24,20 +25,17 @@ from ray.tune import run as run_tune
 from ray.tune.registry import register_env
 
 from algorithms.multi_active_ppo import CustomPPOPolicy, CustomPPOTrainer
-from algorithms.custom_kl_distribution import LogitsDist
-from envs.mujoco.adv_hopper import AdvMAHopper
-from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
-from envs.mujoco.adv_cheetah import AdvMAHalfCheetahEnv
-from envs.mujoco.adv_ant import AdvMAAnt
-
-from visualize.mujoco.transfer_tests import run_transfer_tests
-from visualize.mujoco.action_sampler import sample_actions
+
 # from visualize.mujoco.visualize_adversaries import visualize_adversaries
-from utils.pendulum_env_creator import make_create_env
+from utils.env_control import l2_merge_fn, next_global_l2_memory, send_control
+from utils.memory import memory_metrics, record_batch_bytes
 from utils.parsers import init_parser, ray_parser, ma_env_parser
+from utils.policy_checkpoint import with_policy_checkpoints
+from utils.pendulum_env_creator import make_create_env
+from utils.results_store import parse_checkpoint
 from utils.rllib_utils import get_config_from_path
-
-from models.recurrent_tf_model_v2 import LSTM
+from utils.timing import get_iteration_timer, instrument_policies
+from utils.tracing import get_trace_collector, instrument_rollout_worker, span
 
 def setup_ma_config(config, create_env):
     env = create_env(config['env_config'])
@@ -50,6 +48,7 @@ def setup_ma_config(config, create_env):
     adversary_config = {"model": {'fcnet_hiddens': [64, 64], 'use_lstm': False}, "entropy_coeff": config['env_config']['entropy_coeff']}
     if config['env_config']['run'] == 'PPO':
         if config['env_config']['kl_reward']:
+            from algorithms.custom_kl_distribution import LogitsDist
             ModelCatalog.register_custom_action_dist("logits_dist", LogitsDist)
             adversary_config['model']['custom_action_dist'] = "logits_dist"
         # for both of these we need a graph that zeros out agents that weren't active
@@ -63,6 +62,7 @@ def setup_ma_config(config, create_env):
             policy_graphs.update({adv_policies[i]: (PPOTFPolicy, env.adv_observation_space,
                                                     env.adv_action_space, adversary_config) for i in range(num_adversaries)})
     elif config['env_config']['run'] == 'TD3':
+        from ray.rllib.agents.ddpg.ddpg_policy import DDPGTFPolicy
         policy_graphs = {'agent': (DDPGTFPolicy, env.observation_space, env.action_space, {})}
         policy_graphs.update({adv_policies[i]: (DDPGTFPolicy, env.adv_observation_space,
                                                 env.adv_action_space, adversary_config) for i in range(num_adversaries)})
@@ -124,6 +124,13 @@ def setup_exps(args):
                         help='If true we use domain randomization across different joints/links as well')
     parser.add_argument('--cheating', action='store_true', default=False,
                         help='Enabled with domain randomization, will provide the learner with the transfer params.')
+    parser.add_argument('--batch_mode', type=str, default='complete_episodes',
+                        choices=['complete_episodes', 'truncate_episodes'],
+                        help='If truncate_episodes, workers return fragments of rollout_fragment_length steps instead '
+                             'of waiting for their episodes to finish. The reward_range adversaries then also '
+                             'observe the step and the reward so far')
+    parser.add_argument('--rollout_fragment_length', type=int, default=200,
+                        help='Steps per env in each sample call of a worker')
     parser.add_argument('--reward_range', action='store_true', default=False,
                         help='If true, the adversaries try to get agents to goals evenly spaced between `low_reward`'
                              'and `high_reward')
@@ -149,6 +156,15 @@ def setup_exps(args):
     parser.add_argument('--l2_memory_target_coeff', type=float, default=0.05,
                         help='The coefficient used to update the running mean if l2_memory is true. '
                              '1 / this value sets an approximate time scale for updating. Keep it nice and low.')
+    parser.add_argument('--l2_memory_type', type=str, default='mean', choices=['mean', 'sketch'],
+                        help='If mean, the l2 memory diffs against the mean action of the other adversaries at the '
+                             'same time step. If sketch, against the action they took in the most similar state, '
+                             'from a fixed size reservoir of samples per adversary')
+    parser.add_argument('--l2_sketch_size', type=int, default=256,
+                        help='Samples kept per adversary if l2_memory_type is sketch. Memory and the cost of the '
+                             'l2 reward grow linearly with it')
+    parser.add_argument('--l2_sketch_feature_dim', type=int, default=16,
+                        help='Dimension of the random projection of the observations compared by the sketch')
 
     parser.add_argument('--kl_reward', action='store_true', default=False,
                         help='If true, each adversary gets a reward for being close to the adversaries in '
@@ -164,6 +180,44 @@ def setup_exps(args):
     parser.add_argument('--clip_actions', action='store_true', default=False,
                         help='If true, the sum of the adversary and agent actions is clipped')
 
+    parser.add_argument('--eval_transfer_workers', type=int, default=0,
+                        help='If positive, this many actors evaluate the transfer robustness of the policy during '
+                             'training and report it as transfer_score in the result')
+    parser.add_argument('--eval_transfer_cells', type=int, default=11,
+                        help='Number of cells of the mass / friction grid evaluated each iteration')
+    parser.add_argument('--eval_transfer_rollouts', type=int, default=2,
+                        help='Rollouts per transfer test evaluated during training')
+    parser.add_argument('--eval_stop_score', type=float, default=None,
+                        help='If set, training stops once the transfer_score reaches this value')
+    parser.add_argument('--preloaded_sgd', action='store_true', default=False,
+                        help='If true, PPO loads the train batch of every policy into the graph once per iteration '
+                             'and gathers the minibatches in graph, see algorithms/preloaded_sgd.py')
+    parser.add_argument('--parallel_policy_learners', type=int, default=1,
+                        help='With --preloaded_sgd, how many policies are trained at the same time. The cores of '
+                             'the driver are split between them')
+    parser.add_argument('--policy_checkpoints', action='store_true', default=False,
+                        help='If true, checkpoints store every policy in its own file and only rewrite the '
+                             'policies that changed, see utils/policy_checkpoint.py')
+    parser.add_argument('--keep_checkpoints_num', type=int, default=None,
+                        help='If set, only this many checkpoints are kept, the ones with the best transfer_score '
+                             'if the transfer robustness is evaluated during training')
+
+    parser.add_argument('--driver_rss_limit_gb', type=float, default=None,
+                        help='If set, a breakdown of the memory is printed when the driver uses more than this')
+    parser.add_argument('--worker_rss_limit_gb', type=float, default=None,
+                        help='If set, a breakdown of the memory is printed when a rollout worker uses more than this')
+    parser.add_argument('--policy_batch_limit_gb', type=float, default=None,
+                        help='If set, a breakdown of the memory is printed when the samples of a policy in an '
+                             'iteration are larger than this')
+    parser.add_argument('--object_store_limit_gb', type=float, default=None,
+                        help='If set, a breakdown of the memory is printed when the object stores use more than this')
+
+    parser.add_argument('--trace', action='store_true', default=False,
+                        help='If true, spans of the driver, the rollout workers and the transfer evaluators are '
+                             'written to trace.json in the trial dir, see utils/tracing.py')
+    parser.add_argument('--trace_sample_every', type=int, default=100,
+                        help='Only one in this many env steps and action computations is traced')
+
     parser.add_argument('--lambda_val', type=float, default=0.9,
                         help='PPO lambda value')
     parser.add_argument('--lr', type=float, default=5e-4,
@@ -181,6 +235,12 @@ def setup_exps(args):
         sys.exit('Your number of adversaries per reward range must match the total number of adversaries')
     if args.grid_search and args.seed_search:
         sys.exit('You can\'t both sweed seeds and grid search')
+    if args.preloaded_sgd and (args.algorithm != 'PPO' or args.use_lstm or args.alternate_training):
+        sys.exit('The preloaded sgd is only supported for PPO without an LSTM or alternate training')
+    if args.parallel_policy_learners > 1 and not args.preloaded_sgd:
+        sys.exit('The policies can only be trained in parallel with --preloaded_sgd')
+    if args.eval_stop_score is not None and args.eval_transfer_workers <= 0:
+        sys.exit('--eval_stop_score needs the transfer_score of --eval_transfer_workers > 0')
 
     alg_run = args.algorithm
 
@@ -221,9 +281,11 @@ def setup_exps(args):
             config['sgd_minibatch_size'] *= 5
         config['num_sgd_iter'] = 10
     elif args.algorithm == 'SAC':
+        from ray.rllib.agents.sac.sac import DEFAULT_CONFIG as DEFAULT_SAC_CONFIG
         config = DEFAULT_SAC_CONFIG
         config['target_network_update_freq'] = 1
     elif args.algorithm == 'TD3':
+        from ray.rllib.agents.ddpg.td3 import TD3_DEFAULT_CONFIG as DEFAULT_TD3_CONFIG
         config = DEFAULT_TD3_CONFIG
         # === Exploration ===
         config['learning_starts'] = 10000
@@ -246,7 +308,11 @@ def setup_exps(args):
 
     # Universal hyperparams
     config['num_workers'] = args.num_cpus
-    config["batch_mode"] = "complete_episodes"
+    config['num_envs_per_worker'] = args.num_envs_per_worker
+    config['remote_worker_envs'] = args.remote_worker_envs
+    config["batch_mode"] = args.batch_mode
+    # with truncate_episodes PPO bootstraps the value of the last observation of every fragment
+    config['sample_batch_size'] = args.rollout_fragment_length
 
     # config['num_adversaries'] = args.num_adv
     # config['kl_diff_weight'] = args.kl_diff_weight
@@ -257,6 +323,7 @@ def setup_exps(args):
     config['env_config']['advs_per_strength'] = args.advs_per_strength
     config['env_config']['adversary_strength'] = args.adv_strength
     config['env_config']['reward_range'] = args.reward_range
+    config['env_config']['adv_obs_reward_state'] = args.batch_mode == 'truncate_episodes'
     config['env_config']['num_adv_rews'] = args.num_adv_rews
     config['env_config']['advs_per_rew'] = args.advs_per_rew
 
@@ -277,13 +344,27 @@ def setup_exps(args):
     config['env_config']['l2_in_tranche'] = args.l2_in_tranche
     config['env_config']['l2_memory'] = args.l2_memory
     config['env_config']['l2_memory_target_coeff'] = args.l2_memory_target_coeff
+    config['env_config']['l2_memory_type'] = args.l2_memory_type
+    config['env_config']['l2_sketch_size'] = args.l2_sketch_size
+    config['env_config']['l2_sketch_feature_dim'] = args.l2_sketch_feature_dim
     config['env_config']['no_end_if_fall'] = args.no_end_if_fall
     config['env_config']['adv_all_actions'] = args.adv_all_actions
     config['env_config']['entropy_coeff'] = args.entropy_coeff
     config['env_config']['clip_actions'] = args.clip_actions
 
     config['env_config']['run'] = alg_run
+    config['env_config']['eval_transfer_workers'] = args.eval_transfer_workers
+    config['env_config']['eval_transfer_cells'] = args.eval_transfer_cells
+    config['env_config']['eval_transfer_rollouts'] = args.eval_transfer_rollouts
+    config['env_config']['trace'] = {'enabled': args.trace, 'sample_every': args.trace_sample_every}
+    config['env_config']['memory_limits'] = {
+        'driver_rss': args.driver_rss_limit_gb,
+        'worker_rss': args.worker_rss_limit_gb,
+        'policy_batch': args.policy_batch_limit_gb,
+        'object_store': args.object_store_limit_gb,
+    }
 
+    from models.recurrent_tf_model_v2 import LSTM
     ModelCatalog.register_custom_model("rnn", LSTM)
     config['model']['fcnet_hiddens'] = [64, 64]
     if args.use_lstm:
@@ -295,18 +376,22 @@ def setup_exps(args):
     if args.env_name == "pendulum":
         env_name = "MAPendulumEnv"
         env_tag = "pendulum"
+        from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
         create_env_fn = make_create_env(AdvMAPendulumEnv)
     elif args.env_name == "hopper":
         env_name = "MAHopperEnv"
         env_tag = "hopper"
+        from envs.mujoco.adv_hopper import AdvMAHopper
         create_env_fn = make_create_env(AdvMAHopper)
     elif args.env_name == "cheetah":
         env_name = "MACheetahEnv"
         env_tag = "cheetah"
+        from envs.mujoco.adv_cheetah import AdvMAHalfCheetahEnv
         create_env_fn = make_create_env(AdvMAHalfCheetahEnv)
     elif args.env_name == "ant":
         env_name = "MAAntEnv"
         env_tag = "ant"
+        from envs.mujoco.adv_ant import AdvMAAnt
         create_env_fn = make_create_env(AdvMAAnt)
 
     config['env'] = env_name
@@ -316,7 +401,9 @@ def setup_exps(args):
 
     # add the callbacks
     config["callbacks"] = {"on_train_result": on_train_result,
-                           "on_episode_end": on_episode_end}
+                           "on_episode_start": on_episode_start,
+                           "on_episode_end": on_episode_end,
+                           "on_sample_end": on_sample_end}
 
     # create a custom string that makes looking at the experiment names easier
     def trial_str_creator(trial):
@@ -326,6 +413,15 @@ def setup_exps(args):
         runner = CustomPPOTrainer
     else:
         runner = args.algorithm
+    if args.preloaded_sgd:
+        from algorithms.preloaded_sgd import thread_pool_session_args, with_preloaded_sgd
+        runner = with_preloaded_sgd(get_agent_class(runner) if isinstance(runner, str) else runner,
+                                    args.parallel_policy_learners)
+        if args.parallel_policy_learners > 1:
+            config['local_tf_session_args'] = thread_pool_session_args(args.parallel_policy_learners,
+                                                                       psutil.cpu_count())
+    if args.policy_checkpoints:
+        runner = with_policy_checkpoints(get_agent_class(runner) if isinstance(runner, str) else runner)
 
     stop_dict = {}
     if args.algorithm == 'PPO':
@@ -336,68 +432,91 @@ def setup_exps(args):
         stop_dict.update({
             'timesteps_total': args.num_iters * 10000
         })
+    if args.eval_stop_score is not None:
+        stop_dict['transfer_score'] = args.eval_stop_score
 
     exp_dict = {
         'name': args.exp_title,
         'run_or_experiment': runner,
         'trial_name_creator': trial_str_creator,
-        # 'checkpoint_freq': args.checkpoint_freq,
+        # checkpoints are only saved during training if they are evaluated as they appear
+        'checkpoint_freq': args.checkpoint_freq if args.eval_during_training else 0,
         'checkpoint_at_end': True,
         'stop': stop_dict,
         'config': config,
         'num_samples': args.num_samples,
+        'keep_checkpoints_num': args.keep_checkpoints_num,
     }
+    if args.eval_transfer_workers > 0:
+        exp_dict['checkpoint_score_attr'] = 'transfer_score'
     return exp_dict, args
 
 
 def on_train_result(info):
-    """Store the mean score of the episode, and increment or decrement how many adversaries are on"""
+    """Send the envs the mean score of the agent for the curriculum and the new global state of the l2 memory,
+    in a single control message per worker. Also adds the timing and memory of the iteration and writes its trace,
+    see utils/timing.py, utils/memory.py and utils/tracing.py"""
     result = info["result"]
-
-    if 'policy_reward_mean' in result.keys() and result["config"]["env_config"]["curriculum"]:
-        if 'agent' in result['policy_reward_mean'].keys():
-            pendulum_reward = result['policy_reward_mean']['agent']
-            trainer = info["trainer"]
-
-            trainer.workers.foreach_worker(
-                lambda ev: ev.foreach_env(
-                    lambda env: env.update_curriculum(pendulum_reward)))
-
-    if info["result"]["config"]["env_config"]["l2_memory"]:
-        trainer = info["trainer"]
-        outputs = trainer.workers.foreach_worker(
-            lambda ev: ev.foreach_env(
-                lambda env: env.get_observed_samples()))
-        result_vec = np.zeros(outputs[0][0][0].shape)
-        counts_vec = np.zeros(outputs[0][0][1].shape)
-        # compute the mean weighted by how much each action was seen. We don't need to reweight the mean_vec,
-        # it's already weighted in the env
-        for output in outputs:
-            mean_vec, counts = output[0]
-            result_vec += mean_vec
-            counts_vec += counts
-        mean_result_vec = np.zeros(result_vec.shape)
-        for i, row in enumerate(result_vec):
-            if counts_vec[i] > 0:
-                mean_result_vec[i] = row / counts_vec[i]
-        trainer.workers.foreach_worker(
-            lambda ev: ev.foreach_env(
-                lambda env: env.update_global_action_mean(mean_result_vec)))
+    trainer = info["trainer"]
+    env_config = result["config"]["env_config"]
+    timer = get_iteration_timer(trainer)
+    trace_collector = get_trace_collector(trainer, env_config.get("trace"))
+
+    with timer.time('control'), span('control', 'driver'):
+        msg = {}
+        if 'policy_reward_mean' in result.keys() and env_config["curriculum"]:
+            if 'agent' in result['policy_reward_mean'].keys():
+                msg['mean_rew'] = result['policy_reward_mean']['agent']
+
+        if env_config["l2_memory"]:
+            # the statistics sent back by the previous message were merged in the object store while this
+            # iteration was sampled, so the global memory lags by an iteration
+            if getattr(trainer, 'pending_l2_stats', None) is not None:
+                trainer.global_l2_memory = next_global_l2_memory(getattr(trainer, 'global_l2_memory', None),
+                                                                 ray.get(trainer.pending_l2_stats), env_config)
+                msg['global_l2_memory'] = trainer.global_l2_memory
+            trainer.pending_l2_stats = send_control(trainer.workers, msg, l2_merge_fn(env_config))
+        elif len(msg) > 0:
+            send_control(trainer.workers, msg)
+
+    if env_config.get("eval_transfer_workers", 0) > 0:
+        with timer.time('robustness_eval'), span('robustness_eval', 'driver'):
+            if not hasattr(trainer, 'robustness_evaluator'):
+                from visualize.mujoco.robustness_eval import RobustnessEvaluator
+                from visualize.mujoco.transfer_tests import transfer_lists
+                run_list, test_list = transfer_lists.get(result["config"]["env"], ([], []))
+                trainer.robustness_evaluator = RobustnessEvaluator(trainer.config, run_list, test_list,
+                                                                   env_config["eval_transfer_workers"],
+                                                                   env_config["eval_transfer_cells"],
+                                                                   env_config["eval_transfer_rollouts"])
+            result.update(trainer.robustness_evaluator.step(trainer))
+
+    with span('telemetry', 'driver'):
+        result['memory'] = memory_metrics(trainer, env_config.get("memory_limits"))
+        result['timing'] = timer.collect(result)
+    if trace_collector is not None:
+        evaluators = trainer.robustness_evaluator.evaluators if hasattr(trainer, 'robustness_evaluator') else []
+        trace_collector.collect(evaluators)
+
+
+def on_episode_start(info):
+    """Time and trace the postprocessing of every policy of this worker"""
+    instrument_policies(info["policy"])
+    instrument_rollout_worker(info["env"], info["policy"])
 
 
 def on_episode_end(info):
-    """Select the currently active adversary"""
+    """Store how many adversaries are active. The envs select their next adversary and dynamics themselves, see
+    prepare_next_episode, so this works for any num_envs_per_worker and for remote envs"""
+    episode = info["episode"]
+    agent_info = episode.last_info_for('agent')
+    if agent_info is not None and 'num_active_advs' in agent_info:
+        episode.custom_metrics["num_active_advs"] = agent_info['num_active_advs']
+
 
-    # store info about how many adversaries there are
-    if hasattr(info["env"], 'envs'):
-        env = info["env"].envs[0]
-        env.select_new_adversary()
-        if hasattr(env, 'domain_randomization') and env.domain_randomization:
-            env.randomize_domain()
-        elif hasattr(env, 'extreme_domain_randomization') and env.extreme_domain_randomization:
-            env.extreme_randomize_domain()
-        episode = info["episode"]
-        episode.custom_metrics["num_active_advs"] = env.adversary_range
+def on_sample_end(info):
+    """Record the size of the sample batch of every policy"""
+    record_batch_bytes(info["samples"])
 
 
 class AlternateTraining(Trainable):
@@ -433,6 +552,29 @@ class AlternateTraining(Trainable):
         return self.agent_trainer._save(tmp_checkpoint_dir)
 
 
+def checkpoint_output_path(output_path, checkpoint_path, tune_name):
+    """Folder of the transfer test results of a checkpoint, so the checkpoints of every trial do not overwrite each
+    other's files"""
+    return os.path.join(output_path, tune_name, 'checkpoint_{}'.format(parse_checkpoint(checkpoint_path)))
+
+
+def transfer_test_checkpoint(config, checkpoint_path, tune_name, args, output_path, num_evaluators=None):
+    """Run the validation and test transfer tests of a checkpoint and add them to the results store. The rows of the
+    store are tagged with the trial and the iteration of the checkpoint, see run_transfer_tests"""
+    from visualize.mujoco.transfer_tests import run_transfer_tests, transfer_lists
+    run_list, test_list = transfer_lists.get(config['env'], ([], []))
+    min_rollouts = 5 if args.adaptive_transfer_tests else None
+    results_store = os.path.expanduser(args.transfer_results_store)
+    outdir = checkpoint_output_path(output_path, checkpoint_path, tune_name)
+    run_transfer_tests(config, checkpoint_path, 20, args.exp_title, outdir, run_list=run_list,
+                       num_evaluators=num_evaluators, min_rollouts=min_rollouts, crn_seed=args.transfer_crn_seed,
+                       results_store=results_store)
+    if len(test_list) > 0:
+        run_transfer_tests(config, checkpoint_path, 20, args.exp_title, outdir, run_list=test_list, is_test=True,
+                           num_evaluators=num_evaluators, min_rollouts=min_rollouts,
+                           crn_seed=args.transfer_crn_seed, results_store=results_store)
+
+
 if __name__ == "__main__":
 
     exp_dict, args = setup_exps(sys.argv[1:])
@@ -453,9 +595,7 @@ if __name__ == "__main__":
 
     if args.alternate_training:
         exp_dict['run_or_experiment'] = AlternateTraining
-    run_tune(**exp_dict, queue_trials=False, raise_on_failed_trial=False)
 
-    # Now we add code to loop through the results and create scores of the results
     if args.run_transfer_tests:
         output_path = os.path.join(os.path.join(os.path.expanduser('~/transfer_results/adv_robust'), date), args.exp_title)
         if not os.path.exists(output_path):
@@ -464,51 +604,53 @@ if __name__ == "__main__":
             except OSError as exc:
                 if exc.errno != errno.EEXIST:
                     raise
-        for (dirpath, dirnames, filenames) in os.walk(os.path.expanduser("~/ray_results")):
-            # if "checkpoint_{}".format(args.num_iters) in dirpath:
-            if "checkpoint" in dirpath and dirpath.split('/')[-3] == args.exp_title:
-
-                # grab the experiment name
-                folder = os.path.dirname(dirpath)
-                tune_name = folder.split("/")[-1]
-                outer_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                script_path = os.path.expanduser(os.path.join(outer_folder, "visualize/transfer_test.py"))
-                config, checkpoint_path = get_config_from_path(folder, dirpath.split('_')[-1])
-
-                test_list = []
-                if config['env'] == "MAPendulumEnv":
-                    from visualize.mujoco.transfer_tests import pendulum_run_list
-                    run_list = pendulum_run_list
-                elif config['env'] == "MAHopperEnv":
-                    from visualize.mujoco.transfer_tests import hopper_run_list, hopper_test_list
-                    run_list = hopper_run_list
-                    test_list = hopper_test_list
-                elif config['env'] == "MACheetahEnv":
-                    from visualize.mujoco.transfer_tests import cheetah_run_list, cheetah_test_list
-                    run_list = cheetah_run_list
-                    test_list = cheetah_test_list
-                elif config['env'] == "MAAntEnv":
-                    from visualize.mujoco.transfer_tests import ant_run_list, ant_test_list
-                    run_list = ant_run_list
-                    test_list = ant_test_list
-
-                ray.shutdown()
-                ray.init()
-                run_transfer_tests(config, checkpoint_path, 20, args.exp_title, output_path, run_list=run_list)
-                if len(test_list) > 0:
-                    run_transfer_tests(config, checkpoint_path, 20, args.exp_title, output_path, run_list=test_list, is_test=True)
-
-                sample_actions(config, checkpoint_path, min(2 * args.train_batch_size, 20000), output_path)
-
-                if args.use_s3:
-                    # visualize_adversaries(config, checkpoint_path, 10, 100, output_path)
-                    for i in range(4):
-                        try:
-                            p1 = subprocess.Popen("aws s3 sync {} {}".format(output_path,
-                                                                             "s3://sim2real/transfer_results/adv_robust/{}/{}/{}".format(date,
-                                                                                                                              args.exp_title,
-                                                                                                                              tune_name)).split(
-                                ' '))
-                            p1.wait(50)
-                        except Exception as e:
-                            print('This is the error ', e)
+
+    watcher = None
+    if args.run_transfer_tests and args.eval_during_training:
+        from visualize.mujoco.checkpoint_watcher import CheckpointWatcher
+        watcher = CheckpointWatcher(os.path.join(os.path.expanduser('~/ray_results'), args.exp_title),
+                                    partial(transfer_test_checkpoint, args=args, output_path=output_path,
+                                            num_evaluators=args.eval_num_evaluators),
+                                    poll_interval=args.eval_poll_interval)
+        watcher.start()
+
+    run_tune(**exp_dict, queue_trials=False, raise_on_failed_trial=False)
+
+    # Now we add code to loop through the results and create scores of the results
+    if args.run_transfer_tests:
+        if watcher is not None:
+            # the watcher evaluates the checkpoints saved at the end of training before it stops
+            watcher.stop()
+            checkpoints = watcher.evaluated
+        else:
+            checkpoints = []
+            for (dirpath, dirnames, filenames) in os.walk(os.path.expanduser("~/ray_results")):
+                # if "checkpoint_{}".format(args.num_iters) in dirpath:
+                if "checkpoint" in dirpath and dirpath.split('/')[-3] == args.exp_title:
+                    # grab the experiment name
+                    folder = os.path.dirname(dirpath)
+                    tune_name = folder.split("/")[-1]
+                    config, checkpoint_path = get_config_from_path(folder, dirpath.split('_')[-1])
+
+                    ray.shutdown()
+                    ray.init()
+                    transfer_test_checkpoint(config, checkpoint_path, tune_name, args, output_path)
+                    checkpoints.append((config, checkpoint_path, tune_name))
+
+        from visualize.mujoco.action_sampler import sample_actions
+        for config, checkpoint_path, tune_name in checkpoints:
+            sample_actions(config, checkpoint_path, min(2 * args.train_batch_size, 20000),
+                           checkpoint_output_path(output_path, checkpoint_path, tune_name))
+
+            if args.use_s3:
+                # visualize_adversaries(config, checkpoint_path, 10, 100, output_path)
+                for i in range(4):
+                    try:
+                        p1 = subprocess.Popen("aws s3 sync {} {}".format(os.path.join(output_path, tune_name),
+                                                                         "s3://sim2real/transfer_results/adv_robust/{}/{}/{}".format(date,
+                                                                                                                          args.exp_title,
+                                                                                                                          tune_name)).split(
+                            ' '))
+                        p1.wait(50)
+                    except Exception as e:
+                        print('This is the error ', e)
@@ -147,18 +147,16 @@ def on_train_result(info):
 
 
 def on_episode_end(info):
-    """Select the currently active adversary"""
+    """Store how many adversaries are active. The envs select their next adversary themselves, see
+    prepare_next_episode"""
+    episode = info["episode"]
 
-    # store info about how many adversaries there are
-    if hasattr(info["env"], 'envs'):
-        env = info["env"].envs[0]
-        episode = info["episode"]
+    # if env.prediction_reward and env.adversary_range > 1:
+    #     episode.custom_metrics["predict_frac"] = env.num_correct_predict / episode.length
 
-        # if env.prediction_reward and env.adversary_range > 1:
-        #     episode.custom_metrics["predict_frac"] = env.num_correct_predict / episode.length
-
-        # select a new adversary every episode. Currently disabled.
-        env.select_new_adversary()
+    agent_info = episode.last_info_for('agent')
+    if agent_info is not None and 'num_active_advs' in agent_info:
+        episode.custom_metrics["num_active_advs"] = agent_info['num_active_advs']
 
 
 if __name__ == "__main__":
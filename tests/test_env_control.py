@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ray')
+
+from envs.mujoco.l2_memory import merge_sketch_stats
+from utils.env_control import global_action_mean, l2_merge_fn, next_global_l2_memory, sum_l2_stats
+
+
+def test_sum_l2_stats_adds_the_shared_cells():
+    first = (np.array([1, 4], dtype=np.int32), np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32),
+             np.array([1, 2]))
+    second = (np.array([4, 7], dtype=np.int32), np.array([[5.0, 6.0], [7.0, 8.0]], dtype=np.float32),
+              np.array([3, 1]))
+    flat_idx, action_sums, counts = sum_l2_stats(first, None, second)
+    np.testing.assert_array_equal(flat_idx, [1, 4, 7])
+    np.testing.assert_allclose(action_sums, [[1.0, 2.0], [8.0, 10.0], [7.0, 8.0]])
+    np.testing.assert_array_equal(counts, [1, 5, 1])
+
+
+def test_sum_l2_stats_skips_envs_without_statistics():
+    empty = (np.zeros(0, dtype=np.int32), np.zeros((0, 2), dtype=np.float32), np.zeros(0))
+    assert sum_l2_stats() is None
+    assert sum_l2_stats(None, empty) is None
+    stats = (np.array([2], dtype=np.int32), np.ones((1, 2), dtype=np.float32), np.array([3]))
+    flat_idx, action_sums, counts = sum_l2_stats(empty, stats)
+    np.testing.assert_array_equal(flat_idx, [2])
+    np.testing.assert_array_equal(counts, [3])
+
+
+def test_sum_l2_stats_is_associative():
+    rng = np.random.RandomState(0)
+    stats = [(np.sort(rng.choice(20, 5, replace=False)).astype(np.int32),
+              rng.normal(size=(5, 3)).astype(np.float32), rng.randint(1, 5, size=5)) for _ in range(4)]
+    flat = sum_l2_stats(*stats)
+    tree = sum_l2_stats(sum_l2_stats(*stats[:2]), sum_l2_stats(*stats[2:]))
+    np.testing.assert_array_equal(flat[0], tree[0])
+    np.testing.assert_allclose(flat[1], tree[1], rtol=1e-6)
+    np.testing.assert_array_equal(flat[2], tree[2])
+
+
+def test_global_action_mean_is_count_weighted():
+    stats = (np.array([3], dtype=np.int32), np.array([[6.0, 3.0]], dtype=np.float32), np.array([3]))
+    flat_idx, mean_actions = next_global_l2_memory(None, stats, {'l2_memory_type': 'mean'})
+    np.testing.assert_array_equal(flat_idx, [3])
+    np.testing.assert_allclose(mean_actions, [[2.0, 1.0]])
+    assert mean_actions.dtype == np.float32
+    assert global_action_mean(None) is None
+
+
+def test_l2_merge_fn_follows_the_memory_type():
+    assert l2_merge_fn({}) is sum_l2_stats
+    assert l2_merge_fn({'l2_memory_type': 'sketch'}) is merge_sketch_stats
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+from envs.mujoco import l2_memory
+from envs.mujoco.l2_memory import L2Memory, SketchMemory, merge_sketch_stats, update_sketch_reservoir
+
+
+@pytest.fixture(autouse=True)
+def clear_shared_global_means():
+    l2_memory.shared_global_means.clear()
+    yield
+    l2_memory.shared_global_means.clear()
+
+
+def test_export_returns_the_touched_cells_and_resets_them():
+    memory = L2Memory(2, 2, 5, 0.5)
+    memory.record(0, 1, np.array([1.0, 2.0]))
+    memory.record(0, 1, np.array([3.0, 4.0]))
+    memory.record(1, 3, np.array([5.0, 6.0]))
+    flat_idx, action_sums, counts = memory.export()
+    np.testing.assert_array_equal(flat_idx, [1, 6 + 3])
+    np.testing.assert_allclose(action_sums, [[4.0, 6.0], [5.0, 6.0]])
+    np.testing.assert_array_equal(counts, [2, 1])
+    assert not memory.counts.any()
+    assert not memory.action_sums.any()
+    assert len(memory.export()[0]) == 0
+
+
+def test_update_global_polyak_averages_the_visited_cells():
+    memory = L2Memory(2, 2, 5, 0.25)
+    memory.update_global((np.array([1, 9]), np.array([[4.0, 8.0], [-4.0, 0.0]], dtype=np.float32)))
+    np.testing.assert_allclose(memory.global_mean[0, :, 1], [1.0, 2.0])
+    np.testing.assert_allclose(memory.global_mean[1, :, 3], [-1.0, 0.0])
+    memory.update_global((np.array([1]), np.array([[4.0, 8.0]], dtype=np.float32)))
+    np.testing.assert_allclose(memory.global_mean[0, :, 1], [1.75, 3.5])
+    # cells no adversary visited keep their estimate
+    np.testing.assert_allclose(memory.global_mean[1, :, 3], [-1.0, 0.0])
+    assert memory.global_mean.dtype == np.float32
+
+
+def test_count_weighted_update_of_several_envs():
+    memories = [L2Memory(1, 1, 3, 1.0) for _ in range(2)]
+    # a long episode visits step 2 three times in one env, a short one once in the other
+    for action in (1.0, 1.0, 1.0):
+        memories[0].record(0, 2, np.array([action]))
+    memories[1].record(0, 2, np.array([5.0]))
+    stats = [memory.export() for memory in memories]
+    flat_idx = np.concatenate([stat[0] for stat in stats])
+    assert np.all(flat_idx == flat_idx[0])
+    action_sums = sum(stat[1] for stat in stats)
+    counts = sum(stat[2] for stat in stats)
+    memories[0].update_global((flat_idx[:1], action_sums / counts[:, np.newaxis]))
+    np.testing.assert_allclose(memories[0].global_mean[0, :, 2], [2.0])
+
+
+def test_global_mean_is_shared_and_updated_once_per_process():
+    memories = [L2Memory(2, 2, 5, 0.5) for _ in range(3)]
+    assert all(memory.global_mean is memories[0].global_mean for memory in memories)
+    update = (np.array([2]), np.array([[2.0, 2.0]], dtype=np.float32))
+    for memory in memories:
+        memory.update_global(update)
+    np.testing.assert_allclose(memories[2].global_mean[0, :, 2], [1.0, 1.0])
+    # the next iteration sends a new update with the same values, which is applied again
+    update = (np.array([2]), np.array([[2.0, 2.0]], dtype=np.float32))
+    for memory in memories:
+        memory.update_global(update)
+    np.testing.assert_allclose(memories[0].global_mean[0, :, 2], [1.5, 1.5])
+    # only the global mean is shared
+    memories[0].record(0, 1, np.ones(2))
+    assert memories[1].counts.sum() == 0
+    assert L2Memory(3, 2, 5, 0.5).global_mean is not memories[0].global_mean
+
+
+def make_reservoir(num_adversaries, size, seen, value, feature_dim=2, action_dim=1):
+    """A local reservoir whose entries are all value"""
+    features = np.zeros((num_adversaries, size, feature_dim), dtype=np.float32)
+    actions = np.zeros((num_adversaries, size, action_dim), dtype=np.float32)
+    features[:, :min(seen, size)] = value
+    actions[:, :min(seen, size)] = value
+    return features, actions, np.full(num_adversaries, seen)
+
+
+def test_sketch_reservoir_keeps_a_bounded_sample():
+    memory = SketchMemory(2, 3, 1, reservoir_size=4, feature_dim=2)
+    for step in range(10):
+        memory.record(0, np.ones(3), np.array([step]))
+    features, actions, seen = memory.export()
+    np.testing.assert_array_equal(seen, [10, 0])
+    assert features.shape == (2, 4, 2)
+    assert len(set(actions[0, :, 0])) == 4
+    assert set(actions[0, :, 0]) <= set(range(10))
+    assert not memory.local_seen.any()
+
+
+def test_sketch_distances_use_the_nearest_observation():
+    memory = SketchMemory(2, 2, 1, reservoir_size=2, feature_dim=2)
+    memory.projection = np.eye(2, dtype=np.float32)
+    memory.update_global((np.array([[[0.0, 0.0], [5.0, 5.0]], [[0.0, 0.0], [0.0, 0.0]]], dtype=np.float32),
+                          np.array([[[1.0], [10.0]], [[0.0], [0.0]]], dtype=np.float32), np.array([2, 0])))
+    # the second adversary has an empty reservoir
+    np.testing.assert_allclose(memory.distances(np.array([4.0, 4.0]), np.array([7.0])), [3.0, 0.0])
+    np.testing.assert_allclose(memory.distances(np.array([0.5, 0.0]), np.array([7.0]), high=1), [6.0])
+
+
+def test_merge_sketch_stats_weights_the_envs_by_samples_seen():
+    np.random.seed(0)
+    assert merge_sketch_stats(None) is None
+    # one env saw 100 samples of value 1, the other only 4 of value 2, both fill a reservoir of 4
+    features, actions, seen = merge_sketch_stats(make_reservoir(1, 4, 100, 1.0), None, make_reservoir(1, 4, 4, 2.0))
+    np.testing.assert_array_equal(seen, [104])
+    assert actions.shape == (1, 4, 1)
+    num_heavy = []
+    for _ in range(200):
+        _, actions, _ = merge_sketch_stats(make_reservoir(1, 4, 100, 1.0), make_reservoir(1, 4, 4, 2.0))
+        num_heavy.append(np.sum(actions == 1.0))
+    # every reservoir entry of the first env stands for 25 samples, one of the second env for 1
+    assert np.mean(num_heavy) > 3.5
+
+
+def test_merge_sketch_stats_with_few_samples_keeps_all_of_them():
+    features, actions, seen = merge_sketch_stats(make_reservoir(2, 4, 1, 1.0), make_reservoir(2, 4, 2, 2.0))
+    np.testing.assert_array_equal(seen, [3, 3])
+    np.testing.assert_array_equal(np.sort(actions[0, :3, 0]), [1.0, 2.0, 2.0])
+    np.testing.assert_array_equal(actions[0, 3], [0.0])
+
+
+def test_update_sketch_reservoir_fills_empty_slots_then_replaces_a_fraction():
+    np.random.seed(0)
+    assert update_sketch_reservoir('previous', None, 0.5) == 'previous'
+    first = update_sketch_reservoir(None, make_reservoir(1, 8, 3, 1.0), 0.5)
+    np.testing.assert_array_equal(first[2], [3])
+
+    second = update_sketch_reservoir(first, make_reservoir(1, 8, 8, 2.0), 0.25)
+    features, actions, sizes = second
+    np.testing.assert_array_equal(sizes, [8])
+    # the 5 empty slots are filled and round(0.25 * 3) = 1 of the old entries is replaced
+    np.testing.assert_array_equal(np.sort(actions[0, :, 0]), [1.0, 1.0] + [2.0] * 6)
+    # the previous reservoir is not changed in place
+    np.testing.assert_array_equal(first[1][0, :3, 0], [1.0, 1.0, 1.0])
+
+    third = update_sketch_reservoir(second, make_reservoir(1, 8, 8, 3.0), 0.25)
+    np.testing.assert_array_equal(third[2], [8])
+    assert np.sum(third[1] == 3.0) == 2
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+
+from utils.results_index import INDEX_FILE_NAME, ResultsIndex, index_folder, load_index_file, save_index_file
+
+
+class CountingLoader(object):
+    """np.loadtxt that remembers which files it loaded"""
+
+    def __init__(self):
+        self.loaded = []
+
+    def __call__(self, path):
+        self.loaded.append(os.path.basename(path))
+        return np.loadtxt(path)
+
+
+def write_result(folder, file_name, rewards):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    np.savetxt(os.path.join(folder, file_name), rewards)
+
+
+def make_experiment(root):
+    folder = os.path.join(root, 'exp')
+    trial = os.path.join(folder, 'PPO_0_seed=1_x')
+    write_result(os.path.join(trial, 'checkpoint_10'), 'exp_base_rew.txt', [1.0, 1.0])
+    write_result(os.path.join(trial, 'checkpoint_20'), 'exp_base_rew.txt', [2.0, 4.0])
+    write_result(os.path.join(trial, 'checkpoint_20'), 'exp_m_1.0_f_0.5_rew.txt', [3.0])
+    write_result(os.path.join(trial, 'checkpoint_20'), 'exp_mean_sweep_rew.txt', [[2.0, 1.0, 1.0, 0.0]])
+    write_result(os.path.join(folder, 'PPO_1_seed=2_y'), 'exp_base_rew.txt', [6.0])
+    return folder
+
+
+def test_index_folder_reads_the_latest_checkpoint(tmp_path):
+    folder = make_experiment(str(tmp_path))
+    summary = index_folder(folder)
+    assert list(summary.keys()) == [os.path.join('PPO_0_seed=1_x', 'checkpoint_20', 'exp_base_rew.txt'),
+                                    os.path.join('PPO_0_seed=1_x', 'checkpoint_20', 'exp_m_1.0_f_0.5_rew.txt'),
+                                    os.path.join('PPO_1_seed=2_y', 'exp_base_rew.txt')]
+    assert summary[os.path.join('PPO_0_seed=1_x', 'checkpoint_20', 'exp_base_rew.txt')] == \
+        (1, 'exp_base_rew.txt', 3.0, 1.0, 2)
+    assert summary[os.path.join('PPO_1_seed=2_y', 'exp_base_rew.txt')][0] == 2
+    assert [entry[2] for entry in index_folder(folder, checkpoint=10).values()] == [1.0]
+    assert len(index_folder(folder, checkpoint=None)) == 4
+
+
+def test_sidecar_only_reloads_changed_files(tmp_path):
+    folder = make_experiment(str(tmp_path))
+    loader = CountingLoader()
+    index_folder(folder, loader)
+    assert len(loader.loaded) == 4
+    assert os.path.exists(os.path.join(folder, INDEX_FILE_NAME))
+
+    loader = CountingLoader()
+    index_folder(folder, loader)
+    assert loader.loaded == []
+
+    changed = os.path.join(folder, 'PPO_1_seed=2_y', 'exp_base_rew.txt')
+    np.savetxt(changed, [8.0, 10.0])
+    loader = CountingLoader()
+    summary = index_folder(folder, loader)
+    assert loader.loaded == ['exp_base_rew.txt']
+    assert summary[os.path.join('PPO_1_seed=2_y', 'exp_base_rew.txt')][2:] == (9.0, 1.0, 2)
+
+    os.remove(changed)
+    assert os.path.join('PPO_1_seed=2_y', 'exp_base_rew.txt') not in index_folder(folder)
+    assert len(load_index_file(os.path.join(folder, INDEX_FILE_NAME))) == 3
+
+
+def test_sidecar_of_another_version_is_rebuilt(tmp_path):
+    folder = make_experiment(str(tmp_path))
+    index_path = os.path.join(folder, INDEX_FILE_NAME)
+    index_folder(folder)
+    entries = load_index_file(index_path)
+    assert len(entries) == 4
+    with np.load(index_path) as data:
+        arrays = dict(data)
+    arrays['version'] = -1
+    np.savez(index_path, **arrays)
+    assert load_index_file(index_path) == {}
+    loader = CountingLoader()
+    index_folder(folder, loader)
+    assert len(loader.loaded) == 4
+
+    # the sidecar is written with a temporary file and replaces the old one
+    save_index_file(index_path, entries)
+    assert load_index_file(index_path) == entries
+    assert sorted(os.listdir(folder)) == sorted(['PPO_0_seed=1_x', 'PPO_1_seed=2_y', INDEX_FILE_NAME])
+
+
+def test_persist_false_does_not_write_a_sidecar(tmp_path):
+    folder = make_experiment(str(tmp_path))
+    index_folder(folder, persist=False)
+    assert not os.path.exists(os.path.join(folder, INDEX_FILE_NAME))
+
+
+def test_results_index_matches_test_names(tmp_path):
+    folder = make_experiment(str(tmp_path))
+    results_index = ResultsIndex()
+    assert sorted(results_index.test_means(folder, ['m_1.0_f_0.5', 'base'])) == [(1, 0, 3.0), (1, 1, 3.0),
+                                                                                 (2, 1, 6.0)]
+    assert list(ResultsIndex(checkpoint=10).test_means(folder, ['base'])) == [(1, 0, 1.0)]
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from utils.results_store import ResultsStore, filter_checkpoints, import_results_tree, match_test_index, \
+    parse_checkpoint, parse_result_dir, parse_seed, parse_test_name, parse_trial
+
+
+def test_parse_names():
+    assert parse_test_name('base') == (1.0, 1.0)
+    assert parse_test_name('m_0.76_f_0.7') == (0.76, 0.7)
+    assert parse_test_name('friction_hard_torso') == (None, None)
+    assert parse_seed('PPO_0_seed=3_2020-05-25') == 3
+    assert parse_seed('PPO_0_2020-05-25') is None
+    checkpoint = '/results/PPO_0_seed=3_x/checkpoint_350/checkpoint-350'
+    assert parse_checkpoint(checkpoint) == 350
+    assert parse_trial(checkpoint) == 'PPO_0_seed=3_x'
+    assert parse_trial('/results/model.pkl') == ''
+
+
+def test_match_test_index():
+    test_names = ['base', 'm_1.0_f_0.5']
+    assert match_test_index('exp_base_rew.txt', test_names) == 0
+    assert match_test_index('exp_m_1.0_f_0.5_rew.txt', test_names) == 1
+    assert match_test_index('exp_base_rew.png', test_names) is None
+    assert match_test_index('exp_mean_sweep_rew.txt', test_names) is None
+
+
+def test_parse_result_dir():
+    assert parse_result_dir(os.path.join('PPO_0_seed=3_x', 'checkpoint_20')) == ('PPO_0_seed=3_x', 3, 20)
+    assert parse_result_dir('PPO_0_seed=3_x') == ('PPO_0_seed=3_x', 3, None)
+    assert parse_result_dir('.') == ('', None, None)
+
+
+def test_filter_checkpoints():
+    found = [('a', 10), ('a', 20), ('b', None), ('c', None), ('c', 5)]
+    assert filter_checkpoints(found) == {('a', 20), ('b', None), ('c', 5)}
+    assert filter_checkpoints(found, 10) == {('a', 10)}
+    assert filter_checkpoints(found, None) == set(found)
+
+
+def test_latest_checkpoint_of_every_trial(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    store.add_rollouts('exp', 1, 10, 'base', [1.0, 1.0], trial='a')
+    store.add_rollouts('exp', 1, 20, 'base', [2.0, 2.0], trial='a')
+    # a second trial of the grid search with the same seed and an older last checkpoint
+    store.add_rollouts('exp', 1, 15, 'base', [5.0, 5.0], trial='b')
+    store.add_rollouts('other', 1, 30, 'base', [9.0], trial='a')
+    latest = store.load_rewards('exp')
+    assert list(latest.keys()) == [('a', 1, 'base'), ('b', 1, 'base')]
+    np.testing.assert_array_equal(latest[('a', 1, 'base')], [2.0, 2.0])
+    np.testing.assert_array_equal(latest[('b', 1, 'base')], [5.0, 5.0])
+    np.testing.assert_array_equal(store.load_rewards('exp', checkpoint=10)[('a', 1, 'base')], [1.0, 1.0])
+    assert sum(n for _, _, n in store.load_test_summary('exp', checkpoint=None).values()) == 6
+    mean, std, n = store.load_test_summary('exp')[('a', 1, 'base')]
+    assert (mean, std, n) == (2.0, 0.0, 2)
+
+
+def test_rerun_replaces_the_rollouts(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    store.add_rollouts('exp', 1, 10, 'base', [1.0, 2.0, 3.0], steps=[10, 20, 30])
+    store.add_rollouts('exp', 1, 10, 'base', [4.0, 5.0], steps=[40, 50])
+    np.testing.assert_array_equal(store.load_rewards('exp')[('', 1, 'base')], [4.0, 5.0])
+    assert store.load_test_means('exp')[('', 1)]['base'] == (4.5, 0.5, 45.0, 5.0)
+
+
+def test_rewards_are_indexed_by_rollout(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    store.add_rollouts('exp', 1, 10, 'base', [1.0, 2.0, 3.0])
+    store.conn.execute('DELETE FROM rollouts WHERE rollout = 1')
+    rewards = store.load_rewards('exp')[('', 1, 'base')]
+    assert rewards[0] == 1.0 and np.isnan(rewards[1]) and rewards[2] == 3.0
+
+
+def test_migrate_a_store_without_trials(tmp_path):
+    path = str(tmp_path / 'results.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE rollouts (experiment TEXT NOT NULL, seed INTEGER, checkpoint INTEGER, '
+                 'test TEXT NOT NULL, mass REAL, friction REAL, rollout INTEGER NOT NULL, reward REAL NOT NULL, '
+                 'steps REAL)')
+    # the second run of the test was added again on top of the first one
+    rows = [('exp', 1, None, 'base', 1.0, 1.0, rollout, reward, None)
+            for reward in (1.0, 2.0) for rollout in range(2)]
+    conn.executemany('INSERT INTO rollouts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+    store = ResultsStore(path)
+    np.testing.assert_array_equal(store.load_rewards('exp')[('', 1, 'base')], [2.0, 2.0])
+    store.add_rollouts('exp', 1, None, 'base', [3.0, 3.0])
+    np.testing.assert_array_equal(store.load_rewards('exp')[('', 1, 'base')], [3.0, 3.0])
+    store.close()
+    # opening a migrated store again changes nothing
+    store = ResultsStore(path)
+    assert store.conn.execute('SELECT COUNT(*) FROM rollouts').fetchone()[0] == 2
+
+
+def test_cached_tests_round_trip(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    assert store.get_cached('key') is None
+    store.put_cached('key', np.array([1.5, 2.5]), np.array([100, 200]))
+    store.put_cached('no_steps', [3.0])
+    store.close()
+
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    rewards, steps = store.get_cached('key')
+    np.testing.assert_array_equal(rewards, [1.5, 2.5])
+    np.testing.assert_array_equal(steps, [100, 200])
+    rewards, steps = store.get_cached('no_steps')
+    np.testing.assert_array_equal(rewards, [3.0])
+    assert steps is None
+
+
+def write_result(folder, file_name, rewards):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    np.savetxt(os.path.join(folder, file_name), rewards)
+
+
+def test_import_results_tree(tmp_path):
+    for checkpoint in (10, 20):
+        folder = os.path.join(str(tmp_path), 'exp', 'PPO_0_seed=1_x', 'checkpoint_{}'.format(checkpoint))
+        write_result(folder, 'exp_base_rew.txt', [checkpoint, checkpoint])
+        write_result(folder, 'exp_mean_sweep_rew.txt', [[1.0, 0.0, 1.0, 0.0]])
+    old_folder = os.path.join(str(tmp_path), 'old', 'PPO_0_seed=2_y')
+    write_result(old_folder, 'old_base_rew.txt', [7.0])
+    write_result(old_folder, 'old_mean_sweep_rew.txt', [[7.0, 0.0, 1.0, 0.0]])
+
+    store = ResultsStore(':memory:')
+    import_results_tree(str(tmp_path), store)
+    rows = store.conn.execute('SELECT experiment, trial, seed, checkpoint, test, COUNT(*) FROM rollouts '
+                              'GROUP BY experiment, trial, seed, checkpoint, test ORDER BY experiment').fetchall()
+    assert rows == [('exp', 'PPO_0_seed=1_x', 1, 20, 'base', 2), ('old', 'PPO_0_seed=2_y', 2, None, 'base', 1)]
+
+    store = ResultsStore(':memory:')
+    import_results_tree(str(tmp_path), store, test_names=['base'], checkpoint=None)
+    checkpoints = store.conn.execute('SELECT DISTINCT checkpoint FROM rollouts WHERE experiment = ?', ('exp',))
+    assert sorted(row[0] for row in checkpoints) == [10, 20]
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ray.rllib')
+
+from ray.rllib.policy.sample_batch import DEFAULT_POLICY_ID
+
+from visualize.mujoco.run_rollout import run_batched_rollouts
+
+
+class CountdownEnv(object):
+    """Single agent env whose episodes last length steps"""
+
+    def __init__(self, length):
+        self.length = length
+        self.t = 0
+
+    def seed(self, seed):
+        pass
+
+    def reset(self):
+        self.t = 0
+        return np.zeros(1)
+
+    def step(self, action):
+        self.t += 1
+        return np.zeros(1), 1.0, self.t >= self.length, {'agent': {'agent_reward': 1.0}}
+
+    def close(self):
+        pass
+
+
+class IdentityPreprocessor(object):
+    def transform(self, obs):
+        return obs
+
+
+class ZeroPolicy(object):
+    def compute_actions(self, obs_batch, prev_action_batch=None, prev_reward_batch=None):
+        return np.zeros((len(obs_batch), 1)), [], {}
+
+
+class FakeWorker(object):
+    preprocessors = {DEFAULT_POLICY_ID: IdentityPreprocessor()}
+    filters = {DEFAULT_POLICY_ID: lambda obs, update=False: obs}
+
+
+class FakeWorkerSet(object):
+    def local_worker(self):
+        return FakeWorker()
+
+
+class FakeAgent(object):
+    config = {'clip_actions': False}
+    workers = FakeWorkerSet()
+
+    def get_policy(self, policy_id):
+        return ZeroPolicy()
+
+
+def make_env_makers(num_rollouts):
+    """One test whose rollout k lasts num_rollouts - k steps, so the later rollouts finish first"""
+    num_made = [0]
+
+    def make_env():
+        num_made[0] += 1
+        return CountdownEnv(num_rollouts - num_made[0] + 1)
+    return [make_env]
+
+
+@pytest.mark.parametrize('rollout_offset', [0, 3])
+def test_results_are_ordered_by_rollout_index(rollout_offset):
+    num_rollouts = 5
+    results = run_batched_rollouts(make_env_makers(num_rollouts), FakeAgent(), False,
+                                   lambda agent_id: DEFAULT_POLICY_ID, {DEFAULT_POLICY_ID: np.zeros(1)},
+                                   num_rollouts, rollout_offset=rollout_offset)
+    rewards, step_nums = results[0]
+    assert step_nums == [5, 4, 3, 2, 1]
+    assert rewards == [5.0, 4.0, 3.0, 2.0, 1.0]
+
+
+def test_results_are_ordered_with_fewer_slots_than_rollouts():
+    rewards, step_nums = run_batched_rollouts(make_env_makers(4), FakeAgent(), False,
+                                              lambda agent_id: DEFAULT_POLICY_ID, {DEFAULT_POLICY_ID: np.zeros(1)},
+                                              4, max_batch_envs=2)[0]
+    assert step_nums == [4, 3, 2, 1]
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from utils.stats import bootstrap_ci, bootstrap_seed_means, check_rollout_coverage, nan_mean, paired_bootstrap_ci, \
+    paired_differences, rank_probabilities, seed_means
+
+
+def test_nan_mean_ignores_missing_values():
+    values = np.array([[1.0, np.nan, 3.0], [np.nan, np.nan, np.nan]])
+    means = nan_mean(values, axis=1)
+    assert means[0] == 2.0
+    assert np.isnan(means[1])
+
+
+def test_seed_means_reduces_the_rollouts():
+    rewards = np.full((1, 2, 1, 3), np.nan)
+    rewards[0, 0, 0] = [1.0, 2.0, 3.0]
+    rewards[0, 1, 0, :2] = [4.0, 6.0]
+    np.testing.assert_allclose(seed_means(rewards)[0, :, 0], [2.0, 5.0])
+    with pytest.raises(ValueError):
+        seed_means(np.zeros(3))
+
+
+def test_bootstrap_ci_brackets_the_mean_across_seeds():
+    means = np.random.RandomState(0).normal(10.0, 1.0, size=(1, 30, 1))
+    estimate, lower, upper = bootstrap_ci(means, num_resamples=500, seed=0)
+    assert estimate[0, 0] == pytest.approx(np.mean(means))
+    assert lower[0, 0] < estimate[0, 0] < upper[0, 0]
+    # the 95% interval of the mean of 30 seeds with unit spread is about +-0.36
+    assert 0.2 < upper[0, 0] - lower[0, 0] < 1.2
+
+
+def test_bootstrap_ci_is_degenerate_for_identical_seeds():
+    estimate, lower, upper = bootstrap_ci(np.full((2, 4, 3), 5.0), num_resamples=100, avg_across_tests=True, seed=0)
+    np.testing.assert_allclose(estimate, [5.0, 5.0])
+    np.testing.assert_allclose(lower, [5.0, 5.0])
+    np.testing.assert_allclose(upper, [5.0, 5.0])
+
+
+def test_bootstrap_is_reproducible_and_skips_missing_experiments():
+    means = np.random.RandomState(1).normal(size=(2, 5, 2))
+    means[1] = np.nan
+    first = bootstrap_seed_means(means, num_resamples=50, seed=3)
+    np.testing.assert_array_equal(first, bootstrap_seed_means(means, num_resamples=50, seed=3))
+    assert not np.any(np.isnan(first[0]))
+    assert np.all(np.isnan(first[1]))
+
+
+def test_paired_differences_difference_rollout_by_rollout():
+    rewards = np.zeros((2, 1, 1, 3))
+    rewards[0, 0, 0] = [1.0, 5.0, 9.0]
+    rewards[1, 0, 0] = [2.0, 6.0, 10.0]
+    np.testing.assert_allclose(paired_differences(rewards)[:, 0, 0], [0.0, 1.0])
+
+
+def test_paired_differences_use_the_rollouts_present_in_both():
+    rewards = np.full((2, 1, 1, 4), np.nan)
+    rewards[0, 0, 0] = [1.0, 1.0, 1.0, 1.0]
+    rewards[1, 0, 0, :2] = [3.0, 5.0]
+    assert paired_differences(rewards)[1, 0, 0] == pytest.approx(3.0)
+
+
+def test_paired_differences_refuse_rollouts_with_a_gap():
+    rewards = np.full((2, 1, 1, 3), np.nan)
+    rewards[0, 0, 0] = [1.0, 2.0, 3.0]
+    rewards[1, 0, 0] = [1.0, np.nan, 3.0]
+    with pytest.raises(ValueError):
+        paired_differences(rewards)
+    # the baseline is checked as well
+    with pytest.raises(ValueError):
+        check_rollout_coverage(rewards, baseline_idx=1)
+
+
+def test_rollout_coverage_ignores_seeds_that_are_not_paired():
+    rewards = np.full((2, 2, 1, 3), np.nan)
+    rewards[0, 0, 0] = [1.0, 2.0, 3.0]
+    rewards[1, 0, 0] = [1.0, 2.0, 3.0]
+    # only the second experiment has the second seed, so the gap is never paired
+    rewards[1, 1, 0] = [np.nan, 2.0, np.nan]
+    check_rollout_coverage(rewards)
+
+
+def test_paired_bootstrap_ci_of_a_constant_improvement():
+    rewards = np.random.RandomState(2).normal(size=(1, 6, 2, 5))
+    rewards = np.concatenate([rewards, rewards + 2.0])
+    estimate, lower, upper, prob_better = paired_bootstrap_ci(rewards, num_resamples=200, seed=0)
+    np.testing.assert_allclose(estimate, [0.0, 2.0])
+    np.testing.assert_allclose(lower, [0.0, 2.0])
+    np.testing.assert_allclose(upper, [0.0, 2.0])
+    np.testing.assert_allclose(prob_better, [0.0, 1.0])
+
+
+def test_rank_probabilities_of_well_separated_experiments():
+    rng = np.random.RandomState(4)
+    means = np.stack([rng.normal(loc, 0.1, size=(8, 2)) for loc in (0.0, 10.0, 5.0)])
+    probs = rank_probabilities(means, num_resamples=200, seed=0)
+    np.testing.assert_allclose(probs.sum(axis=1), 1.0)
+    np.testing.assert_allclose(probs.sum(axis=0), 1.0)
+    np.testing.assert_allclose(probs, [[0, 0, 1], [1, 0, 0], [0, 1, 0]])
+
+
+def test_rank_probabilities_put_missing_experiments_last():
+    means = np.ones((2, 3, 1))
+    means[0] = np.nan
+    np.testing.assert_allclose(rank_probabilities(means, num_resamples=20, seed=0), [[0, 1], [1, 0]])
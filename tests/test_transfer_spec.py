@@ -0,0 +1,65 @@
+import json
+import pickle
+
+import numpy as np
+
+from visualize.mujoco.transfer_spec import TransferSpec, make_fric_hard_spec, make_grid_spec
+
+
+class FakeModel(object):
+    def __init__(self):
+        self.body_names = ('world', 'torso', 'thigh')
+        self.body_mass = np.array([0.0, 3.0, 4.0])
+        self.geom_friction = np.array([[1.0, 0.1, 0.1], [0.9, 0.1, 0.1]])
+
+
+class FakeEnv(object):
+    """Just the parameters of a mujoco env that a TransferSpec sets"""
+
+    def __init__(self):
+        self.model = FakeModel()
+
+
+def test_apply_sets_parameters_relative_to_the_original_ones():
+    env = FakeEnv()
+    spec = make_grid_spec(0.5, 2.0)
+    spec.apply(env)
+    np.testing.assert_allclose(env.model.body_mass, [0.0, 1.5, 4.0])
+    np.testing.assert_allclose(env.model.geom_friction[:, 0], [2.0, 1.8])
+    # applying it again is the same as applying it once
+    spec.apply(env)
+    np.testing.assert_allclose(env.model.body_mass, [0.0, 1.5, 4.0])
+    np.testing.assert_allclose(env.model.geom_friction[:, 0], [2.0, 1.8])
+
+
+def test_apply_resets_what_the_spec_does_not_set():
+    env = FakeEnv()
+    TransferSpec('heavy', mass_coefs={'thigh': 2.0}, env_attrs={'curr_adversary': 3}).apply(env)
+    make_fric_hard_spec('fric_hard', 3.0, 0.5, [1]).apply(env)
+    np.testing.assert_allclose(env.model.body_mass, [0.0, 3.0, 4.0])
+    np.testing.assert_allclose(env.model.geom_friction[:, 0], [0.5, 2.7])
+    assert env.curr_adversary == 3
+
+
+def test_key_ignores_the_name():
+    assert make_grid_spec(0.5, 2.0).key() == TransferSpec('other', mass_coefs={'torso': 0.5},
+                                                          friction_coefs=2.0).key()
+    assert make_grid_spec(0.5, 2.0).key() != make_grid_spec(0.5, 1.0).key()
+    assert make_grid_spec(0.5, 2.0) != TransferSpec('other', mass_coefs={'torso': 0.5}, friction_coefs=2.0)
+
+
+def test_dict_round_trip():
+    spec = TransferSpec('hard', mass_coefs={'torso': 1.5}, friction_coefs=0.5, geom_friction_coefs={2: 3.0},
+                        adv_num=4, env_attrs={'horizon': 100})
+    restored = TransferSpec.from_dict(json.loads(json.dumps(spec.to_dict())))
+    assert restored == spec
+    assert hash(restored) == hash(spec)
+    assert restored.key() == spec.key()
+    assert restored.geom_friction_coefs == {'2': 3.0}
+    assert pickle.loads(pickle.dumps(spec)) == spec
+
+
+def test_grid_coefs():
+    assert make_grid_spec(0.5, 2.0).grid_coefs() == (0.5, 2.0)
+    assert TransferSpec('base').grid_coefs() == (1.0, 1.0)
+    assert make_fric_hard_spec('fric_hard', 3.0, 0.5, [1]).grid_coefs() == (None, None)
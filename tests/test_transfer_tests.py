@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+ray = pytest.importorskip('ray')
+pytest.importorskip('ray.rllib')
+
+from visualize.mujoco.transfer_spec import TransferSpec
+from visualize.mujoco.transfer_tests import confidence_interval, hash_checkpoint_files, run_adaptive_tests_on_pool, \
+    run_tests_on_pool
+
+
+@pytest.fixture(scope='module', autouse=True)
+def local_ray():
+    ray.init(local_mode=True, num_cpus=1, include_webui=False)
+    yield
+    ray.shutdown()
+
+
+def rollout_reward(test_name, rollout):
+    """Reward of rollout number rollout of a test"""
+    if test_name == 'constant':
+        return 10.0
+    if test_name == 'noisy':
+        return 0.0 if rollout % 2 == 0 else 20.0
+    if test_name == 'bad':
+        return -100.0 + rollout % 2
+    raise ValueError(test_name)
+
+
+@ray.remote
+class FakeEvaluator(object):
+    """Stands in for TransferTestEvaluator, every rollout reward is a function of the test and the rollout index"""
+
+    def run_tests(self, tests, num_rollouts, render=False, max_batch_envs=256, crn_seed=None, rollout_offset=0):
+        results = []
+        for spec in tests:
+            rollouts = range(rollout_offset, rollout_offset + num_rollouts)
+            results.append(([rollout_reward(spec.name, rollout) for rollout in rollouts], [100] * num_rollouts))
+        return results
+
+
+def record_results(saved):
+    def save_fn(spec, rewards, step_num):
+        saved[spec.name] = list(rewards)
+        return np.mean(rewards), np.std(rewards), np.mean(step_num), np.std(step_num)
+    return save_fn
+
+
+def test_confidence_interval():
+    assert confidence_interval([3.0]) == (-np.inf, np.inf)
+    lower, upper = confidence_interval([1.0, 3.0])
+    assert (lower + upper) / 2 == pytest.approx(2.0)
+    assert (upper - lower) / 2 == pytest.approx(1.96)
+    assert confidence_interval([5.0, 5.0, 5.0]) == (5.0, 5.0)
+
+
+def test_fixed_budget_runs_every_test_in_order():
+    saved = {}
+    tests = [TransferSpec('noisy'), TransferSpec('constant'), TransferSpec('bad')]
+    output, used = run_tests_on_pool([FakeEvaluator.remote() for _ in range(2)], tests, 4, record_results(saved))
+    assert used == [4, 4, 4]
+    assert [row[0] for row in output] == [10.0, 10.0, -99.5]
+    assert saved['noisy'] == [0.0, 20.0, 0.0, 20.0]
+
+
+def test_adaptive_stops_tight_tests_early():
+    saved = {}
+    tests = [TransferSpec('noisy'), TransferSpec('constant')]
+    output, used = run_adaptive_tests_on_pool([FakeEvaluator.remote()], tests, 11, record_results(saved),
+                                              min_rollouts=3, round_size=4, rel_tol=0.05)
+    assert used == [11, 3]
+    # the rounds continue the rollout indices, so the rewards are those of rollouts 0..10
+    assert saved['noisy'] == [rollout_reward('noisy', rollout) for rollout in range(11)]
+    assert output[1][0] == 10.0
+
+
+def test_adaptive_stops_dominated_tests():
+    tests = [TransferSpec('noisy'), TransferSpec('bad')]
+    _, used = run_adaptive_tests_on_pool([FakeEvaluator.remote()], tests, 11, record_results({}), min_rollouts=3,
+                                         round_size=4, rel_tol=0.001, dominance_margin=10.0)
+    assert used == [11, 3]
+    _, used = run_adaptive_tests_on_pool([FakeEvaluator.remote()], tests, 11, record_results({}), min_rollouts=3,
+                                         round_size=4, rel_tol=0.001)
+    assert used == [11, 11]
+
+
+def test_checkpoint_hash_ignores_the_checkpoint_number():
+    files = {'checkpoint-10': b'weights', 'checkpoint-10.tune_metadata': b'meta'}
+    renamed = {'checkpoint-20': b'weights', 'checkpoint-20.tune_metadata': b'meta'}
+    assert hash_checkpoint_files(files, 'checkpoint-10') == hash_checkpoint_files(renamed, 'checkpoint-20')
+
+
+def test_checkpoint_hash_depends_on_names_and_boundaries():
+    files = {'checkpoint-10': b'ab', 'checkpoint-10.tune_metadata': b'c'}
+    assert hash_checkpoint_files(files, 'checkpoint-10') != \
+        hash_checkpoint_files({'checkpoint-10': b'a', 'checkpoint-10.tune_metadata': b'bc'}, 'checkpoint-10')
+    assert hash_checkpoint_files(files, 'checkpoint-10') != \
+        hash_checkpoint_files({'checkpoint-10': b'ab', 'checkpoint-10.other': b'c'}, 'checkpoint-10')
@@ -0,0 +1,81 @@
+"""Per iteration control messages from the driver to the envs of every rollout worker.
+
+Once per training iteration the driver sends each worker a single message, a dict that can hold
+    mean_rew: the mean agent reward, used by the adversary curriculum
+    global_l2_memory: the new global state of the l2 memory, see envs/mujoco/l2_memory.py
+Each env applies it in apply_control and returns the l2 memory statistics it collected since the previous message.
+For the per time step mean these are only the (adversary, time step) cells that were visited, for the sketch the
+local reservoirs. The statistics of all the workers are merged by a tree of remote tasks, so they never pass through
+the driver as one array per env. Only the final merge is fetched, one iteration later, to build the next
+global_l2_memory.
+"""
+
+import numpy as np
+import ray
+
+from envs.mujoco.l2_memory import merge_sketch_stats, update_sketch_reservoir
+
+
+def sum_l2_stats(*stats):
+    """Sum the sparse l2 statistics of several envs, see envs/mujoco/l2_memory.py. Each one is a tuple of
+    (flat (adversary, step) indices, action sums, counts) and the envs and workers that have none are skipped."""
+    stats = [stat for stat in stats if stat is not None and len(stat[0]) > 0]
+    if len(stats) == 0:
+        return None
+    flat_idx, inverse = np.unique(np.concatenate([stat[0] for stat in stats]), return_inverse=True)
+    action_sums = np.zeros((len(flat_idx), stats[0][1].shape[1]), dtype=np.float32)
+    np.add.at(action_sums, inverse, np.concatenate([stat[1] for stat in stats]))
+    counts = np.bincount(inverse, weights=np.concatenate([stat[2] for stat in stats]), minlength=len(flat_idx))
+    return flat_idx, action_sums, counts.astype(np.int64)
+
+
+@ray.remote
+def reduce_l2_stats(merge_fn, *stats):
+    return merge_fn(*stats)
+
+
+def l2_merge_fn(env_config):
+    """The function that merges the l2 statistics of several envs for the l2_memory_type of env_config"""
+    if env_config.get('l2_memory_type', 'mean') == 'sketch':
+        return merge_sketch_stats
+    return sum_l2_stats
+
+
+def tree_reduce(object_ids, merge_fn=sum_l2_stats, fanin=4):
+    """Merge the l2 statistics behind object_ids with a tree of reduce tasks and return the id of the total"""
+    while len(object_ids) > 1:
+        object_ids = [reduce_l2_stats.remote(merge_fn, *object_ids[i:i + fanin])
+                      for i in range(0, len(object_ids), fanin)]
+    return object_ids[0]
+
+
+def apply_control_to_worker(worker, msg, merge_fn=sum_l2_stats):
+    stats = worker.foreach_env(lambda env: env.apply_control(msg))
+    return merge_fn(*stats)
+
+
+def send_control(workers, msg, merge_fn=sum_l2_stats):
+    """Send msg to the envs of every worker without waiting for them.
+
+    Actor calls run in submission order, so the envs see the message before the next sample call. Returns the object
+    id of the l2 statistics of all the envs, merged by merge_fn.
+    """
+    stats_ids = [ray.put(apply_control_to_worker(workers.local_worker(), msg, merge_fn))]
+    stats_ids += [worker.apply.remote(apply_control_to_worker, msg, merge_fn) for worker in workers.remote_workers()]
+    return tree_reduce(stats_ids, merge_fn)
+
+
+def global_action_mean(stats):
+    """The count weighted mean action of every (adversary, step) in the summed l2 statistics, as the
+    (flat indices, mean actions) that L2Memory.update_global expects"""
+    if stats is None:
+        return None
+    flat_idx, action_sums, counts = stats
+    return flat_idx, (action_sums / counts[:, np.newaxis]).astype(np.float32)
+
+
+def next_global_l2_memory(previous, stats, env_config):
+    """The global_l2_memory to send with the next message, given the one sent last and the merged statistics"""
+    if env_config.get('l2_memory_type', 'mean') == 'sketch':
+        return update_sketch_reservoir(previous, stats, env_config['l2_memory_target_coeff'])
+    return global_action_mean(stats)
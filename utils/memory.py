@@ -0,0 +1,111 @@
+"""Memory telemetry of a training run, exported as result['memory'].
+
+Every iteration on_train_result measures
+    driver_rss_gb: resident memory of the driver
+    worker_rss_gb: resident memory of the rollout workers, max, mean and total
+    batch_gb_per_policy: size of the sample batches of every policy collected this iteration, summed over the
+        workers. The size of every column is recorded by on_sample_end on the workers
+    object_store_gb: memory used by the object stores, summed over the nodes. The plasma store keeps its objects in
+        /dev/shm, so this is the usage of /dev/shm of every node with a worker or the driver on it
+The soft limits in env_config['memory_limits'] only print a breakdown of the memory (every worker, the largest columns
+of every policy batch) when they are exceeded, so the run can be resized before it runs out of memory.
+"""
+
+from collections import defaultdict
+import os
+import platform
+
+import numpy as np
+import psutil
+import ray
+from ray.rllib.policy.sample_batch import DEFAULT_POLICY_ID
+
+GB = float(1 << 30)
+SHM_DIR = '/dev/shm'
+
+# bytes of every (policy, column) sampled in this process since the last call of worker_memory_stats
+_batch_bytes = defaultdict(lambda: defaultdict(int))
+
+
+def record_batch_bytes(samples):
+    """Add the size of every column of samples, a SampleBatch or MultiAgentBatch"""
+    policy_batches = getattr(samples, 'policy_batches', {DEFAULT_POLICY_ID: samples})
+    for policy_id, batch in policy_batches.items():
+        for column, value in batch.data.items():
+            _batch_bytes[policy_id][column] += getattr(value, 'nbytes', 0)
+
+
+def node_memory_stats():
+    stats = {'node': platform.node(), 'rss': psutil.Process().memory_info().rss, 'shm': 0}
+    if os.path.isdir(SHM_DIR):
+        stats['shm'] = psutil.disk_usage(SHM_DIR).used
+    return stats
+
+
+def worker_memory_stats(worker=None):
+    """Memory of this process and the batch sizes recorded since the last call, which are reset. Takes the worker to
+    be used with worker.apply"""
+    stats = node_memory_stats()
+    stats['batch_bytes'] = {policy_id: dict(columns) for policy_id, columns in _batch_bytes.items()}
+    _batch_bytes.clear()
+    return stats
+
+
+def format_breakdown(driver_stats, worker_stats, batch_bytes):
+    lines = ['  driver rss {:.2f} GB on {}'.format(driver_stats['rss'] / GB, driver_stats['node'])]
+    for i, stats in sorted(enumerate(worker_stats), key=lambda item: -item[1]['rss']):
+        lines.append('  worker {} rss {:.2f} GB on {}'.format(i + 1, stats['rss'] / GB, stats['node']))
+    for policy_id, columns in sorted(batch_bytes.items(), key=lambda item: -sum(item[1].values())):
+        lines.append('  policy {} batch {:.3f} GB'.format(policy_id, sum(columns.values()) / GB))
+        for column, num_bytes in sorted(columns.items(), key=lambda item: -item[1])[:5]:
+            lines.append('    {} {:.3f} GB'.format(column, num_bytes / GB))
+    return '\n'.join(lines)
+
+
+def memory_metrics(trainer, limits=None):
+    """Measure the memory of the driver and the workers of trainer, print a breakdown if one of the soft limits is
+    exceeded and return the metrics to add to the result.
+
+    Parameters
+    ----------
+    trainer: (Trainer)
+        The trainer whose workers are measured
+    limits: (dict or None)
+        Soft limits in GB, any of driver_rss, worker_rss (of a single worker), policy_batch (of a single policy)
+        and object_store. Missing or None limits are not checked
+    """
+    limits = limits or {}
+    workers = trainer.workers
+    # with no remote workers the local worker samples in the driver process
+    driver_stats = worker_memory_stats()
+    worker_stats = ray.get([worker.apply.remote(worker_memory_stats) for worker in workers.remote_workers()])
+
+    batch_bytes = defaultdict(lambda: defaultdict(int))
+    for stats in [driver_stats] + worker_stats:
+        for policy_id, columns in stats['batch_bytes'].items():
+            for column, num_bytes in columns.items():
+                batch_bytes[policy_id][column] += num_bytes
+    shm_per_node = {stats['node']: stats['shm'] for stats in [driver_stats] + worker_stats}
+    worker_rss = np.array([stats['rss'] for stats in worker_stats] or [0]) / GB
+    policy_ids = sorted(set(workers.local_worker().policy_map.keys()) | set(batch_bytes.keys()))
+
+    metrics = {
+        'driver_rss_gb': driver_stats['rss'] / GB,
+        'worker_rss_gb': {'max': np.max(worker_rss), 'mean': np.mean(worker_rss), 'total': np.sum(worker_rss)},
+        'batch_gb_per_policy': {policy_id: sum(batch_bytes[policy_id].values()) / GB for policy_id in policy_ids},
+        'object_store_gb': sum(shm_per_node.values()) / GB,
+    }
+    metrics['batch_gb'] = sum(metrics['batch_gb_per_policy'].values())
+
+    exceeded = []
+    for name, value in [('driver_rss', metrics['driver_rss_gb']),
+                        ('worker_rss', metrics['worker_rss_gb']['max']),
+                        ('policy_batch', max(metrics['batch_gb_per_policy'].values() or [0])),
+                        ('object_store', metrics['object_store_gb'])]:
+        if limits.get(name) is not None and value > limits[name]:
+            exceeded.append('{} {:.2f} GB > {:.2f} GB'.format(name, value, limits[name]))
+    metrics['limits_exceeded'] = len(exceeded)
+    if len(exceeded) > 0:
+        print('Memory soft limit exceeded at iteration {}: {}'.format(trainer.iteration, ', '.join(exceeded)))
+        print(format_breakdown(driver_stats, worker_stats, batch_bytes))
+    return metrics
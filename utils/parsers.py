@@ -16,6 +16,12 @@ def ray_parser(parser):
     parser.add_argument('--local_mode', action='store_true', help='Set to true if this will '
                                                                   'be run in local mode')
     parser.add_argument('--train_batch_size', type=int, default=10000, help='How many steps go into a training batch')
+    parser.add_argument('--num_envs_per_worker', type=int, default=1,
+                        help='Number of envs each rollout worker steps together. Every env picks its own adversary '
+                             'and dynamics at the end of its episodes')
+    parser.add_argument('--remote_worker_envs', action='store_true', default=False,
+                        help='If true, the envs of a worker run in their own processes. Only worth it if '
+                             'num_envs_per_worker > 1 and the env step is slow')
     parser.add_argument('--num_iters', type=int, default=350)
     parser.add_argument('--checkpoint_freq', type=int, default=50)
     parser.add_argument('--num_samples', type=int, default=1)
@@ -25,6 +31,20 @@ def ray_parser(parser):
     # TODO: Fix this visualization code
     parser.add_argument('--run_transfer_tests', action='store_true', default=False,
                         help='If true run the transfer tests on the results and upload them to AWS')
+    parser.add_argument('--adaptive_transfer_tests', action='store_true', default=False,
+                        help='If true, each transfer test stops adding rollouts once its mean reward estimate is tight')
+    parser.add_argument('--transfer_crn_seed', type=int, default=None,
+                        help='If set, the transfer tests are evaluated with common random numbers from this seed')
+    parser.add_argument('--transfer_results_store', type=str, default='~/transfer_results/results.db',
+                        help='Results store the transfer tests are added to. Tests already in it are not rerun. An '
+                             'empty value turns off both the store and this cache')
+    parser.add_argument('--eval_during_training', action='store_true', default=False,
+                        help='If true, every checkpoint_freq iterations a checkpoint is saved and transfer tested '
+                             'by a background watcher while training continues')
+    parser.add_argument('--eval_poll_interval', type=float, default=60,
+                        help='Seconds between two scans of the experiment dir for new checkpoints')
+    parser.add_argument('--eval_num_evaluators', type=int, default=2,
+                        help='Number of transfer test actors used for each checkpoint evaluated during training')
     parser.add_argument('--render', type=str, default=False)
     parser.add_argument('--use_lstm', default=False, action='store_true', help='If true, use an LSTM')
 
@@ -1,15 +1,14 @@
-import gym
-from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
-from gym.envs.mujoco.inverted_pendulum import InvertedPendulumEnv
-
 def pendulum_env_creator(env_config):
+    from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
     if env_config['num_adversaries'] > 0:
         env = AdvMAPendulumEnv(env_config)
     else:
+        from gym.envs.mujoco.inverted_pendulum import InvertedPendulumEnv
         env = InvertedPendulumEnv()
     return env
 
 def lerrel_pendulum_env_creator(env_config):
+    from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
     env = AdvMAPendulumEnv(env_config)
     return env
 
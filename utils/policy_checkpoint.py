@@ -0,0 +1,211 @@
+"""Checkpoints with one file per policy.
+
+A tune checkpoint of a standard trainer pickles every policy, so with a large adversary population every checkpoint
+rewrites all of them and every evaluation restores all of them. A policy checkpoint is instead a small json manifest,
+written where tune expects the checkpoint file (<trial_dir>/checkpoint_N/checkpoint-N), that maps each policy to a
+file in <trial_dir>/policy_store named by the hash of its contents. A policy whose weights did not change since the
+last checkpoint maps to the file that is already there, and frozen policies are not even serialized again. The
+observation filters, the optimizer state and the variables of the tf optimizer of every trained policy (e.g. the Adam
+moments, which get_weights leaves out) are stored the same way, so a restored trial resumes training where it stopped.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+import ray
+
+MANIFEST_FORMAT = 'policy_checkpoint'
+POLICY_STORE_DIR = 'policy_store'
+
+
+def policy_store_dir(checkpoint_path):
+    """The policy store of the trial a checkpoint belongs to"""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(checkpoint_path))), POLICY_STORE_DIR)
+
+
+def is_policy_checkpoint(checkpoint_path):
+    """Whether checkpoint_path is a manifest rather than a pickled trainer"""
+    with open(checkpoint_path, 'rb') as f:
+        if f.read(1) != b'{':
+            return False
+        f.seek(0)
+        try:
+            return json.loads(f.read().decode('utf-8')).get('format') == MANIFEST_FORMAT
+        except ValueError:
+            return False
+
+
+def load_manifest(checkpoint_path):
+    with open(checkpoint_path, 'r') as f:
+        return json.load(f)
+
+
+def put_blob(store_dir, data):
+    """Write data to the store unless a file with the same contents exists and return its file name"""
+    file_name = hashlib.sha1(data).hexdigest() + '.pkl'
+    path = os.path.join(store_dir, file_name)
+    if not os.path.exists(path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return file_name
+
+
+def get_blob(store_dir, file_name):
+    with open(os.path.join(store_dir, file_name), 'rb') as f:
+        return pickle.load(f)
+
+
+def referenced_files(manifest, policies=None):
+    """The store files a checkpoint refers to. If policies is set, only the files needed to restore those policies
+    and the filters, the optimizer state is left out"""
+    if policies is None:
+        return set(manifest['policies'].values()) | set(manifest.get('optimizer_variables', {}).values()) | \
+            {manifest['filters'], manifest['optimizer']}
+    return {manifest['policies'][policy_id] for policy_id in policies if policy_id in manifest['policies']} | \
+        {manifest['filters']}
+
+
+def prune_policy_store(trial_dir):
+    """Delete the files of the policy store that no checkpoint of the trial refers to any more, e.g. after tune
+    removed old checkpoints because of keep_checkpoints_num"""
+    store_dir = os.path.join(trial_dir, POLICY_STORE_DIR)
+    if not os.path.isdir(store_dir):
+        return
+    in_use = set()
+    for dir_name in os.listdir(trial_dir):
+        if not dir_name.startswith('checkpoint_'):
+            continue
+        manifest_path = os.path.join(trial_dir, dir_name, 'checkpoint-' + dir_name[len('checkpoint_'):])
+        if os.path.exists(manifest_path) and is_policy_checkpoint(manifest_path):
+            in_use |= referenced_files(load_manifest(manifest_path))
+    for file_name in os.listdir(store_dir):
+        if file_name.endswith('.pkl') and file_name not in in_use:
+            os.remove(os.path.join(store_dir, file_name))
+
+
+def optimizer_variables(policy):
+    """The variables of the tf optimizer of a policy, e.g. the Adam moments and beta powers"""
+    if getattr(policy, '_optimizer', None) is None:
+        return []
+    with policy._sess.graph.as_default():
+        return policy._optimizer.variables()
+
+
+def get_optimizer_variables(policy):
+    """Map from variable name to value of optimizer_variables"""
+    variables = optimizer_variables(policy)
+    return {variable.name: value for variable, value in zip(variables, policy._sess.run(variables))}
+
+
+def set_optimizer_variables(policy, values):
+    for variable in optimizer_variables(policy):
+        if variable.name in values:
+            variable.load(values[variable.name], policy._sess)
+
+
+def save_policy_checkpoint(trainer, checkpoint_dir, frozen_cache=None):
+    """Write a policy checkpoint of trainer to checkpoint_dir and return the path of its manifest.
+
+    Parameters
+    ----------
+    trainer: (Trainer)
+        The trainer to save
+    checkpoint_dir: (str)
+        The checkpoint_N dir tune made for this checkpoint
+    frozen_cache: (dict or None)
+        Map from the id of each policy that is not trained to the store file it was saved to. Those policies are
+        only serialized the first time
+    """
+    checkpoint_path = os.path.join(checkpoint_dir, 'checkpoint-{}'.format(trainer.iteration))
+    store_dir = policy_store_dir(checkpoint_path)
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+    local_worker = trainer.workers.local_worker()
+    policies_to_train = trainer.config['multiagent']['policies_to_train']
+    policies = {}
+    policy_optimizers = {}
+    for policy_id, policy in local_worker.policy_map.items():
+        frozen = policies_to_train is not None and policy_id not in policies_to_train
+        if not frozen:
+            policy_optimizers[policy_id] = put_blob(store_dir, pickle.dumps(get_optimizer_variables(policy)))
+        if frozen and frozen_cache is not None and policy_id in frozen_cache \
+                and os.path.exists(os.path.join(store_dir, frozen_cache[policy_id])):
+            policies[policy_id] = frozen_cache[policy_id]
+            continue
+        policies[policy_id] = put_blob(store_dir, pickle.dumps(policy.get_weights()))
+        if frozen and frozen_cache is not None:
+            frozen_cache[policy_id] = policies[policy_id]
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'iteration': trainer.iteration,
+        'policies': policies,
+        'filters': put_blob(store_dir, pickle.dumps(local_worker.get_filters(flush_after=False))),
+        'optimizer': put_blob(store_dir, pickle.dumps(trainer.optimizer.save())),
+        'optimizer_variables': policy_optimizers,
+    }
+    with open(checkpoint_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    prune_policy_store(os.path.dirname(checkpoint_dir))
+    return checkpoint_path
+
+
+def load_policy_weights(checkpoint_path, policies=None):
+    """Read the weights of the chosen policies (all of them if policies is None) without building a trainer.
+    Returns a map from policy id to weights"""
+    manifest = load_manifest(checkpoint_path)
+    store_dir = policy_store_dir(checkpoint_path)
+    if policies is None:
+        policies = manifest['policies'].keys()
+    return {policy_id: get_blob(store_dir, manifest['policies'][policy_id]) for policy_id in policies}
+
+
+def restore_policy_checkpoint(trainer, checkpoint_path, policies=None, restore_optimizer=False):
+    """Restore the chosen policies (all of them if policies is None) and the observation filters of trainer from a
+    policy checkpoint. The policies of the trainer that are not chosen keep their weights. With restore_optimizer the
+    optimizer state and the tf optimizer variables of the chosen policies are restored as well, which is only needed
+    to continue training"""
+    manifest = load_manifest(checkpoint_path)
+    store_dir = policy_store_dir(checkpoint_path)
+    local_worker = trainer.workers.local_worker()
+    policies = [policy_id for policy_id in (manifest['policies'] if policies is None else policies)
+                if policy_id in local_worker.policy_map]
+    for policy_id, weights in load_policy_weights(checkpoint_path, policies).items():
+        local_worker.policy_map[policy_id].set_weights(weights)
+    filters = get_blob(store_dir, manifest['filters'])
+    local_worker.sync_filters({policy_id: filters[policy_id] for policy_id in filters
+                               if policy_id in local_worker.filters})
+    if restore_optimizer:
+        trainer.optimizer.restore(get_blob(store_dir, manifest['optimizer']))
+        # older policy checkpoints did not store them, those trials restart the optimizer moments
+        for policy_id, file_name in manifest.get('optimizer_variables', {}).items():
+            if policy_id in policies:
+                set_optimizer_variables(local_worker.policy_map[policy_id], get_blob(store_dir, file_name))
+    if len(trainer.workers.remote_workers()) > 0:
+        weights = ray.put(local_worker.get_weights())
+        filters = ray.put(local_worker.get_filters(flush_after=False))
+        for worker in trainer.workers.remote_workers():
+            worker.set_weights.remote(weights)
+            worker.sync_filters.remote(filters)
+
+
+def with_policy_checkpoints(trainer_cls):
+    """A version of trainer_cls whose checkpoints are policy checkpoints. It also restores the standard ones"""
+
+    class PolicyCheckpointTrainer(trainer_cls):
+        def _save(self, checkpoint_dir):
+            if not hasattr(self, 'frozen_policy_files'):
+                self.frozen_policy_files = {}
+            return save_policy_checkpoint(self, checkpoint_dir, self.frozen_policy_files)
+
+        def _restore(self, checkpoint_path):
+            if is_policy_checkpoint(checkpoint_path):
+                restore_policy_checkpoint(self, checkpoint_path, restore_optimizer=True)
+            else:
+                super(PolicyCheckpointTrainer, self)._restore(checkpoint_path)
+
+    PolicyCheckpointTrainer.__name__ = trainer_cls.__name__
+    return PolicyCheckpointTrainer
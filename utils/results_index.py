@@ -0,0 +1,156 @@
+"""Index of the summary statistics of every transfer test result in a tree of result files.
+
+The plots only need the mean of each result file, so instead of loading every file each time a figure is drawn, each
+experiment folder is walked once and the (mean, std, n) of every result file is kept in a sidecar results_index.npz
+next to the results. On the next walk only the files whose size or modification time changed are loaded again. The
+files are still matched against the test names of a figure by name, see match_test_index, since their prefix is not
+always the name of the folder (e.g. the domain randomization sweeps add the hyperparameters to it). The sidecar
+covers the files of every checkpoint folder, which checkpoint is read is chosen when the index is queried.
+"""
+
+from collections import OrderedDict
+import os
+
+import numpy as np
+
+from utils.results_store import filter_checkpoints, match_test_index, parse_result_dir, walk_result_dirs, \
+    SUMMARY_SUFFIXES
+
+INDEX_FILE_NAME = 'results_index.npz'
+# bumped whenever the meaning of a field changes, older sidecars are rebuilt
+INDEX_VERSION = 3
+
+
+def load_index_file(index_path):
+    """Return a dict from the relative path of a result file to (mtime, size, seed, mean, std, n)"""
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with np.load(index_path) as data:
+            if 'version' not in data or int(data['version']) != INDEX_VERSION:
+                return {}
+            return {str(path): (int(mtime), int(size), None if seed < 0 else int(seed), float(mean), float(std),
+                                int(n))
+                    for path, mtime, size, seed, mean, std, n in zip(
+                        data['paths'], data['mtimes'], data['sizes'], data['seeds'], data['means'], data['stds'],
+                        data['counts'])}
+    except Exception as e:
+        print('Could not read the results index {}, rebuilding it: {}'.format(index_path, e))
+        return {}
+
+
+def save_index_file(index_path, entries):
+    # written to a temporary file first so that concurrent figure builds never see a partial index
+    temp_path = index_path[:-len('.npz')] + '_{}.tmp.npz'.format(os.getpid())
+    paths = sorted(entries.keys())
+    np.savez(temp_path,
+             version=INDEX_VERSION,
+             paths=np.array(paths, dtype=str),
+             mtimes=np.array([entries[path][0] for path in paths], dtype=np.int64),
+             sizes=np.array([entries[path][1] for path in paths], dtype=np.int64),
+             seeds=np.array([-1 if entries[path][2] is None else entries[path][2] for path in paths], dtype=np.int64),
+             means=np.array([entries[path][3] for path in paths], dtype=np.float64),
+             stds=np.array([entries[path][4] for path in paths], dtype=np.float64),
+             counts=np.array([entries[path][5] for path in paths], dtype=np.int64))
+    os.replace(temp_path, index_path)
+
+
+def index_folder(folder, open_cmd=lambda x: np.loadtxt(x), persist=True, checkpoint='latest'):
+    """Return an OrderedDict from the relative path of every result file (*_rew.txt) of the chosen checkpoints in an
+    experiment folder to (seed, file name, mean, std, n). The trial, seed and checkpoint of a file are parsed from its
+    path relative to the experiment folder, see utils/results_store.py parse_result_dir.
+
+    Parameters
+    ----------
+    folder: (str)
+        The experiment folder
+    open_cmd: (function)
+        Loads the rewards of a result file. The sidecar does not record it, so pass persist=False when using a
+        loader that gives different values than the default one.
+    persist: (bool)
+        If true, the index is read from and written to the results_index.npz sidecar in the folder
+    checkpoint: (int, 'latest' or None)
+        Which checkpoint folder of every trial is read, see utils/results_store.py filter_checkpoints
+    """
+    index_path = os.path.join(folder, INDEX_FILE_NAME)
+    cached = load_index_file(index_path) if persist else {}
+    entries = {}
+    changed = False
+    for dirpath, filenames, trial, seed, dir_checkpoint in walk_result_dirs(folder, checkpoint=None):
+        for file in filenames:
+            if not file.endswith('_rew.txt') or file[:-len('_rew.txt')].endswith(SUMMARY_SUFFIXES):
+                continue
+            file_path = os.path.join(dirpath, file)
+            rel_path = os.path.relpath(file_path, folder)
+            stat = os.stat(file_path)
+            entry = cached.get(rel_path)
+            if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+                rewards = np.atleast_1d(open_cmd(file_path))
+                entry = (stat.st_mtime_ns, stat.st_size, seed, np.mean(rewards), np.std(rewards), len(rewards))
+                changed = True
+            entries[rel_path] = entry
+    if len(entries) != len(cached):
+        changed = True
+    if persist and changed:
+        try:
+            save_index_file(index_path, entries)
+        except OSError as e:
+            print('Could not write the results index {}: {}'.format(index_path, e))
+
+    result_dirs = {rel_path: parse_result_dir(os.path.dirname(rel_path)) for rel_path in entries}
+    keep = filter_checkpoints([(trial, dir_checkpoint) for trial, _, dir_checkpoint in result_dirs.values()],
+                              checkpoint)
+    summary = OrderedDict()
+    for rel_path in sorted(entries.keys()):
+        trial, _, dir_checkpoint = result_dirs[rel_path]
+        if (trial, dir_checkpoint) not in keep:
+            continue
+        mtime, size, seed, mean, std, n = entries[rel_path]
+        summary[rel_path] = (seed, os.path.basename(rel_path), mean, std, n)
+    return summary
+
+
+class ResultsIndex(object):
+    """The mean reward of every result file of an experiment folder, matched against test names. Each folder is
+    indexed the first time it is queried.
+
+    Parameters
+    ----------
+    open_cmd: (function)
+        Loads the rewards of a result file
+    store: (ResultsStore or None)
+        If set, the folders are experiment names and the statistics are computed by the store instead
+    persist: (bool)
+        If true, the index of each folder is kept in a sidecar file, see index_folder
+    checkpoint: (int, 'latest' or None)
+        The checkpoint of every trial whose results are read, see ResultsStore.select_rollouts and index_folder
+    """
+
+    def __init__(self, open_cmd=lambda x: np.loadtxt(x), store=None, persist=True, checkpoint='latest'):
+        self.open_cmd = open_cmd
+        self.store = store
+        self.persist = persist
+        self.checkpoint = checkpoint
+        self.folders = {}
+
+    def folder_summary(self, folder):
+        if folder not in self.folders:
+            if self.store is not None:
+                self.folders[folder] = self.store.load_test_summary(folder, checkpoint=self.checkpoint)
+            else:
+                self.folders[folder] = index_folder(folder, self.open_cmd, self.persist, self.checkpoint)
+        return self.folders[folder]
+
+    def test_means(self, folder, test_names):
+        """Yield (seed, test index, mean reward) for every result of the tests in folder. Without a store there is
+        one result per matching file, so the callers sum every file of a test as the plots always have"""
+        if self.store is not None:
+            test_idx = {test_name: i for i, test_name in enumerate(test_names)}
+            for (trial, seed, test), (mean, std, n) in self.folder_summary(folder).items():
+                if test in test_idx:
+                    yield seed, test_idx[test], mean
+            return
+        for seed, file_name, mean, std, n in self.folder_summary(folder).values():
+            test_idx = match_test_index(file_name, test_names)
+            if test_idx is not None:
+                yield seed, test_idx, mean
@@ -0,0 +1,376 @@
+"""SQLite store for the transfer test results.
+
+Every rollout of every transfer test is one row, so a full comparison across experiments, seeds and tests is a single
+query instead of a walk over one text file per test. Run this file to import an existing tree of results, e.g.
+    python utils/results_store.py data --store data/results.db
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+DEFAULT_STORE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/results.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollouts (
+    experiment TEXT NOT NULL,
+    trial TEXT NOT NULL DEFAULT '',
+    seed INTEGER,
+    checkpoint INTEGER,
+    test TEXT NOT NULL,
+    mass REAL,
+    friction REAL,
+    rollout INTEGER NOT NULL,
+    reward REAL NOT NULL,
+    steps REAL
+);
+CREATE INDEX IF NOT EXISTS rollouts_experiment_test ON rollouts (experiment, test);
+CREATE TABLE IF NOT EXISTS cached_tests (
+    cache_key TEXT PRIMARY KEY,
+    rewards TEXT NOT NULL,
+    steps TEXT
+);
+"""
+
+# a rollout is stored once per (experiment, trial, seed, checkpoint, test), rerunning a test replaces its rows
+UNIQUE_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS rollouts_unique ON rollouts
+    (experiment, trial, IFNULL(seed, -1), IFNULL(checkpoint, -1), test, rollout)
+"""
+
+# files written next to the per test results that summarize a whole sweep
+SUMMARY_SUFFIXES = ('mean_sweep', 'holdout_test_sweep', 'rollouts_used')
+
+
+def parse_test_name(test_name):
+    """Return the (mass, friction) coefficients of a grid test name like m_0.76_f_0.7, the base test is (1, 1) and
+    every other test is (None, None)"""
+    if test_name == 'base':
+        return 1.0, 1.0
+    match = re.match(r'^m_([0-9.e+-]+)_f_([0-9.e+-]+)$', test_name)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    return None, None
+
+
+def match_test_index(file_name, test_names):
+    """Return the index of the first test in test_names whose name appears as _<test>_ in file_name, or None. This is
+    how the plots have always matched result files, so the prefix of the file does not have to be known"""
+    if '.png' in file_name:
+        return None
+    for i, test_name in enumerate(test_names):
+        if '_' + test_name + '_' in file_name:
+            return i
+    return None
+
+
+def parse_seed(path):
+    """Return the seed in a tune trial folder name like PPO_0_seed=3_2020-05-25_..., or None"""
+    match = re.search(r'seed=([0-9]+)', path)
+    return int(match.group(1)) if match else None
+
+
+def parse_checkpoint(checkpoint):
+    """Return the iteration of a checkpoint path like .../checkpoint_350/checkpoint-350, or None"""
+    match = re.search(r'checkpoint-([0-9]+)$', checkpoint or '')
+    return int(match.group(1)) if match else None
+
+
+def parse_trial(checkpoint):
+    """Return the tune trial folder name of a checkpoint path like .../PPO_0_seed=3_.../checkpoint_350/checkpoint-350,
+    or '' if the path is not in a trial folder"""
+    if parse_checkpoint(checkpoint) is None:
+        return ''
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.normpath(checkpoint))))
+
+
+def parse_result_dir(rel_dir):
+    """Return the (trial, seed, checkpoint) of a folder of result files from its path relative to the experiment
+    folder. The transfer tests write to <trial>/checkpoint_<N>/ (see run_adv_mujoco.checkpoint_output_path), older
+    results are directly in <trial>/ and have the checkpoint None. The seed is taken from the trial folder name"""
+    parts = [part for part in os.path.normpath(rel_dir).split(os.sep) if part not in ('', '.')]
+    checkpoint = None
+    if parts:
+        match = re.match(r'^checkpoint_([0-9]+)$', parts[-1])
+        if match:
+            checkpoint = int(match.group(1))
+            parts = parts[:-1]
+    trial = parts[-1] if parts else ''
+    return trial, parse_seed(trial), checkpoint
+
+
+def filter_checkpoints(trial_checkpoints, checkpoint='latest'):
+    """Return the set of (trial, checkpoint) pairs to read out of the pairs found in a tree of result folders, with
+    the same meaning of checkpoint as ResultsStore.select_rollouts. Like there, 'latest' ignores the results without
+    a checkpoint unless a trial has nothing else"""
+    if checkpoint is None:
+        return set(trial_checkpoints)
+    if checkpoint != 'latest':
+        return set((trial, trial_checkpoint) for trial, trial_checkpoint in trial_checkpoints
+                   if trial_checkpoint == checkpoint)
+    latest = {}
+    for trial, trial_checkpoint in trial_checkpoints:
+        if trial not in latest or latest[trial] is None or \
+                (trial_checkpoint is not None and trial_checkpoint > latest[trial]):
+            latest[trial] = trial_checkpoint
+    return set(latest.items())
+
+
+def walk_result_dirs(folder, checkpoint='latest'):
+    """Return (dirpath, filenames, trial, seed, checkpoint) for every folder of an experiment folder that holds
+    result files (*_rew.txt) of the checkpoints to read, see parse_result_dir and filter_checkpoints"""
+    result_dirs = []
+    for (dirpath, dirnames, filenames) in os.walk(folder):
+        if any(file.endswith('_rew.txt') for file in filenames):
+            result_dirs.append((dirpath, filenames) + parse_result_dir(os.path.relpath(dirpath, folder)))
+    keep = filter_checkpoints([(trial, dir_checkpoint) for _, _, trial, _, dir_checkpoint in result_dirs],
+                              checkpoint)
+    return [result_dir for result_dir in result_dirs if (result_dir[2], result_dir[4]) in keep]
+
+
+class ResultsStore(object):
+    """Table of rollout results, one row per rollout of every (experiment, trial, seed, checkpoint, test)
+
+    Parameters
+    ----------
+    path: (str)
+        Location of the sqlite file, it is created if it does not exist
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+
+    def migrate(self):
+        """Bring a store made before the trial column and the unique rollouts existed up to date. Duplicated rollouts
+        keep the row that was added last"""
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(rollouts)')]
+        if 'trial' not in columns:
+            self.conn.execute("ALTER TABLE rollouts ADD COLUMN trial TEXT NOT NULL DEFAULT ''")
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'rollouts_unique'").fetchone() \
+                is None:
+            self.conn.execute('DELETE FROM rollouts WHERE rowid NOT IN (SELECT MAX(rowid) FROM rollouts GROUP BY '
+                              'experiment, trial, IFNULL(seed, -1), IFNULL(checkpoint, -1), test, rollout)')
+            self.conn.execute(UNIQUE_INDEX)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def add_rollouts(self, experiment, seed, checkpoint, test, rewards, steps=None, commit=True, mass=None,
+                     friction=None, trial=''):
+        """Store the result of every rollout of a single test. Adding the same test of the same checkpoint again
+        replaces its rollouts
+
+        Parameters
+        ----------
+        experiment: (str)
+            Name of the experiment, this is the output_file_name of the transfer tests
+        seed: (int or None)
+            Training seed of the evaluated policy
+        checkpoint: (int or None)
+            Training iteration of the evaluated checkpoint
+        test: (str)
+            Name of the transfer test
+        rewards: (list)
+            Total agent reward of each rollout
+        steps: (list or None)
+            Length of each rollout
+        commit: (bool)
+            If false, the rows are only committed by the next call to commit(). Use this for bulk inserts.
+        mass, friction: (float or None)
+            Sweep coefficients of the test, see TransferSpec.grid_coefs. If both are None they are parsed from the
+            test name, which is only needed for results imported from text files.
+        trial: (str)
+            Tune trial folder of the evaluated policy, this tells apart the trials of a grid search that share a seed
+        """
+        rewards = np.atleast_1d(rewards)
+        steps = np.atleast_1d(steps) if steps is not None else None
+        if steps is not None and len(steps) != len(rewards):
+            steps = None
+        if mass is None and friction is None:
+            mass, friction = parse_test_name(test)
+        rows = [(experiment, trial, seed, checkpoint, test, mass, friction, rollout, float(reward),
+                 float(steps[rollout]) if steps is not None else None)
+                for rollout, reward in enumerate(rewards)]
+        # a rerun with fewer rollouts, e.g. an adaptive one, would otherwise leave the extra rollouts of the old run
+        self.conn.execute('DELETE FROM rollouts WHERE experiment = ? AND trial = ? AND seed IS ? AND checkpoint IS ? '
+                          'AND test = ? AND rollout >= ?', (experiment, trial, seed, checkpoint, test, len(rows)))
+        self.conn.executemany('INSERT OR REPLACE INTO rollouts (experiment, trial, seed, checkpoint, test, mass, '
+                              'friction, rollout, reward, steps) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        if commit:
+            self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def get_cached(self, cache_key):
+        """Return the (rewards, steps) of a finished transfer test or None if it has not been run"""
+        row = self.conn.execute('SELECT rewards, steps FROM cached_tests WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is None:
+            return None
+        return np.array(json.loads(row[0])), np.array(json.loads(row[1])) if row[1] is not None else None
+
+    def put_cached(self, cache_key, rewards, steps=None, commit=True):
+        """Mark a transfer test as finished, see transfer_tests.transfer_cache_key"""
+        steps = json.dumps(np.atleast_1d(steps).tolist()) if steps is not None else None
+        self.conn.execute('INSERT OR REPLACE INTO cached_tests VALUES (?, ?, ?)',
+                          (cache_key, json.dumps(np.atleast_1d(rewards).tolist()), steps))
+        if commit:
+            self.conn.commit()
+
+    def experiments(self):
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT experiment FROM rollouts ORDER BY experiment')]
+
+    def select_rollouts(self, columns, experiment, tests=None, checkpoint='latest'):
+        """Return the query and parameters selecting columns, an sql expression, from the rollouts of experiment.
+        checkpoint is an iteration, 'latest' for the last checkpoint of every (trial, seed) or None for every
+        checkpoint"""
+        query = 'SELECT {} FROM rollouts'.format(columns)
+        params = []
+        if checkpoint == 'latest':
+            query += ' JOIN (SELECT trial, seed, MAX(checkpoint) AS checkpoint FROM rollouts WHERE experiment = ? ' \
+                     'GROUP BY trial, seed) AS latest ON rollouts.trial = latest.trial AND ' \
+                     'rollouts.seed IS latest.seed AND rollouts.checkpoint IS latest.checkpoint'
+            params.append(experiment)
+        query += ' WHERE rollouts.experiment = ?'
+        params.append(experiment)
+        if checkpoint is not None and checkpoint != 'latest':
+            query += ' AND rollouts.checkpoint = ?'
+            params.append(checkpoint)
+        if tests is not None:
+            query += ' AND rollouts.test IN ({})'.format(', '.join('?' * len(tests)))
+            params.extend(tests)
+        return query, params
+
+    def load_rewards(self, experiment, tests=None, checkpoint='latest'):
+        """Return an OrderedDict from (trial, seed, test) to the array of rewards indexed by rollout, NaN where a
+        rollout index is missing. See select_rollouts for checkpoint"""
+        query, params = self.select_rollouts(
+            'rollouts.trial, rollouts.seed, rollouts.test, rollouts.rollout, rollouts.reward', experiment, tests,
+            checkpoint)
+        query += ' ORDER BY rollouts.trial, rollouts.seed, rollouts.test, rollouts.checkpoint, rollouts.rollout'
+        results = OrderedDict()
+        for trial, seed, test, rollout, reward in self.conn.execute(query, params):
+            results.setdefault((trial, seed, test), {})[rollout] = reward
+        loaded = OrderedDict()
+        for key, rewards in results.items():
+            loaded[key] = np.full(max(rewards) + 1, np.nan)
+            loaded[key][list(rewards)] = list(rewards.values())
+        return loaded
+
+    def load_test_means(self, experiment, tests=None, checkpoint='latest'):
+        """Return an OrderedDict from (trial, seed) to a dict from test to (mean, std, steps mean, steps std), the same
+        rows the transfer tests write into the sweep files"""
+        query, params = self.select_rollouts(
+            'rollouts.trial, rollouts.seed, rollouts.test, rollouts.reward, rollouts.steps', experiment, tests,
+            checkpoint)
+        query += ' ORDER BY rollouts.trial, rollouts.seed, rollouts.test, rollouts.checkpoint, rollouts.rollout'
+        grouped = OrderedDict()
+        for trial, seed, test, reward, steps in self.conn.execute(query, params):
+            grouped.setdefault((trial, seed), OrderedDict()).setdefault(test, []).append((reward, steps))
+        results = OrderedDict()
+        for key, seed_tests in grouped.items():
+            results[key] = {}
+            for test, rows in seed_tests.items():
+                rewards = np.array([row[0] for row in rows])
+                steps = np.array([np.nan if row[1] is None else row[1] for row in rows])
+                results[key][test] = (np.mean(rewards), np.std(rewards), np.mean(steps), np.std(steps))
+        return results
+
+    def load_test_summary(self, experiment, tests=None, checkpoint='latest'):
+        """Return an OrderedDict from (trial, seed, test) to the (mean, std, n) of the rewards, aggregated by sqlite"""
+        query, params = self.select_rollouts(
+            'rollouts.trial, rollouts.seed, rollouts.test, AVG(rollouts.reward), '
+            'AVG(rollouts.reward * rollouts.reward), COUNT(*)', experiment, tests, checkpoint)
+        query += ' GROUP BY rollouts.trial, rollouts.seed, rollouts.test ' \
+                 'ORDER BY rollouts.trial, rollouts.seed, rollouts.test'
+        results = OrderedDict()
+        for trial, seed, test, mean, mean_sq, n in self.conn.execute(query, params):
+            results[(trial, seed, test)] = (mean, np.sqrt(max(mean_sq - mean ** 2, 0.0)), n)
+        return results
+
+
+def sweep_prefixes(filenames):
+    """The prefixes of the result files in a folder, read from the names of the sweep files the transfer tests write
+    next to them (<prefix>_mean_sweep_rew.txt, <prefix>_holdout_test_sweep_rew.txt), longest first"""
+    prefixes = set()
+    for file in filenames:
+        for suffix in ('_mean_sweep_rew.txt', '_holdout_test_sweep_rew.txt'):
+            if file.endswith(suffix) and not file.endswith('_with_adv' + suffix):
+                prefixes.add(file[:-len(suffix)])
+    return sorted(prefixes, key=len, reverse=True)
+
+
+def import_results_tree(results_path, store, test_names=None, checkpoint='latest'):
+    """One time import of a tree of per test result files laid out as
+    <experiment>/<trial>/checkpoint_<N>/<prefix>_<test>_rew.txt, or <experiment>/<trial>/<prefix>_<test>_rew.txt for
+    results written before the transfer tests kept one folder per checkpoint. See parse_result_dir for how the trial,
+    seed and checkpoint are read from the path. The steps were not saved.
+
+    Parameters
+    ----------
+    results_path: (str)
+        Folder containing the experiment folders
+    store: (ResultsStore)
+        The store the results are added to
+    test_names: (list or None)
+        If set, the files are matched against these tests like the plots match them, see match_test_index. Otherwise
+        the test is what follows the prefix of the sweep files in the same folder
+    checkpoint: (int, 'latest' or None)
+        Which checkpoint folders of every trial are imported, see filter_checkpoints
+    """
+    num_files = 0
+    num_skipped = 0
+    experiments = sorted(name for name in os.listdir(results_path) if os.path.isdir(os.path.join(results_path, name)))
+    for experiment in experiments:
+        result_dirs = walk_result_dirs(os.path.join(results_path, experiment), checkpoint)
+        for dirpath, filenames, trial, seed, trial_checkpoint in result_dirs:
+            prefixes = sweep_prefixes(filenames) if test_names is None else []
+            for file in filenames:
+                if not file.endswith('_rew.txt'):
+                    continue
+                stem = file[:-len('_rew.txt')]
+                test = None
+                if test_names is not None:
+                    test_idx = match_test_index(file, test_names)
+                    test = test_names[test_idx] if test_idx is not None else None
+                elif not stem.endswith(SUMMARY_SUFFIXES):
+                    test = next((stem[len(prefix) + 1:] for prefix in prefixes if stem.startswith(prefix + '_')),
+                                None)
+                if test is None:
+                    num_skipped += 1
+                    continue
+                try:
+                    rewards = np.load(os.path.join(dirpath, file))
+                except:
+                    rewards = np.loadtxt(os.path.join(dirpath, file))
+                store.add_rollouts(experiment, seed, trial_checkpoint, test, rewards, commit=False, trial=trial)
+                num_files += 1
+    store.commit()
+    print('Imported {} files, skipped {}'.format(num_files, num_skipped))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Import a tree of transfer test results into a results store')
+    parser.add_argument('results_path', type=str, help='Folder containing the experiment folders')
+    parser.add_argument('--store', type=str, default=DEFAULT_STORE_PATH, help='Path of the sqlite file')
+    parser.add_argument('--test_names', type=str, nargs='+', default=None,
+                        help='Tests to import. By default the tests are read from the names of the sweep files')
+    parser.add_argument('--checkpoint', type=str, default='latest',
+                        help='Checkpoint folder of every trial to import, latest or an iteration')
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint if args.checkpoint == 'latest' else int(args.checkpoint)
+    store = ResultsStore(args.store)
+    import_results_tree(args.results_path, store, args.test_names, checkpoint)
+    store.close()
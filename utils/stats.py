@@ -0,0 +1,155 @@
+"""Vectorized bootstrap statistics for comparing experiments across seeds.
+
+All functions take the rewards as an (experiment, seed, test, rollout) array padded with NaN where a seed, test or
+rollout is missing, or the (experiment, seed, test) array of the per seed means. The seed is the unit that is
+resampled, since the rollouts of one seed are not independent draws of the training outcome. Resampling with
+replacement is done as multinomial weights over the seeds, so all resamples of an experiment are a single matrix
+product.
+"""
+
+import numpy as np
+
+
+def nan_mean(values, axis):
+    """Mean over axis ignoring NaN, NaN where every value is missing. Unlike np.nanmean it does not warn"""
+    mask = ~np.isnan(values)
+    total = np.where(mask, values, 0.0).sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / mask.sum(axis=axis)
+
+
+def seed_means(rewards):
+    """Reduce an (experiment, seed, test, rollout) array to the (experiment, seed, test) means over the rollouts"""
+    rewards = np.asarray(rewards, dtype=np.float64)
+    if rewards.ndim == 4:
+        return nan_mean(rewards, axis=3)
+    if rewards.ndim != 3:
+        raise ValueError('Expected an (experiment, seed, test[, rollout]) array, got shape {}'.format(rewards.shape))
+    return rewards
+
+
+def bootstrap_seed_means(rewards, num_resamples=2000, avg_across_tests=False, seed=None):
+    """Resample the seeds of every experiment with replacement and return the mean across seeds of each resample
+
+    Parameters
+    ----------
+    rewards: (np.ndarray)
+        (experiment, seed, test, rollout) rewards or (experiment, seed, test) per seed means
+    num_resamples: (int)
+        Number of bootstrap resamples
+    avg_across_tests: (bool)
+        If true, the tests are averaged within each seed first and the result has a single test
+    seed: (int or None)
+        Seed of the resampling, so that the error bars of a figure do not change between builds
+
+    Returns
+    -------
+    resampled: (np.ndarray)
+        (experiment, num_resamples, test) mean across seeds of each resample
+    """
+    means = seed_means(rewards)
+    if avg_across_tests:
+        means = nan_mean(means, axis=2)[:, :, np.newaxis]
+    rng = np.random.RandomState(seed)
+    num_exps, num_seeds, num_tests = means.shape
+    resampled = np.full((num_exps, num_resamples, num_tests), np.nan)
+    for exp_idx in range(num_exps):
+        mask = ~np.isnan(means[exp_idx])
+        valid_seeds = np.where(mask.any(axis=1))[0]
+        if len(valid_seeds) == 0:
+            continue
+        weights = np.zeros((num_resamples, num_seeds))
+        weights[:, valid_seeds] = rng.multinomial(len(valid_seeds), np.ones(len(valid_seeds)) / len(valid_seeds),
+                                                  size=num_resamples)
+        # a seed missing a test does not count towards the mean of that test
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resampled[exp_idx] = weights.dot(np.where(mask, means[exp_idx], 0.0)) / weights.dot(mask)
+    return resampled
+
+
+def bootstrap_ci(rewards, num_resamples=2000, alpha=0.05, avg_across_tests=False, seed=None):
+    """Percentile bootstrap confidence interval of the mean across seeds
+
+    Returns
+    -------
+    estimate, lower, upper: (np.ndarray)
+        (experiment, test) arrays, or (experiment,) if avg_across_tests
+    """
+    means = seed_means(rewards)
+    if avg_across_tests:
+        estimate = nan_mean(nan_mean(means, axis=2), axis=1)
+    else:
+        estimate = nan_mean(means, axis=1)
+    resampled = bootstrap_seed_means(means, num_resamples, avg_across_tests, seed)
+    lower, upper = nan_percentile(resampled, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+    if avg_across_tests:
+        lower, upper = lower[:, 0], upper[:, 0]
+    return estimate, lower, upper
+
+
+def nan_percentile(values, percentiles, axis):
+    # resamples of an experiment are either all NaN or none of them are, which np.nanpercentile warns about
+    if np.all(np.isnan(values)):
+        shape = list(values.shape)
+        del shape[axis]
+        return np.full([len(percentiles)] + shape, np.nan)
+    with np.errstate(invalid='ignore'):
+        return np.percentile(values, percentiles, axis=axis)
+
+
+def check_rollout_coverage(rewards, baseline_idx=0):
+    """Raise a ValueError unless, for every (seed, test) that an experiment shares with the baseline, the rewards of
+    both are the contiguous rollouts 0..n-1. The rollout axis holds the rollout index, so a missing rollout would
+    otherwise pair rollouts that did not see the same random numbers."""
+    present = ~np.isnan(rewards)
+    counts = present.sum(axis=3)
+    contiguous = np.all(present == (np.arange(rewards.shape[3]) < counts[..., np.newaxis]), axis=3)
+    paired = (counts > 0) & (counts[baseline_idx] > 0)[np.newaxis]
+    unpaired = np.argwhere(paired & ~(contiguous & contiguous[baseline_idx][np.newaxis]))
+    if len(unpaired) > 0:
+        raise ValueError('The rollouts of (experiment, seed, test) {} and of the baseline do not both cover the rollout '
+                         'indices 0..n-1, they cannot be paired'.format([tuple(int(i) for i in idx) for idx in unpaired]))
+
+
+def paired_differences(rewards, baseline_idx=0):
+    """Per seed mean difference of every experiment to the baseline experiment, (experiment, seed, test).
+
+    With (experiment, seed, test, rollout) rewards the rollouts are differenced one by one, which is what makes
+    results evaluated with common random numbers (transfer_tests.py --crn_seed) comparable with fewer rollouts. If
+    the two experiments ran a different number of rollouts, the rollouts 0..n-1 present in both are used. See
+    check_rollout_coverage for when the rewards cannot be paired.
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    if rewards.ndim == 4:
+        check_rollout_coverage(rewards, baseline_idx)
+    diffs = rewards - rewards[baseline_idx][np.newaxis]
+    return seed_means(diffs)
+
+
+def paired_bootstrap_ci(rewards, baseline_idx=0, num_resamples=2000, alpha=0.05, avg_across_tests=True, seed=None):
+    """Bootstrap confidence interval of the paired difference of every experiment to the baseline
+
+    Returns
+    -------
+    estimate, lower, upper: (np.ndarray)
+        see bootstrap_ci
+    prob_better: (np.ndarray)
+        Fraction of the resamples in which the experiment beats the baseline, same shape as estimate
+    """
+    diffs = paired_differences(rewards, baseline_idx)
+    estimate, lower, upper = bootstrap_ci(diffs, num_resamples, alpha, avg_across_tests, seed)
+    resampled = bootstrap_seed_means(diffs, num_resamples, avg_across_tests, seed)
+    prob_better = np.mean(resampled > 0, axis=1)
+    if avg_across_tests:
+        prob_better = prob_better[:, 0]
+    return estimate, lower, upper, prob_better
+
+
+def rank_probabilities(rewards, num_resamples=2000, seed=None):
+    """Probability of every experiment to have each rank when the experiments are ordered by their mean reward across
+    seeds and tests, rank 0 being the best. Returns an (experiment, rank) array."""
+    resampled = bootstrap_seed_means(rewards, num_resamples, avg_across_tests=True, seed=seed)[:, :, 0]
+    resampled = np.where(np.isnan(resampled), -np.inf, resampled)
+    ranks = np.argsort(np.argsort(-resampled, axis=0, kind='stable'), axis=0)
+    num_exps = resampled.shape[0]
+    return np.mean(ranks[:, :, np.newaxis] == np.arange(num_exps), axis=1)
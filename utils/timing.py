@@ -0,0 +1,170 @@
+"""Per iteration breakdown of where the time of a training iteration goes, exported as result['timing'].
+
+The rllib optimizers only keep running means of their sample, learn and weight sync times over all the policies, which
+does not say which adversary or which phase is slow. Everything here is installed from the callbacks:
+    on_episode_start wraps postprocess_trajectory of every policy of the rollout worker it runs on, so postprocessing
+        (postprocess_ppo_gae, new_postprocess_ppo_gae, ...) is timed where it happens. The times are summed over the
+        workers, so they are cpu seconds rather than wall clock
+    on_train_result makes an IterationTimer for the trainer on its first call, which times the learning of every
+        policy, the filter sync and the callback itself from then on
+Since the trainer is only instrumented after its first iteration, the per policy learn times and the filter sync
+time of that iteration are nan.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import time
+
+import numpy as np
+import ray
+from ray.rllib.policy.sample_batch import DEFAULT_POLICY_ID
+
+# postprocessing time of every policy in this process since the last call of pop_postprocess_times
+_postprocess_times = defaultdict(float)
+
+# timers of the rllib optimizers and the result field of each
+OPTIMIZER_TIMERS = [
+    ('sample_timer', 'sample_s'),
+    ('update_weights_timer', 'weight_sync_s'),
+    ('load_timer', 'load_s'),
+    ('grad_timer', 'learn_s'),
+    ('replay_timer', 'replay_s'),
+]
+
+
+def timed(fn, times, key):
+    """fn, adding the time of each call to times[key]"""
+    def timed_fn(*args, **kwargs):
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            times[key] += time.time() - start
+    return timed_fn
+
+
+def instrument_policies(policy_map):
+    """Time postprocess_trajectory of every policy in policy_map, once per policy"""
+    for policy_id, policy in policy_map.items():
+        if not getattr(policy, 'postprocess_timed', False):
+            policy.postprocess_trajectory = timed(policy.postprocess_trajectory, _postprocess_times, policy_id)
+            policy.postprocess_timed = True
+
+
+def pop_postprocess_times(worker=None):
+    """Return the postprocessing times of this process and reset them. Takes the worker to be used with worker.apply"""
+    times = dict(_postprocess_times)
+    _postprocess_times.clear()
+    return times
+
+
+class IterationTimer(object):
+    """Collects the timing breakdown of one trainer.
+
+    Parameters
+    ----------
+    trainer: (Trainer)
+        The trainer to instrument. Its optimizer has to exist already, so this is made in on_train_result
+    """
+
+    def __init__(self, trainer):
+        self.trainer = trainer
+        self.policy_ids = sorted(trainer.workers.local_worker().policy_map.keys())
+        self.learn_times = defaultdict(float)
+        self.load_times = defaultdict(float)
+        self.times = defaultdict(float)
+        self.callback_times = defaultdict(float)
+        self.timer_totals = {}
+        self.first_iteration = True
+        self.instrument()
+
+    def instrument(self):
+        optimizer = self.trainer.optimizer
+        if hasattr(optimizer, 'optimizers'):
+            # LocalMultiGPUOptimizer loads and optimizes one tower stack per policy
+            for policy_id, tower_stack in optimizer.optimizers.items():
+                tower_stack.load_data = timed(tower_stack.load_data, self.load_times, policy_id)
+                tower_stack.optimize = timed(tower_stack.optimize, self.learn_times, policy_id)
+        else:
+            local_worker = self.trainer.workers.local_worker()
+            learn_on_batch = local_worker.learn_on_batch
+
+            def timed_learn_on_batch(samples):
+                start = time.time()
+                try:
+                    return learn_on_batch(samples)
+                finally:
+                    # minibatch sgd passes one policy at a time, the replay optimizers all of them together
+                    policy_ids = getattr(samples, 'policy_batches', {DEFAULT_POLICY_ID: None}).keys()
+                    self.learn_times['+'.join(sorted(policy_ids))] += time.time() - start
+
+            local_worker.learn_on_batch = timed_learn_on_batch
+        if hasattr(self.trainer, '_sync_filters_if_needed'):
+            self.trainer._sync_filters_if_needed = timed(self.trainer._sync_filters_if_needed, self.times,
+                                                         'filter_sync_s')
+
+    @contextmanager
+    def time(self, name):
+        """Time a part of the callback"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.callback_times[name] += time.time() - start
+
+    def optimizer_times(self):
+        """The time each optimizer timer ran this iteration"""
+        times = {}
+        for attr, name in OPTIMIZER_TIMERS:
+            timer = getattr(self.trainer.optimizer, attr, None)
+            if timer is None:
+                continue
+            # TimerStat only exposes a mean over a window, its running total gives the time of this iteration
+            total = timer._total_time
+            times[name] = total - self.timer_totals.get(attr, 0.0)
+            self.timer_totals[attr] = total
+        return times
+
+    def postprocess_times(self):
+        """Postprocessing time of every policy summed over the workers"""
+        workers = self.trainer.workers
+        worker_times = [pop_postprocess_times()]
+        worker_times += ray.get([worker.apply.remote(pop_postprocess_times) for worker in workers.remote_workers()])
+        times = defaultdict(float)
+        for worker_time in worker_times:
+            for policy_id, policy_time in worker_time.items():
+                times[policy_id] += policy_time
+        return times
+
+    def collect(self, result):
+        """Return the timing of this iteration and reset the counters. Every key is always present, since tune
+        only writes the columns of the first result to progress.csv"""
+        missing = np.nan if self.first_iteration else 0.0
+        timing = self.optimizer_times()
+        postprocess_times = self.postprocess_times()
+        timing['postprocess_s'] = sum(postprocess_times.values())
+        timing['postprocess_s_per_policy'] = {policy_id: postprocess_times.get(policy_id, 0.0)
+                                              for policy_id in self.policy_ids}
+        learn_ids = sorted(set(self.policy_ids) | set(self.learn_times.keys()))
+        timing['learn_s_per_policy'] = {policy_id: self.learn_times.get(policy_id, missing) for policy_id in learn_ids}
+        if hasattr(self.trainer.optimizer, 'optimizers'):
+            timing['load_s_per_policy'] = {policy_id: self.load_times.get(policy_id, missing)
+                                           for policy_id in self.policy_ids}
+        timing['filter_sync_s'] = self.times.get('filter_sync_s', missing)
+        timing['callback_s'] = dict(self.callback_times)
+        timing['callback_s']['total'] = sum(self.callback_times.values())
+        timing['iteration_s'] = result.get('time_this_iter_s', np.nan)
+
+        self.learn_times.clear()
+        self.load_times.clear()
+        self.times.clear()
+        self.callback_times.clear()
+        self.first_iteration = False
+        return timing
+
+
+def get_iteration_timer(trainer):
+    """The IterationTimer of trainer, made on the first call"""
+    if not hasattr(trainer, 'iteration_timer'):
+        trainer.iteration_timer = IterationTimer(trainer)
+    return trainer.iteration_timer
@@ -0,0 +1,190 @@
+"""Spans across the driver, the rollout workers and the transfer test evaluators, written as a Chrome trace.
+
+Every process keeps the spans it recorded in a buffer. Once per iteration the driver collects the buffers of the
+workers and the evaluators and appends them to <trial logdir>/trace.json, in the json array format of the trace event
+format, so the file can be opened in chrome://tracing or https://ui.perfetto.dev at any point of the run. The spans
+are
+    driver: optimizer step, get_weights (weight sync), learn_on_batch / optimize of every policy, filter sync and the
+        parts of on_train_result, plus one span per iteration
+    rollout workers: env step and compute_actions, which are sampled, postprocessing of every policy
+    evaluators: checkpoint restore, set_weights and run_tests
+The env step and compute_actions run for every step of every env, so only one in sample_every of their calls is
+recorded. Tracing is off unless env_config['trace']['enabled'] is set.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+import ray
+
+_config = {'enabled': False, 'sample_every': 100}
+_events = []
+_call_counts = defaultdict(int)
+_named_processes = set()
+
+
+def configure(trace_config, process_name):
+    """Turn tracing in this process on or off and name the process in the trace"""
+    if trace_config is None:
+        return
+    _config.update(trace_config)
+    if _config['enabled'] and os.getpid() not in _named_processes:
+        _named_processes.add(os.getpid())
+        _events.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                        'args': {'name': '{} {}'.format(process_name, os.getpid())}})
+
+
+def enabled():
+    return _config['enabled']
+
+
+def add_span(name, cat, start, end, args=None):
+    _events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                    'pid': os.getpid(), 'tid': threading.current_thread().ident, 'args': args or {}})
+
+
+@contextmanager
+def span(name, cat='', sampled=False, args=None):
+    """Record the time spent in the block as a span. If sampled, only one in sample_every calls is recorded"""
+    if not _config['enabled']:
+        yield
+        return
+    if sampled:
+        _call_counts[name] += 1
+        if _call_counts[name] % _config['sample_every'] != 0:
+            yield
+            return
+        args = dict(args or {}, sampled_one_in=_config['sample_every'])
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, cat, start, time.time(), args)
+
+
+def traced(fn, name, cat='', sampled=False):
+    """fn, recording every call (or one in sample_every) as a span"""
+    def traced_fn(*args, **kwargs):
+        with span(name, cat, sampled):
+            return fn(*args, **kwargs)
+    return traced_fn
+
+
+def pop_trace_events(worker=None):
+    """Return the spans recorded in this process and clear them. Takes the worker to be used with worker.apply"""
+    events = list(_events)
+    del _events[:]
+    return events
+
+
+def instrument_rollout_worker(base_env, policy_map):
+    """Trace the env steps, the action computation and the postprocessing of a rollout worker. Called from
+    on_episode_start, it only instruments each env and policy once"""
+    if not getattr(base_env, 'traced', False):
+        trace_config = None
+        for policy in policy_map.values():
+            trace_config = policy.config.get('env_config', {}).get('trace')
+        configure(trace_config, 'rollout worker')
+        base_env.traced = True
+        if not enabled():
+            return
+        base_env.send_actions = traced(base_env.send_actions, 'env.step', 'worker', sampled=True)
+        from ray.rllib.evaluation import sampler
+        if hasattr(sampler, '_do_policy_eval') and not hasattr(sampler._do_policy_eval, 'traced'):
+            # the sampler computes the actions of all the policies together, through the graph for tf policies
+            sampler._do_policy_eval = traced(sampler._do_policy_eval, 'compute_actions', 'worker', sampled=True)
+            sampler._do_policy_eval.traced = True
+    if not enabled():
+        return
+    for policy_id, policy in policy_map.items():
+        if not getattr(policy, 'postprocess_traced', False):
+            policy.postprocess_trajectory = traced(policy.postprocess_trajectory, 'postprocess/' + policy_id,
+                                                   'worker')
+            policy.postprocess_traced = True
+
+
+class TraceCollector(object):
+    """Instruments the driver side of a trainer and appends the spans of every process to a trace file once per
+    iteration.
+
+    Parameters
+    ----------
+    trainer: (Trainer)
+        The trainer to trace. Its optimizer has to exist already, so this is made in on_train_result
+    trace_config: (dict)
+        enabled and sample_every
+    path: (str)
+        The trace file
+    """
+
+    def __init__(self, trainer, trace_config, path):
+        configure(trace_config, 'driver')
+        self.trainer = trainer
+        self.path = path
+        # a restored trial keeps appending to the trace of its previous run
+        self.num_written = int(os.path.exists(path) and os.path.getsize(path) > 0)
+        self.iteration_start = time.time()
+        self.pending_evaluators = {}
+        self.instrument()
+
+    def instrument(self):
+        trainer = self.trainer
+        optimizer = trainer.optimizer
+        local_worker = trainer.workers.local_worker()
+        optimizer.step = traced(optimizer.step, 'optimizer.step', 'driver')
+        local_worker.get_weights = traced(local_worker.get_weights, 'get_weights', 'driver')
+        if hasattr(optimizer, 'optimizers'):
+            for policy_id, tower_stack in optimizer.optimizers.items():
+                tower_stack.load_data = traced(tower_stack.load_data, 'load_data/' + policy_id, 'driver')
+                tower_stack.optimize = traced(tower_stack.optimize, 'optimize/' + policy_id, 'driver')
+        else:
+            local_worker.learn_on_batch = traced(local_worker.learn_on_batch, 'learn_on_batch', 'driver')
+        if hasattr(trainer, '_sync_filters_if_needed'):
+            trainer._sync_filters_if_needed = traced(trainer._sync_filters_if_needed, 'filter_sync', 'driver')
+
+    def evaluator_events(self, evaluators):
+        """The spans of the evaluators that are ready. An evaluator runs its calls in order, so the spans are asked
+        for without waiting and collected once the evaluation before them is done"""
+        events = []
+        if len(self.pending_evaluators) > 0:
+            ready, _ = ray.wait(list(self.pending_evaluators.keys()), num_returns=len(self.pending_evaluators),
+                                timeout=0)
+            for object_id in ready:
+                events += ray.get(object_id)
+                del self.pending_evaluators[object_id]
+        pending = set(self.pending_evaluators.values())
+        for i, evaluator in enumerate(evaluators):
+            if i not in pending:
+                self.pending_evaluators[evaluator.pop_trace_events.remote()] = i
+        return events
+
+    def collect(self, evaluators=()):
+        """Append the spans of this iteration of every process to the trace file"""
+        end = time.time()
+        add_span('iteration {}'.format(self.trainer.iteration), 'driver', self.iteration_start, end,
+                 {'iteration': self.trainer.iteration})
+        self.iteration_start = end
+        events = pop_trace_events()
+        events += sum(ray.get([worker.apply.remote(pop_trace_events)
+                               for worker in self.trainer.workers.remote_workers()]), [])
+        events += self.evaluator_events(evaluators)
+        if len(events) == 0:
+            return
+        # the closing bracket is optional in the json array format, so the file is valid after every iteration
+        with open(self.path, 'a') as f:
+            for event in events:
+                f.write(('[\n' if self.num_written == 0 else ',\n') + json.dumps(event))
+                self.num_written += 1
+
+
+def get_trace_collector(trainer, trace_config):
+    """The TraceCollector of trainer, made on the first call. None if tracing is off"""
+    if trace_config is None or not trace_config.get('enabled', False):
+        return None
+    if not hasattr(trainer, 'trace_collector'):
+        trainer.trace_collector = TraceCollector(trainer, trace_config, os.path.join(trainer.logdir, 'trace.json'))
+    return trainer.trace_collector
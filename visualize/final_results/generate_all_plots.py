@@ -1,13 +1,22 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
 import os
 import string
 
 import matplotlib
+# the figures are rendered in worker processes without a display
+matplotlib.use('Agg')
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 import numpy as np
 
 from visualize.plot_heatmap import make_heatmap
 from visualize.plot_heatmap import load_data, load_data_by_name
+from utils.results_index import INDEX_FILE_NAME, ResultsIndex
+from utils.results_store import match_test_index, walk_result_dirs
+from utils.stats import bootstrap_ci, paired_bootstrap_ci
 from visualize.mujoco.transfer_tests import cheetah_grid, cheetah_mass_sweep, ant_run_list, hopper_run_list, hopper_friction_sweep, hopper_mass_sweep, ant_mass_sweep, ant_friction_sweep
 
 
@@ -83,9 +92,108 @@ def plot_across_folders(folder_list, test_names, file_names, legend_names, open_
     plt.close()
 
 
+def iter_test_rewards(outer_folder, test_names, open_cmd=lambda x: np.loadtxt(x), store=None, checkpoint='latest'):
+    """Yield (seed, test index, rewards) for every result of the tests in outer_folder from the checkpoint of every
+    trial given by checkpoint, see utils/results_store.py walk_result_dirs. If a ResultsStore is passed, outer_folder
+    is the experiment name and the results are read from the store instead of walking the folder."""
+    if store is not None:
+        test_idx = {test_name: i for i, test_name in enumerate(test_names)}
+        for (trial, seed, test_name), rewards in store.load_rewards(outer_folder, test_names, checkpoint).items():
+            yield seed, test_idx[test_name], rewards
+        return
+    for dirpath, filenames, trial, seed, _ in walk_result_dirs(outer_folder, checkpoint):
+        for file in filenames:
+            test_idx = match_test_index(file, test_names)
+            if test_idx is not None:
+                yield seed, test_idx, np.atleast_1d(open_cmd(os.path.join(dirpath, file)))
+
+
+def load_reward_tensor(outer_folder_list, test_names, open_cmd=lambda x: np.loadtxt(x), store=None,
+                       checkpoint='latest'):
+    """Load the per rollout rewards into an (experiment, seed, test, rollout) array padded with NaN"""
+    results = [list(iter_test_rewards(folder, test_names, open_cmd, store, checkpoint))
+               for folder in outer_folder_list]
+    seeds = sorted(set(seed for result in results for seed, _, _ in result if seed is not None))
+    seed_idx = {seed: i for i, seed in enumerate(seeds)}
+    num_rollouts = max([len(rewards) for result in results for _, _, rewards in result] + [1])
+    tensor = np.full((len(outer_folder_list), max(len(seeds), 1), len(test_names), num_rollouts), np.nan)
+    for i, result in enumerate(results):
+        for seed, test_idx, rewards in result:
+            if seed is not None:
+                tensor[i, seed_idx[seed], test_idx, :len(rewards)] = rewards
+    return tensor
+
+
+def load_seed_means(results_index, outer_folder_list, test_names):
+    """(experiment, seed, test) array of the mean reward of every seed, NaN where a result is missing"""
+    results = [list(results_index.test_means(folder, test_names)) for folder in outer_folder_list]
+    seeds = sorted(set(seed for result in results for seed, _, _ in result), key=lambda seed: (seed is None, seed))
+    seed_idx = {seed: i for i, seed in enumerate(seeds)}
+    means = np.full((len(outer_folder_list), max(len(seeds), 1), len(test_names)), np.nan)
+    for i, result in enumerate(results):
+        for seed, test_idx, mean in result:
+            means[i, seed_idx[seed], test_idx] = mean
+    return means
+
+
+def ci_error_bars(values, lower, upper):
+    """Asymmetric yerr for plt.bar from a confidence interval around values"""
+    return np.maximum(np.vstack((values - lower, upper - values)), 0.0)
+
+
+def plot_paired_across_seeds(outer_folder_list, test_names, file_name, legend_names, baseline_idx=0,
+                             ylabel='Reward diff. to baseline', open_cmd=lambda x: np.loadtxt(x), yaxis=None, title='',
+                             fontsize=14, title_fontsize=16, store=None, num_resamples=2000, checkpoint='latest'):
+    """Plot the paired difference in reward of each experiment against the experiment at `baseline_idx`.
+
+    This is meant for results run with common random numbers (transfer_tests.py --crn_seed). Then rollout k of a
+    test saw the same initial state and action noise in every experiment, so we difference the rewards rollout by
+    rollout within each seed and test instead of comparing the independent means. The error bars are the 95% bootstrap
+    confidence interval over the seeds. Raises a ValueError if a paired seed and test does not cover the rollout
+    indices 0..n-1 in both experiments, see utils/stats.py check_rollout_coverage.
+    """
+    rewards = load_reward_tensor(outer_folder_list, test_names, open_cmd, store, checkpoint)
+    means, lower, upper, prob_better = paired_bootstrap_ci(rewards, baseline_idx, num_resamples, seed=0)
+    for i, folder in enumerate(outer_folder_list):
+        if np.isnan(means[i]):
+            print('No seeds of {} could be paired with the baseline'.format(folder))
+    colors = cm.rainbow(np.linspace(0.1, 0.5, len(outer_folder_list)))
+
+    plt.figure()
+    plt.bar(np.arange(len(outer_folder_list)), means, color=colors, capsize=3,
+            yerr=ci_error_bars(means, lower, upper), alpha=0.7)
+    plt.axhline(0, color='k', linewidth=1)
+    plt.grid(zorder=0, linestyle='-.', alpha=0.5)
+    plt.xticks(np.arange(len(legend_names)), legend_names, fontsize=fontsize, rotation=45)
+    plt.ylabel(ylabel, fontsize=fontsize)
+    if yaxis:
+        plt.ylim(yaxis)
+    plt.title(title, pad=10, fontsize=title_fontsize)
+    plt.tight_layout()
+    plt.savefig(file_name, bbox_inches='tight')
+    plt.close()
+
+    with open(file_name + '_paired_mean_ci.txt', 'w') as file:
+        file.write('name mean_diff lower upper prob_better\n')
+        for i in range(len(outer_folder_list)):
+            file.write('{} {} {} {} {}\n'.format(legend_names[i], means[i], lower[i], upper[i], prob_better[i]))
+    return means, lower, upper
+
+
 def plot_across_seeds(outer_folder_list, test_names, file_names, legend_names, num_seeds, ylabel='Avg. Reward',
                       open_cmd=lambda x: np.loadtxt(x), yaxis=None, titles=[], fontsize=14, title_fontsize=16,
-                      use_std=False, avg_across_tests=False, validation_set=False):
+                      use_std=False, avg_across_tests=False, validation_set=False, paired_baseline=None, store=None,
+                      results_index=None, error_bars='std', num_resamples=2000, checkpoint='latest'):
+    """Bar charts of the mean reward across seeds. error_bars is 'std' for the spread of the seed means or
+    'bootstrap' for a 95% bootstrap confidence interval of the mean across seeds, see utils/stats.py. With a store,
+    checkpoint picks the checkpoint of every trial that is plotted"""
+    if paired_baseline is not None:
+        # results evaluated with common random numbers are compared pairwise against the baseline experiment
+        file_name = file_names if avg_across_tests else file_names[-1]
+        plot_paired_across_seeds(outer_folder_list, test_names, file_name, legend_names, paired_baseline,
+                                 open_cmd=open_cmd, title=titles[-1] if len(titles) > 0 else '', fontsize=fontsize,
+                                 title_fontsize=title_fontsize, store=store, checkpoint=checkpoint)
+        return
     test_results = np.zeros((len(test_names), len(outer_folder_list)))
     # indexed by [test_name, result_for given experiment]. Each internal element will be a list of length
     # number of seeds or number of hyperparameters
@@ -96,15 +204,15 @@ def plot_across_seeds(outer_folder_list, test_names, file_names, legend_names, n
         colors = cm.rainbow(np.linspace(0.6, 1.0, len(outer_folder_list)))
     if not validation_set:
         use_std = False
+    if results_index is None:
+        results_index = ResultsIndex(open_cmd, store, checkpoint=checkpoint)
     for i, folder in enumerate(outer_folder_list):
-        for (dirpath, dirnames, filenames) in os.walk(folder):
-            for file in filenames:
-                found_idx = ['_' + test_name + '_' in file and '.png' not in file for test_name in test_names]
-                if np.sum(found_idx) > 0:
-                    idx = np.where(np.array(found_idx) > 0)
-                    test_idx = idx[0][0]
-                    test_results[test_idx, i] += np.mean(open_cmd(os.path.join(dirpath, file)))
-                    std_deviations[i][test_idx].append(np.mean(open_cmd(os.path.join(dirpath, file))))
+        for _, test_idx, mean in results_index.test_means(folder, test_names):
+            test_results[test_idx, i] += mean
+            std_deviations[i][test_idx].append(mean)
+    if use_std and error_bars == 'bootstrap':
+        _, ci_lower, ci_upper = bootstrap_ci(load_seed_means(results_index, outer_folder_list, test_names),
+                                             num_resamples, avg_across_tests=avg_across_tests, seed=0)
 
     if avg_across_tests:
         std_deviations = np.sqrt(np.var(test_results, axis=0)/(num_seeds * len(test_names)))
@@ -114,6 +222,8 @@ def plot_across_seeds(outer_folder_list, test_names, file_names, legend_names, n
         if use_std:
             # we compute the std deviation of the means across the seeds
             stds = std_deviations
+            if error_bars == 'bootstrap':
+                stds = ci_error_bars(test_results, ci_lower, ci_upper)
             ax = plt.bar(np.arange(len(outer_folder_list)), test_results, color=colors,
                              capsize=3,
                              yerr=stds, alpha=0.7)
@@ -137,6 +247,10 @@ def plot_across_seeds(outer_folder_list, test_names, file_names, legend_names, n
             with open(file_names + '_' + legend_names[i] + '_' + 'mean_std.txt', 'w') as file:
                 file.write('name mean std')
                 file.write(str(test_results[i]) + ' ' + str(std_deviations[i]) + '\n')
+            if use_std and error_bars == 'bootstrap':
+                with open(file_names + '_' + legend_names[i] + '_' + 'mean_ci.txt', 'w') as file:
+                    file.write('name mean lower upper\n')
+                    file.write('{} {} {}\n'.format(test_results[i], ci_lower[i], ci_upper[i]))
 
     else:
         for i, test in enumerate(test_names):
@@ -160,6 +274,8 @@ def plot_across_seeds(outer_folder_list, test_names, file_names, legend_names, n
             if use_std:
                 # we compute the std deviation of the means across the seeds
                 stds = [np.std(exp[i]) for exp in std_deviations]
+                if error_bars == 'bootstrap':
+                    stds = ci_error_bars(test_results[i, :] / num_seeds, ci_lower[:, i], ci_upper[:, i])
                 ax = plt.bar(np.arange(len(outer_folder_list)) + dist * i, test_results[i, :] / num_seeds, color=colors, capsize=3,
                              yerr=stds, alpha=0.7)
             else:
@@ -187,17 +303,18 @@ def plot_across_seeds(outer_folder_list, test_names, file_names, legend_names, n
 
 
 def plot_across_seeds_heatmap(exp_type, mass_sweep, friction_sweep, outer_folder_list, test_names, file_name, num_seeds,
-                      titles=[], open_cmd=lambda x: np.loadtxt(x), fontsize=22, title_fontsize=16):
+                      titles=[], open_cmd=lambda x: np.loadtxt(x), fontsize=22, title_fontsize=16, store=None,
+                      results_index=None, ci_file_name=None, num_resamples=2000, checkpoint='latest'):
+    """Heatmaps of the mean reward across seeds over the mass / friction sweep. If ci_file_name is a list of files,
+    the width of the 95% bootstrap confidence interval of every cell is plotted into them as well. With a store,
+    checkpoint picks the checkpoint of every trial that is plotted."""
 
     test_results = np.zeros((len(test_names), len(outer_folder_list)))
+    if results_index is None:
+        results_index = ResultsIndex(open_cmd, store, checkpoint=checkpoint)
     for i, folder in enumerate(outer_folder_list):
-        for (dirpath, dirnames, filenames) in os.walk(folder):
-            for file in filenames:
-                found_idx = ['_' + test_name + '_' in file and '.png' not in file for test_name in test_names]
-                if np.sum(found_idx) > 0:
-                    idx = np.where(np.array(found_idx) > 0)
-                    test_idx = idx[0][0]
-                    test_results[test_idx, i] += np.mean(open_cmd(os.path.join(dirpath, file)))
+        for _, test_idx, mean in results_index.test_means(folder, test_names):
+            test_results[test_idx, i] += mean
     for i in range(len(outer_folder_list)):
         means = test_results[:,i].reshape(len(mass_sweep), len(friction_sweep)) / num_seeds
         fig = plt.figure()
@@ -227,68 +344,173 @@ def plot_across_seeds_heatmap(exp_type, mass_sweep, friction_sweep, outer_folder
         plt.savefig(file_name[i], bbox_inches='tight')
         plt.close()
 
+    if ci_file_name is not None:
+        _, ci_lower, ci_upper = bootstrap_ci(load_seed_means(results_index, outer_folder_list, test_names),
+                                             num_resamples, seed=0)
+        for i in range(len(outer_folder_list)):
+            widths = (ci_upper[i] - ci_lower[i]).reshape(len(mass_sweep), len(friction_sweep))
+            plt.figure()
+            plt.imshow(widths.T, interpolation='nearest', cmap='viridis', aspect='equal')
+            plt.title('{} 95% CI width'.format(titles[i]), fontsize=title_fontsize)
+            plt.yticks(ticks=np.arange(len(mass_sweep)), labels=["{:0.2f}".format(x) for x in mass_sweep], fontsize=10)
+            plt.ylabel("Mass coef", fontsize=fontsize)
+            plt.xticks(ticks=np.arange(len(friction_sweep)), labels=["{:0.2f}".format(x) for x in friction_sweep],
+                       fontsize=10)
+            plt.xlabel("Friction coef", fontsize=fontsize)
+            plt.colorbar()
+            plt.tight_layout()
+            plt.savefig(ci_file_name[i], bbox_inches='tight')
+            plt.close()
 
-if __name__ == '__main__':
-    ### CONSTANTS
-    fontsize = 22
-    title_fontsize = 24
-    ###################################################################################################################
-    ######################################### CHEETAH #########################################################
-    ###################################################################################################################
 
-    ###########################################################
-    curr_path = os.path.abspath(__file__)
-    data_dir = os.path.abspath(os.path.join(curr_path, '../../../data/cheetah')) + '/'
+def plot_policy_correlation(input_file, output_file, title, fontsize=18, title_fontsize=20):
+    with open(input_file, 'rb') as file:
+        results = np.loadtxt(file)
 
-    ##############################################################
-    # generate the bar charts comparing 0 adv, dr, and 5 adv for hopper
-    # generate validation set bar charts
-    test_names = []
-    cheetah_friction_sweep_good = np.linspace(0.5, 1.5, 11)
-    cheetah_friction_sweep_bad = np.linspace(0.1, 0.9, 11)
-    transfer_test_names_good = []
-    transfer_test_names_bad = []
-
-    cheetah_grid_good = np.meshgrid(cheetah_mass_sweep, cheetah_friction_sweep_good)
-    for mass, fric in np.vstack((cheetah_grid_good[0].ravel(), cheetah_grid_good[1].ravel())).T:
-        transfer_test_names_good.append('m_{}_f_{}'.format(mass, fric))
-
-    cheetah_grid_bad = np.meshgrid(cheetah_mass_sweep, cheetah_friction_sweep_bad)
-    for mass, fric in np.vstack((cheetah_grid_bad[0].ravel(), cheetah_grid_bad[1].ravel())).T:
-        transfer_test_names_bad.append('m_{}_f_{}'.format(mass, fric))
-
-    output_files = 'final_plots/cheetah/hc_compare_valid_all_seeds_good.png'
-    file_names_good = [data_dir + 'hc_0adv_concat1_seed_good/',
-                  data_dir + 'hc_0adv_concat1_seed_dr_good/',
-                  data_dir + 'hc_1adv_concat1_seed_str0p1_good/',
-                  data_dir + 'hc_3adv_concat1_seed_str0p1_norew_good/',
-                  data_dir + 'hc_5adv_concat1_seed_str0p1_norew_good/']
-    legend_names = ['0 Adv', 'DR', '1 Adv', '3 Adv', '5 Adv']
-    titles = ['Cheetah, Valid. Set Reward - Good Param.']
+    plt.figure()
+    plt.tight_layout()
+    plt.imshow(results, interpolation='nearest', cmap='seismic', aspect='equal', vmin=400, vmax=3600)
+    plt.colorbar()
+    plt.yticks(ticks=np.arange(results.shape[1]))
+    plt.xticks(ticks=np.arange(results.shape[0]))
+    plt.ylabel('agent seed index', fontsize=fontsize)
+    plt.xlabel('adversary seed index', fontsize=fontsize)
+    plt.title(title, fontsize=title_fontsize)
+    plt.savefig(output_file, bbox_inches="tight")
+    plt.close()
 
-    plot_across_seeds(file_names_good, transfer_test_names_good, output_files, legend_names, num_seeds=10, yaxis=[0, 7000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True)
-    output_files = ['final_plots/cheetah/hc_heat0adv_good.png', 'final_plots/cheetah/hc_heatdr_good.png', 'final_plots/cheetah/hc_heat1adv_good.png', 'final_plots/cheetah/hc_heat3adv_good.png', 'final_plots/cheetah/hc_heat5adv_good.png']
-    plot_across_seeds_heatmap(exp_type='cheetah', mass_sweep=cheetah_mass_sweep, friction_sweep=cheetah_friction_sweep_good,  outer_folder_list=file_names_good, test_names=transfer_test_names_good, file_name=output_files,
-                       titles=legend_names, num_seeds=10, title_fontsize=title_fontsize)
 
+class FigureTask(object):
+    """One plotting call of the paper figures and the results it is built from
+
+    Parameters
+    ----------
+    name: (str)
+        Unique name of the task, used as its key in the manifest
+    plot_fn: (function)
+        Module level plotting function, it is called in a worker process as plot_fn(**kwargs)
+    kwargs: (dict)
+        Arguments to plot_fn
+    inputs: (list)
+        Result folders or files the figure is built from
+    outputs: (list)
+        Files the plotting call writes, if any of them is missing the figure is rebuilt
+    """
+
+    def __init__(self, name, plot_fn, kwargs, inputs, outputs):
+        self.name = name
+        self.plot_fn = plot_fn
+        self.kwargs = kwargs
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def input_hash(self, signatures):
+        """Hash of the plotting arguments and the signatures of every input"""
+        task_hash = hashlib.sha1()
+        task_hash.update(self.plot_fn.__name__.encode())
+        task_hash.update(json.dumps(self.kwargs, sort_keys=True, default=str).encode())
+        for path in self.inputs:
+            task_hash.update(signatures[path].encode())
+        return task_hash.hexdigest()
+
+    def outputs_exist(self):
+        # savefig adds the extension when it is missing from the name
+        return all(os.path.exists(path) or os.path.exists(path + '.png') for path in self.outputs)
+
+
+def path_signature(path):
+    """Cheap signature of a results folder or file: the name, size and modification time of every file in it"""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return '{} {} {}'.format(path, stat.st_size, stat.st_mtime_ns)
+    entries = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for file in filenames:
+            # the results index is a cache of the results, not an input
+            if file == INDEX_FILE_NAME:
+                continue
+            stat = os.stat(os.path.join(dirpath, file))
+            entries.append('{} {} {}'.format(os.path.relpath(os.path.join(dirpath, file), path), stat.st_size,
+                                             stat.st_mtime_ns))
+    return '\n'.join(sorted(entries))
+
+
+def run_figure_task(task):
+    for path in task.outputs:
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    task.plot_fn(**task.kwargs)
+    return task.name
+
+
+def build_figures(tasks, manifest_path, num_workers=None, force=False):
+    """Render every task whose inputs changed since the last build in a process pool. The input hashes of the
+    built tasks are kept in the json manifest at manifest_path."""
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+    # every folder is only scanned once even if many figures use it
+    signatures = {path: path_signature(path) for path in set(path for task in tasks for path in task.inputs)}
+    hashes = {task.name: task.input_hash(signatures) for task in tasks}
+    stale_tasks = [task for task in tasks if manifest.get(task.name) != hashes[task.name] or not task.outputs_exist()]
+    print('Building {} of {} figures'.format(len(stale_tasks), len(tasks)))
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(run_figure_task, task) for task in stale_tasks]
+        for future in futures:
+            try:
+                name = future.result()
+            except Exception as e:
+                print('Failed to build a figure: ', e)
+                continue
+            manifest[name] = hashes[name]
+            print('Built ', name)
+            # written after every figure so an interrupted build keeps the finished figures
+            with open(manifest_path, 'w') as file:
+                json.dump(manifest, file, indent=2, sort_keys=True)
+
+
+def plot_seed_bars(std_file_name, **kwargs):
+    """The per test bar charts across seeds, then the same charts with the std across seeds. Both calls write the per
+    test files so they run in the same task."""
+    plot_across_seeds(**kwargs)
+    kwargs['file_names'] = kwargs['file_names'][:-1] + [std_file_name]
+    plot_across_seeds(use_std=True, **kwargs)
+
+
+def seed_plot_task(name, file_names, test_names, legend_names, output_prefix, compare_name, std_compare_name, yaxis,
+                   fontsize, title_fontsize, error_bars='std'):
+    output_files = [output_prefix + test_name for test_name in test_names] + [compare_name]
+    titles = ['blah' for i in range(len(test_names))] + ['Average reward on test set across 10 seeds']
+    kwargs = dict(std_file_name=std_compare_name, outer_folder_list=file_names, test_names=test_names,
+                  file_names=output_files, legend_names=legend_names, num_seeds=10, yaxis=yaxis, titles=titles,
+                  fontsize=fontsize, title_fontsize=title_fontsize, error_bars=error_bars)
+    return FigureTask(name, plot_seed_bars, kwargs, file_names, output_files + [std_compare_name])
 
-    output_files = 'final_plots/cheetah/hc_compare_valid_all_seeds_bad.png'
-    file_names_bad = [data_dir + 'hc_0adv_concat1_seed_bad/',
-                  data_dir + 'hc_0adv_concat1_seed_dr_bad/',
-                  data_dir + 'hc_1adv_concat1_seed_str0p1_bad/',
-                  data_dir + 'hc_3adv_concat1_seed_str0p1_norew_bad/',
-                  data_dir + 'hc_5adv_concat1_seed_str0p1_norew_bad/']
-    legend_names = ['0 Adv', 'DR', '1 Adv', '3 Adv', '5 Adv']
-    titles = ['Cheetah, Valid. Set Reward - Bad Param.']
 
-    plot_across_seeds(file_names_bad, transfer_test_names_bad, output_files, legend_names, num_seeds=10, yaxis=[0, 7000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True)
-    output_files = ['final_plots/cheetah/hc_heat0adv_bad.png', 'final_plots/cheetah/hc_heatdr_bad.png', 'final_plots/cheetah/hc_heat1adv_bad.png', 'final_plots/cheetah/hc_heat3adv_bad.png', 'final_plots/cheetah/hc_heat5adv_bad.png']
-    plot_across_seeds_heatmap(exp_type='cheetah', mass_sweep=cheetah_mass_sweep, friction_sweep=cheetah_friction_sweep_bad,  outer_folder_list=file_names_bad, test_names=transfer_test_names_bad, file_name=output_files,
-                      titles=legend_names, num_seeds=10, title_fontsize=title_fontsize)
+def heatmap_ci_files(output_files, error_bars):
+    """The files of the confidence interval heatmaps, which are only built with bootstrap error bars"""
+    if error_bars != 'bootstrap':
+        return None
+    return [name.replace('.png', '_ci.png') for name in output_files]
 
-    # generate the test set maps for the best validation set result
+
+def grid_test_names(mass_sweep, friction_sweep):
+    grid = np.meshgrid(mass_sweep, friction_sweep)
+    return ['m_{}_f_{}'.format(mass, fric) for mass, fric in np.vstack((grid[0].ravel(), grid[1].ravel())).T]
+
+
+def make_figure_tasks(data_root, fontsize=22, title_fontsize=24, error_bars='std'):
+    tasks = []
+    ###################################################################################################################
+    ######################################### CHEETAH #########################################################
+    ###################################################################################################################
+    data_dir = os.path.join(data_root, 'cheetah') + '/'
+    cheetah_friction_sweep_good = np.linspace(0.5, 1.5, 11)
+    cheetah_friction_sweep_bad = np.linspace(0.1, 0.9, 11)
+    legend_names = ['0 Adv', 'DR', '1 Adv', '3 Adv', '5 Adv']
     test_names = [
         'friction_hard_torsoheadfthighmax',
         'friction_hard_floorheadfshinmax',
@@ -299,75 +521,74 @@ if __name__ == '__main__':
         'friction_hard_bthighfthighfshinmax',
         'friction_hard_headfshinffootmax'
     ]
-
-    #good
-    output_files = 'final_plots/cheetah/hc_avg_test_all_seed_good.png'
-    titles = ['Cheetah, Test Set Reward - Good Param.']
-    plot_across_seeds(file_names_good, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 7000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize,avg_across_tests=True, use_std=True)
-
-    output_files = ['final_plots/cheetah/hc_seed_good_' + name for name in test_names]
-    output_files.append('final_plots/cheetah/compare_test_all_seed_good')
-    titles = ['blah' for i in range(len(test_names))] + ['Average reward on test set across 10 seeds']
-
-    plot_across_seeds(file_names_good, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 8000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize)
-    output_files[-1] = 'final_plots/cheetah/compare_test_all_seed_std_good'
-    plot_across_seeds(file_names_good, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 8000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize,use_std=True)
-
-    #bad
-    output_files = 'final_plots/cheetah/hc_avg_test_all_seed_bad.png'
-    titles = ['Cheetah, Test Set Reward - Bad Param.']
-    plot_across_seeds(file_names_bad, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 7000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, use_std=True)
-
-    output_files = ['final_plots/cheetah/hc_seed_bad_' + name for name in test_names]
-    output_files.append('final_plots/cheetah/compare_test_all_seed_bad')
-    titles = ['blah' for i in range(len(test_names))] + ['Average reward on test set across 10 seeds']
-
-    plot_across_seeds(file_names_bad, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 8000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize)
-    output_files[-1] = 'final_plots/cheetah/compare_test_all_seed_std_bad'
-    plot_across_seeds(file_names_bad, test_names, output_files, legend_names, num_seeds=10,yaxis=[0, 8000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, use_std=True)
+    for param, param_title, friction_sweep in [('good', 'Good', cheetah_friction_sweep_good),
+                                               ('bad', 'Bad', cheetah_friction_sweep_bad)]:
+        transfer_test_names = grid_test_names(cheetah_mass_sweep, friction_sweep)
+        file_names = [data_dir + 'hc_0adv_concat1_seed_{}/'.format(param),
+                      data_dir + 'hc_0adv_concat1_seed_dr_{}/'.format(param),
+                      data_dir + 'hc_1adv_concat1_seed_str0p1_{}/'.format(param),
+                      data_dir + 'hc_3adv_concat1_seed_str0p1_norew_{}/'.format(param),
+                      data_dir + 'hc_5adv_concat1_seed_str0p1_norew_{}/'.format(param)]
+
+        output_files = 'final_plots/cheetah/hc_compare_valid_all_seeds_{}.png'.format(param)
+        tasks.append(FigureTask('cheetah_valid_{}'.format(param), plot_across_seeds, dict(
+            outer_folder_list=file_names, test_names=transfer_test_names, file_names=output_files,
+            legend_names=legend_names, num_seeds=10, yaxis=[0, 7000],
+            titles=['Cheetah, Valid. Set Reward - {} Param.'.format(param_title)], fontsize=fontsize,
+            title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True,
+            error_bars=error_bars),
+            file_names, [output_files]))
+
+        output_files = ['final_plots/cheetah/hc_heat{}_{}.png'.format(name, param)
+                        for name in ['0adv', 'dr', '1adv', '3adv', '5adv']]
+        ci_files = heatmap_ci_files(output_files, error_bars)
+        tasks.append(FigureTask('cheetah_heatmaps_{}'.format(param), plot_across_seeds_heatmap, dict(
+            exp_type='cheetah', mass_sweep=cheetah_mass_sweep, friction_sweep=friction_sweep,
+            outer_folder_list=file_names, test_names=transfer_test_names, file_name=output_files,
+            titles=legend_names, num_seeds=10, title_fontsize=title_fontsize, ci_file_name=ci_files),
+            file_names, output_files + (ci_files or [])))
+
+        # generate the test set maps for the best validation set result
+        output_files = 'final_plots/cheetah/hc_avg_test_all_seed_{}.png'.format(param)
+        tasks.append(FigureTask('cheetah_test_{}'.format(param), plot_across_seeds, dict(
+            outer_folder_list=file_names, test_names=test_names, file_names=output_files,
+            legend_names=legend_names, num_seeds=10, yaxis=[0, 7000],
+            titles=['Cheetah, Test Set Reward - {} Param.'.format(param_title)], fontsize=fontsize,
+            title_fontsize=title_fontsize, avg_across_tests=True, use_std=True, error_bars=error_bars),
+            file_names, [output_files]))
+
+        tasks.append(seed_plot_task('cheetah_test_seed_{}'.format(param), file_names, test_names, legend_names,
+                                    'final_plots/cheetah/hc_seed_{}_'.format(param),
+                                    'final_plots/cheetah/compare_test_all_seed_{}'.format(param),
+                                    'final_plots/cheetah/compare_test_all_seed_std_{}'.format(param), [0, 8000],
+                                    fontsize, title_fontsize, error_bars))
 
     ###################################################################################################################
     ######################################### ANT #########################################################
     ###################################################################################################################
-
-    ###########################################################
-    curr_path = os.path.abspath(__file__)
-    data_dir = os.path.abspath(os.path.join(curr_path, '../../../data/ant')) + '/'
-
-    ##############################################################
-    # generate the bar charts comparing 0 adv, dr, and 5 adv for hopper
-    # generate validation set bar charts
-    transfer_test_names = []
-
-    ant_grid = np.meshgrid(ant_mass_sweep, ant_friction_sweep)
-    for mass, fric in np.vstack((ant_grid[0].ravel(), ant_grid[1].ravel())).T:
-        transfer_test_names.append('m_{}_f_{}'.format(mass, fric))
-
-
-    output_files = 'final_plots/ant/ant_compare_valid_all_seeds.png'
+    data_dir = os.path.join(data_root, 'ant') + '/'
+    transfer_test_names = grid_test_names(ant_mass_sweep, ant_friction_sweep)
     file_names = [data_dir + 'ant_0adv_concat1_seed/',
-                       data_dir + 'ant_0adv_concat1_seed_dr/',
-                       data_dir + 'ant_1adv_concat1_seed_str0p15/',
-                       data_dir + 'ant_3adv_concat1_seed_str0p15_norew/',
-                       data_dir + 'ant_5adv_concat1_seed_str0p15_norew/']
+                  data_dir + 'ant_0adv_concat1_seed_dr/',
+                  data_dir + 'ant_1adv_concat1_seed_str0p15/',
+                  data_dir + 'ant_3adv_concat1_seed_str0p15_norew/',
+                  data_dir + 'ant_5adv_concat1_seed_str0p15_norew/']
     legend_names = ['0 Adv', 'DR', '1 Adv', '3 Adv', '5 Adv']
-    titles = ['Ant, Validation Set Reward']
-
-    plot_across_seeds(file_names, transfer_test_names, output_files, legend_names, num_seeds=10,
-                      yaxis=[0, 7000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True)
-    output_files = ['final_plots/ant/ant_heat0adv.png', 'final_plots/ant/ant_heatdr.png', 'final_plots/ant/ant_heat1adv.png', 'final_plots/ant/ant_heat3adv.png', 'final_plots/ant/ant_heat5adv.png']
 
-    plot_across_seeds_heatmap(exp_type='ant', mass_sweep=ant_mass_sweep, friction_sweep=ant_friction_sweep,  outer_folder_list=file_names, test_names=transfer_test_names, file_name=output_files,
-                      titles=legend_names, num_seeds=10, title_fontsize=title_fontsize)
+    output_files = 'final_plots/ant/ant_compare_valid_all_seeds.png'
+    tasks.append(FigureTask('ant_valid', plot_across_seeds, dict(
+        outer_folder_list=file_names, test_names=transfer_test_names, file_names=output_files,
+        legend_names=legend_names, num_seeds=10, yaxis=[0, 7000], titles=['Ant, Validation Set Reward'],
+        fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True,
+            error_bars=error_bars),
+        file_names, [output_files]))
+
+    output_files = ['final_plots/ant/ant_heat{}.png'.format(name) for name in ['0adv', 'dr', '1adv', '3adv', '5adv']]
+    ci_files = heatmap_ci_files(output_files, error_bars)
+    tasks.append(FigureTask('ant_heatmaps', plot_across_seeds_heatmap, dict(
+        exp_type='ant', mass_sweep=ant_mass_sweep, friction_sweep=ant_friction_sweep, outer_folder_list=file_names,
+        test_names=transfer_test_names, file_name=output_files, titles=legend_names, num_seeds=10,
+        title_fontsize=title_fontsize, ci_file_name=ci_files), file_names, output_files + (ci_files or [])))
 
     # generate the test set maps for the best validation set result
     test_names = [
@@ -380,57 +601,28 @@ if __name__ == '__main__':
         'friction_hard_frla3rblmax',
         'friction_hard_a1rbla4max'
     ]
-
     output_files = 'final_plots/ant/ant_avg_test_all_seed.png'
-    titles = ['Ant, Test Set Reward']
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 7000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, use_std=True)
-
-    output_files = ['final_plots/ant/ant_seed_' + name for name in test_names]
-    output_files.append('final_plots/ant/compare_test_all_seed')
-    titles = ['blah' for i in range(len(test_names))] + ['Average reward on test set across 10 seeds']
-
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 8000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize)
-    output_files[-1] = 'final_plots/ant/compare_test_all_seed_std'
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 8000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, use_std=True)
+    tasks.append(FigureTask('ant_test', plot_across_seeds, dict(
+        outer_folder_list=file_names, test_names=test_names, file_names=output_files, legend_names=legend_names,
+        num_seeds=10, yaxis=[0, 7000], titles=['Ant, Test Set Reward'], fontsize=fontsize,
+        title_fontsize=title_fontsize, avg_across_tests=True, use_std=True, error_bars=error_bars),
+        file_names, [output_files]))
+    tasks.append(seed_plot_task('ant_test_seed', file_names, test_names, legend_names, 'final_plots/ant/ant_seed_',
+                                'final_plots/ant/compare_test_all_seed', 'final_plots/ant/compare_test_all_seed_std',
+                                [0, 8000], fontsize, title_fontsize, error_bars))
 
     ###################################################################################################################
     ######################################### HOPPER #########################################################
     ###################################################################################################################
-
-    ###########################################################
-    curr_path = os.path.abspath(__file__)
-    data_dir = os.path.abspath(os.path.join(curr_path, '../../../data/hopper')) + '/'
-
-    ##############################################################
-    # generate the bar charts comparing 0 adv, dr, and 5 adv for hopper
-    # generate validation set bar charts
-    transfer_test_names = []
-
-    hop_grid = np.meshgrid(hopper_mass_sweep, hopper_friction_sweep)
-    for mass, fric in np.vstack((hop_grid[0].ravel(), hop_grid[1].ravel())).T:
-        transfer_test_names.append('m_{}_f_{}'.format(mass, fric))
-
-    output_files = 'final_plots/hopper/hop_compare_valid_all_seeds.png'
+    data_dir = os.path.join(data_root, 'hopper') + '/'
+    transfer_test_names = grid_test_names(hopper_mass_sweep, hopper_friction_sweep)
     file_names = [data_dir + 'hop_0adv_concat1_seed/',
-                       data_dir + 'hop_0adv_concat1_seed_dr/',
-                       data_dir + 'hop_1adv_concat1_seed_str0p25/',
-                       data_dir + 'hop_3adv_concat1_seed_str0p25/',
-                       data_dir + 'hop_5adv_concat1_seed_str0p25_norew/']
+                  data_dir + 'hop_0adv_concat1_seed_dr/',
+                  data_dir + 'hop_1adv_concat1_seed_str0p25/',
+                  data_dir + 'hop_3adv_concat1_seed_str0p25/',
+                  data_dir + 'hop_5adv_concat1_seed_str0p25_norew/']
     legend_names = ['0 Adv', 'DR', '1 Adv', '3 Adv', '5 Adv']
-    titles = ['Hopper, Validation Set Reward']
-
-    plot_across_seeds(file_names, transfer_test_names, output_files, legend_names, num_seeds=10,
-                      yaxis=[0, 3000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True)
-
-    # generate the test set maps for the best validation set result
-    test_names = [
+    hopper_test_names = [
         'friction_hard_torsolegmax_floorthighfootmin',
         'friction_hard_floorthighmax_torsolegfootmin',
         'friction_hard_footlegmax_floortorsothighmin',
@@ -441,43 +633,38 @@ if __name__ == '__main__':
         'friction_hard_thighlegmax_floortorsofootmin',
     ]
 
-    output_files = 'final_plots/hopper/hop_avg_test_all_seed.png'
-    titles = ['Hopper, Test Set Reward']
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 3000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, use_std=True)
-    output_files = ['final_plots/hopper/hop_heat0adv.png', 'final_plots/hopper/hop_heatdr.png', 'final_plots/hopper/hop_heat1adv.png', 'final_plots/hopper/hop_heat3adv.png', 'final_plots/hopper/hop_heat5adv.png']
-    plot_across_seeds_heatmap(exp_type='hopper', mass_sweep=hopper_mass_sweep, friction_sweep=hopper_friction_sweep,  outer_folder_list=file_names, test_names=transfer_test_names, file_name=output_files,
-                      titles=legend_names, num_seeds=10, title_fontsize=title_fontsize)
-
-    output_files = ['final_plots/hopper/hop_seed_' + name for name in test_names]
-    output_files.append('final_plots/hopper/compare_test_all_seed')
-    titles = ['blah' for i in range(len(test_names))] + ['Average reward on test set across 10 seeds']
+    output_files = 'final_plots/hopper/hop_compare_valid_all_seeds.png'
+    tasks.append(FigureTask('hopper_valid', plot_across_seeds, dict(
+        outer_folder_list=file_names, test_names=transfer_test_names, file_names=output_files,
+        legend_names=legend_names, num_seeds=10, yaxis=[0, 3000], titles=['Hopper, Validation Set Reward'],
+        fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True,
+            error_bars=error_bars),
+        file_names, [output_files]))
 
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 3000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize)
-    output_files[-1] = 'final_plots/hopper/compare_test_all_seed_std'
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 3000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, use_std=True)
+    # generate the test set maps for the best validation set result
+    output_files = 'final_plots/hopper/hop_avg_test_all_seed.png'
+    tasks.append(FigureTask('hopper_test', plot_across_seeds, dict(
+        outer_folder_list=file_names, test_names=hopper_test_names, file_names=output_files,
+        legend_names=legend_names, num_seeds=10, yaxis=[0, 3000], titles=['Hopper, Test Set Reward'],
+        fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, use_std=True, error_bars=error_bars),
+        file_names, [output_files]))
+
+    output_files = ['final_plots/hopper/hop_heat{}.png'.format(name) for name in ['0adv', 'dr', '1adv', '3adv', '5adv']]
+    ci_files = heatmap_ci_files(output_files, error_bars)
+    tasks.append(FigureTask('hopper_heatmaps', plot_across_seeds_heatmap, dict(
+        exp_type='hopper', mass_sweep=hopper_mass_sweep, friction_sweep=hopper_friction_sweep,
+        outer_folder_list=file_names, test_names=transfer_test_names, file_name=output_files, titles=legend_names,
+        num_seeds=10, title_fontsize=title_fontsize, ci_file_name=ci_files),
+        file_names, output_files + (ci_files or [])))
+    tasks.append(seed_plot_task('hopper_test_seed', file_names, hopper_test_names, legend_names,
+                                'final_plots/hopper/hop_seed_', 'final_plots/hopper/compare_test_all_seed',
+                                'final_plots/hopper/compare_test_all_seed_std', [0, 3000], fontsize, title_fontsize,
+                                error_bars))
 
     ###################################################################################################################
     ######################################### HOPPER NUMADV #########################################################
     ###################################################################################################################
-
-    ###########################################################
-    curr_path = os.path.abspath(__file__)
-    data_dir = os.path.abspath(os.path.join(curr_path, '../../../data/hopper')) + '/'
-
-    ##############################################################
-    # generate the bar charts comparing 0 adv, dr, and 5 adv for hopper
-    # generate validation set bar charts
-    transfer_test_names = []
-    for test in hopper_run_list:
-        transfer_test_names.append(test[0])
-
-    output_files = 'final_plots/hopper/hop_compare_valid_all_seeds_numadv.png'
+    transfer_test_names = [test.name for test in hopper_run_list]
     file_names = [data_dir + 'hop_0adv_concat1_seed/',
                   data_dir + 'hop_1adv_concat1_seed_str0p25/',
                   data_dir + 'hop_2adv_concat1_seed_str0p25/',
@@ -487,78 +674,55 @@ if __name__ == '__main__':
                   data_dir + 'hop_9adv_concat1_seed_str0p25_norew/',
                   data_dir + 'hop_11adv_concat1_seed_str0p25_norew/']
     legend_names = ['0 Adv', '1 Adv', '2 Adv', '3 Adv', '5 Adv', '7 Adv', '9 Adv', '11 Adv']
-    titles = ['Hopper, Validation Set Reward']
 
-    plot_across_seeds(file_names, transfer_test_names, output_files, legend_names, num_seeds=10,
-                      yaxis=[0, 3000], titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True)
-
-    # generate the test set maps for the best validation set result
-    test_names = [
-        'friction_hard_torsolegmax_floorthighfootmin',
-        'friction_hard_floorthighmax_torsolegfootmin',
-        'friction_hard_footlegmax_floortorsothighmin',
-        'friction_hard_torsothighfloormax_footlegmin',
-        'friction_hard_torsofootmax_floorthighlegmin',
-        'friction_hard_floorthighlegmax_torsofootmin',
-        'friction_hard_floorfootmax_torsothighlegmin',
-        'friction_hard_thighlegmax_floortorsofootmin',
-    ]
+    output_files = 'final_plots/hopper/hop_compare_valid_all_seeds_numadv.png'
+    tasks.append(FigureTask('hopper_numadv_valid', plot_across_seeds, dict(
+        outer_folder_list=file_names, test_names=transfer_test_names, file_names=output_files,
+        legend_names=legend_names, num_seeds=10, yaxis=[0, 3000], titles=['Hopper, Validation Set Reward'],
+        fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, validation_set=True, use_std=True,
+            error_bars=error_bars),
+        file_names, [output_files]))
 
-    # good
     output_files = 'final_plots/hopper/hop_avg_test_all_seed_numadv.png'
-    titles = ['Hopper, Test Set Reward']
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 3000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, use_std=True)
-
-    output_files = ['final_plots/hopper/hop_test_seed_numadv_' + name for name in test_names]
-    output_files.append('final_plots/hopper/compare_test_all_seed_numadv')
-    titles = ['blah' for i in range(len(test_names))] + ['Average reward on test set across 10 seeds']
-
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 3000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize)
-    output_files[-1] = 'final_plots/hopper/compare_test_all_seed_std_numadv'
-    plot_across_seeds(file_names, test_names, output_files, legend_names, num_seeds=10, yaxis=[0, 3000],
-                      titles=titles,
-                      fontsize=fontsize, title_fontsize=title_fontsize, use_std=True)
+    tasks.append(FigureTask('hopper_numadv_test', plot_across_seeds, dict(
+        outer_folder_list=file_names, test_names=hopper_test_names, file_names=output_files,
+        legend_names=legend_names, num_seeds=10, yaxis=[0, 3000], titles=['Hopper, Test Set Reward'],
+        fontsize=fontsize, title_fontsize=title_fontsize, avg_across_tests=True, use_std=True, error_bars=error_bars),
+        file_names, [output_files]))
+    tasks.append(seed_plot_task('hopper_numadv_test_seed', file_names, hopper_test_names, legend_names,
+                                'final_plots/hopper/hop_test_seed_numadv_',
+                                'final_plots/hopper/compare_test_all_seed_numadv',
+                                'final_plots/hopper/compare_test_all_seed_std_numadv', [0, 3000], fontsize,
+                                title_fontsize, error_bars))
 
     ###################################################################################################################
     ######################################### HOPPER POLICY CORRELATION MATRIX #########################################
     ###################################################################################################################
-    adv_1_file = data_dir + 'policy_correlation_data/results_1adv.txt'
-
-    with open(adv_1_file, 'rb') as file:
-        adv_1_results = np.loadtxt(file)
-
-    plt.figure()
-    plt.tight_layout()
-    plt.imshow(adv_1_results, interpolation='nearest', cmap='seismic', aspect='equal', vmin=400, vmax=3600)
-    plt.colorbar()
-    fontsize = 18
-    title_fontsize = 20
-    plt.yticks(ticks=np.arange(adv_1_results.shape[1]))
-    plt.xticks(ticks=np.arange(adv_1_results.shape[0]))
-    plt.ylabel('agent seed index', fontsize=fontsize)
-    plt.xlabel('adversary seed index', fontsize=fontsize)
-    plt.title('1 Adversary', fontsize=title_fontsize)
-    plt.savefig('final_results/final_plots/hopper/adv_1_correlation.png', bbox_inches="tight")
+    for num_adv, title in [(1, '1 Adversary'), (3, '3 Adversaries')]:
+        input_file = data_dir + 'policy_correlation_data/results_{}adv.txt'.format(num_adv)
+        output_file = 'final_results/final_plots/hopper/adv_{}_correlation.png'.format(num_adv)
+        tasks.append(FigureTask('hopper_correlation_{}adv'.format(num_adv), plot_policy_correlation, dict(
+            input_file=input_file, output_file=output_file, title=title), [input_file], [output_file]))
 
-    adv_3_file = data_dir + 'policy_correlation_data/results_3adv.txt'
+    return tasks
 
-    with open(adv_3_file, 'rb') as file:
-        adv_3_results = np.loadtxt(file)
 
-    plt.figure()
-    plt.imshow(adv_3_results, interpolation='nearest', cmap='seismic', aspect='equal', vmin=400, vmax=3600)
-    plt.tight_layout()
-    plt.colorbar()
-    fontsize = 18
-    title_fontsize = 20
-    plt.yticks(ticks=np.arange(adv_3_results.shape[1]))
-    plt.xticks(ticks=np.arange(adv_3_results.shape[0]))
-    plt.ylabel('agent seed index', fontsize=fontsize)
-    plt.xlabel('adversary seed index', fontsize=fontsize)
-    plt.title('3 Adversaries', fontsize=title_fontsize)
-    plt.savefig('final_results/final_plots/hopper/adv_3_correlation.png', bbox_inches="tight")
+if __name__ == '__main__':
+    curr_path = os.path.abspath(__file__)
+    parser = argparse.ArgumentParser('Generate the paper figures')
+    parser.add_argument('--data_dir', type=str, default=os.path.abspath(os.path.join(curr_path, '../../../data')))
+    parser.add_argument('--manifest', type=str, default='final_plots/manifest.json',
+                        help='Where the input hashes of the built figures are kept')
+    parser.add_argument('--num_workers', type=int, default=None, help='Number of processes rendering figures')
+    parser.add_argument('--force', action='store_true', default=False, help='If true, rebuild every figure')
+    parser.add_argument('--only', type=str, default=None, help='Only build the figures whose name contains this')
+    parser.add_argument('--error_bars', type=str, default='std', choices=['std', 'bootstrap'],
+                        help='Error bars of the bar charts. With bootstrap the heatmaps of the CI widths are built too')
+    args = parser.parse_args()
+
+    tasks = make_figure_tasks(args.data_dir, error_bars=args.error_bars)
+    if args.only:
+        tasks = [task for task in tasks if args.only in task.name]
+    if os.path.dirname(args.manifest) and not os.path.exists(os.path.dirname(args.manifest)):
+        os.makedirs(os.path.dirname(args.manifest))
+    build_figures(tasks, args.manifest, args.num_workers, args.force)
@@ -0,0 +1,78 @@
+"""Evaluate checkpoints while the experiment that writes them is still training"""
+
+import os
+import re
+import threading
+import traceback
+
+from utils.rllib_utils import get_config_from_path
+
+
+def find_checkpoints(exp_dir):
+    """Return the sorted (trial dir, checkpoint number) of every checkpoint in a tune experiment dir whose save has
+    finished. Tune writes the .tune_metadata file after the checkpoint itself, so it marks a complete checkpoint."""
+    checkpoints = []
+    for (dirpath, dirnames, filenames) in os.walk(exp_dir):
+        match = re.match(r'^checkpoint_([0-9]+)$', os.path.basename(dirpath))
+        if match and 'checkpoint-{}.tune_metadata'.format(match.group(1)) in filenames:
+            checkpoints.append((os.path.dirname(dirpath), int(match.group(1))))
+    return sorted(checkpoints)
+
+
+class CheckpointWatcher(threading.Thread):
+    """Background thread that polls a tune experiment dir and calls evaluate_fn on every new checkpoint.
+
+    The evaluation runs on the ray cluster the driver is connected to (see transfer_tests.run_transfer_tests), so its
+    actors only get scheduled on the resources the trials are not using. The checkpoints are evaluated one at a time
+    in the order they are found. Every checkpoint of a trial ends up in the same results store, so the rows are
+    tagged with the trial and the iteration of the checkpoint and the plots pick the checkpoint they show, see
+    ResultsStore.select_rollouts.
+
+    Parameters
+    ----------
+    exp_dir: (str)
+        The tune experiment dir, e.g. ~/ray_results/<exp_title>
+    evaluate_fn: (function)
+        Called as evaluate_fn(rllib_config, checkpoint_path, tune_name) for every checkpoint
+    poll_interval: (float)
+        Seconds between two scans of exp_dir
+    """
+
+    def __init__(self, exp_dir, evaluate_fn, poll_interval=60):
+        super(CheckpointWatcher, self).__init__(daemon=True)
+        self.exp_dir = exp_dir
+        self.evaluate_fn = evaluate_fn
+        self.poll_interval = poll_interval
+        self.seen = set()
+        # (rllib_config, checkpoint_path, tune_name) of every checkpoint that was evaluated
+        self.evaluated = []
+        self._stop_event = threading.Event()
+
+    def poll(self):
+        """Evaluate every finished checkpoint that has not been seen yet"""
+        for trial_dir, checkpoint_num in find_checkpoints(self.exp_dir):
+            if (trial_dir, checkpoint_num) in self.seen:
+                continue
+            self.seen.add((trial_dir, checkpoint_num))
+            tune_name = os.path.basename(trial_dir)
+            print('Evaluating checkpoint {} of {}'.format(checkpoint_num, tune_name))
+            try:
+                config, checkpoint_path = get_config_from_path(trial_dir, str(checkpoint_num))
+                self.evaluate_fn(config, checkpoint_path, tune_name)
+                self.evaluated.append((config, checkpoint_path, tune_name))
+            except Exception:
+                # a failed evaluation should not take down the training it runs next to
+                print('Evaluation of checkpoint {} of {} failed'.format(checkpoint_num, tune_name))
+                traceback.print_exc()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.poll()
+            self._stop_event.wait(self.poll_interval)
+        # pick up the checkpoints written at the end of training
+        self.poll()
+
+    def stop(self):
+        """Stop polling once the checkpoints already written are evaluated and wait for the thread to finish"""
+        self._stop_event.set()
+        self.join()
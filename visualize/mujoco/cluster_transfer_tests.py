@@ -15,6 +15,8 @@ parser = argparse.ArgumentParser()
 parser.add_argument('exp_title', type=str)
 parser.add_argument('checkpoint_num', type=int)
 parser.add_argument('date', type=str, help='A date in M-DD-YYYY format')
+parser.add_argument('--results_store', type=str, default='~/transfer_results/results.db',
+                    help='Results store the transfer tests are added to. Tests already in it are not rerun')
 
 
 args = parser.parse_args()
@@ -79,9 +81,12 @@ for (dirpath, dirnames, filenames) in os.walk(os.path.expanduser("~/s3_test")):
 
         ray.shutdown()
         ray.init()
-        run_transfer_tests(config, checkpoint_path, 20, args.exp_title, output_path, run_list=lerrel_run_list)
+        results_store = os.path.expanduser(args.results_store)
+        run_transfer_tests(config, checkpoint_path, 20, args.exp_title, output_path, run_list=lerrel_run_list,
+                           results_store=results_store)
         if len(test_list) > 0:
-            run_transfer_tests(config, checkpoint_path, 20, args.exp_title, output_path, run_list=test_list, is_test=True)
+            run_transfer_tests(config, checkpoint_path, 20, args.exp_title, output_path, run_list=test_list, is_test=True,
+                               results_store=results_store)
 
         sample_actions(config, checkpoint_path, 10000, output_path)
 
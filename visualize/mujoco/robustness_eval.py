@@ -0,0 +1,117 @@
+"""Estimate the transfer robustness of a policy while it trains"""
+
+from collections import OrderedDict
+
+import numpy as np
+import ray
+
+from visualize.mujoco.transfer_tests import make_evaluator_pool, split_into_chunks
+
+
+class RobustnessEvaluator(object):
+    """Keeps a few TransferTestEvaluator actors and, every training iteration, evaluates the current weights of the
+    trainer on a rotating subset of the mass / friction grid and one of the holdout tests.
+
+    Each iteration picks num_cells rows of the grid (one per mass coefficient, rotating through the masses) and one
+    cell of each picked row, rotating through the frictions of that row. After num_frictions * num_masses / num_cells
+    iterations every cell has been evaluated once. The latest score of every cell is kept, so the reported score is a
+    running estimate over the cells seen so far.
+
+    The evaluation of an iteration runs while the trainer samples the next one and is collected one iteration later.
+    If it has not finished by then, no new evaluation is started, so it never takes more than the eval actors.
+
+    Parameters
+    ----------
+    rllib_config: (dict)
+        Config of the trainer
+    run_list: (list)
+        TransferSpecs of the validation set, the grid cells among them are evaluated
+    test_list: (list)
+        TransferSpecs of the holdout tests
+    num_workers: (int)
+        Number of eval actors
+    num_cells: (int)
+        Number of grid cells evaluated each iteration
+    num_rollouts: (int)
+        Rollouts per test
+    """
+
+    def __init__(self, rllib_config, run_list, test_list, num_workers=1, num_cells=11, num_rollouts=2):
+        rows = OrderedDict()
+        for spec in run_list:
+            mass, friction = spec.grid_coefs()
+            if mass is not None and spec.name != 'base':
+                rows.setdefault(mass, []).append((friction, spec))
+        self.rows = [[spec for _, spec in sorted(row, key=lambda cell: cell[0])] for _, row in sorted(rows.items())]
+        self.num_grid_cells = sum(len(row) for row in self.rows)
+        self.test_list = test_list
+        self.num_cells = min(num_cells, len(self.rows))
+        self.num_rollouts = num_rollouts
+        # the tests only run the agent, so the eval actors do not build the adversaries
+        self.evaluators = make_evaluator_pool(rllib_config, None, None, num_workers, policies=['agent'])
+        self.iteration = 0
+        self.row_visits = [0 for _ in self.rows]
+        self.pending = None
+        self.grid_scores = {}
+        self.holdout_scores = {}
+
+    def select_tests(self):
+        """Return the grid cells and the holdout tests evaluated this iteration"""
+        grid_tests = []
+        for k in range(self.num_cells):
+            row_idx = (self.iteration * self.num_cells + k) % len(self.rows)
+            row = self.rows[row_idx]
+            # neighbouring rows are offset so that an iteration does not see a single friction
+            grid_tests.append(row[(self.row_visits[row_idx] + row_idx) % len(row)])
+            self.row_visits[row_idx] += 1
+        holdout_tests = []
+        if len(self.test_list) > 0:
+            holdout_tests.append(self.test_list[self.iteration % len(self.test_list)])
+        return grid_tests, holdout_tests
+
+    def collect(self, block=False):
+        """Store the scores of the running evaluation. Returns False if it is still running"""
+        if self.pending is None:
+            return True
+        futures, chunks, grid_names = self.pending
+        ready, _ = ray.wait(futures, num_returns=len(futures), timeout=None if block else 0)
+        if len(ready) < len(futures):
+            return False
+        for chunk, results in zip(chunks, ray.get(futures)):
+            for spec, (rewards, step_nums) in zip(chunk, results):
+                if spec.name in grid_names:
+                    self.grid_scores[spec.name] = np.mean(rewards)
+                else:
+                    self.holdout_scores[spec.name] = np.mean(rewards)
+        self.pending = None
+        return True
+
+    def step(self, trainer):
+        """Collect the previous evaluation and start one on the current weights of the trainer. Returns the metrics
+        to add to the training result."""
+        if self.collect():
+            grid_tests, holdout_tests = self.select_tests()
+            tests = grid_tests + holdout_tests
+            weights = ray.put(trainer.get_weights(['agent']))
+            filters = ray.put(trainer.workers.local_worker().get_filters(flush_after=False))
+            chunks, _ = split_into_chunks(tests, len(self.evaluators))
+            futures = []
+            for evaluator, chunk in zip(self.evaluators, chunks):
+                # actor methods run in submission order, so the tests see the new weights
+                evaluator.set_weights.remote(weights, filters)
+                futures.append(evaluator.run_tests.remote(chunk, self.num_rollouts))
+            self.pending = (futures, chunks[:len(futures)], set(spec.name for spec in grid_tests))
+            self.iteration += 1
+        return self.metrics()
+
+    def metrics(self):
+        # the keys are always present since tune raises on a missing stopping criterion. The scores are -inf until
+        # the first evaluation returns, a nan would be ranked by checkpoint_score_attr and keep_checkpoints_num
+        grid_scores = list(self.grid_scores.values())
+        holdout_scores = list(self.holdout_scores.values())
+        return {
+            'transfer_score': np.mean(grid_scores) if len(grid_scores) > 0 else -np.inf,
+            'transfer_worst_score': np.min(grid_scores) if len(grid_scores) > 0 else -np.inf,
+            'transfer_coverage': len(grid_scores) / max(self.num_grid_cells, 1),
+            'holdout_score': np.mean(holdout_scores) if len(holdout_scores) > 0 else np.nan,
+        }
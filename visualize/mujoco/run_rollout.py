@@ -8,18 +8,16 @@ from ray.rllib.env.base_env import _DUMMY_AGENT_ID
 from ray.rllib.evaluation.episode import _flatten_action
 
 from ray.rllib.models import ModelCatalog
+from ray.rllib.models.tf.tf_action_dist import DiagGaussian
+from ray.rllib.policy.sample_batch import SampleBatch
 from ray.tune.registry import register_env
 try:
     from ray.rllib.agents.agent import get_agent_class
 except ImportError:
     from ray.rllib.agents.registry import get_agent_class
 
-from envs.mujoco.adv_hopper import AdvMAHopper
-from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
-from envs.mujoco.adv_cheetah import AdvMAHalfCheetahEnv
-from envs.mujoco.adv_ant import AdvMAAnt
-
 from utils.pendulum_env_creator import make_create_env
+from utils.policy_checkpoint import is_policy_checkpoint, restore_policy_checkpoint
 
 from models.conv_lstm import ConvLSTM
 from models.recurrent_tf_model_v2 import LSTM
@@ -39,33 +37,50 @@ def default_policy_agent_mapping(unused_agent_id):
     return DEFAULT_POLICY_ID
 
 
-def instantiate_rollout(rllib_config, checkpoint):
+def get_env_creator(env_name):
+    """Return the function that creates the env registered under `env_name`. Only that env is imported"""
+    if env_name == "MAPendulumEnv":
+        from envs.mujoco.adv_inverted_pendulum_env import AdvMAPendulumEnv
+        return make_create_env(AdvMAPendulumEnv)
+    elif env_name == "MAHopperEnv":
+        from envs.mujoco.adv_hopper import AdvMAHopper
+        return make_create_env(AdvMAHopper)
+    elif env_name == "MACheetahEnv":
+        from envs.mujoco.adv_cheetah import AdvMAHalfCheetahEnv
+        return make_create_env(AdvMAHalfCheetahEnv)
+    elif env_name == "MAAntEnv":
+        from envs.mujoco.adv_ant import AdvMAAnt
+        return make_create_env(AdvMAAnt)
+
+
+def instantiate_rollout(rllib_config, checkpoint, policies=None):
+    """Build the trainer of rllib_config and restore checkpoint. If policies is set and checkpoint is a policy
+    checkpoint (see utils/policy_checkpoint.py) or None, only those policies are built (and restored)"""
     rllib_config['num_workers'] = 0
+    use_policy_checkpoint = checkpoint is not None and is_policy_checkpoint(checkpoint)
+    if (use_policy_checkpoint or checkpoint is None) and policies is not None:
+        rllib_config['multiagent']['policies'] = {policy_id: spec for policy_id, spec in
+                                                  rllib_config['multiagent']['policies'].items()
+                                                  if policy_id in policies}
+        rllib_config['multiagent']['policies_to_train'] = [policy_id for policy_id in
+                                                           rllib_config['multiagent']['policies']]
 
     # Determine agent and checkpoint
     assert rllib_config['env_config']['run'], "No RL algorithm specified in env config!"
     agent_cls = get_agent_class(rllib_config['env_config']['run'])
     # configure the env
-
-    if rllib_config['env'] == "MAPendulumEnv":
-        env_name = "MAPendulumEnv"
-        create_env_fn = make_create_env(AdvMAPendulumEnv)
-    elif rllib_config['env'] == "MAHopperEnv":
-        env_name = "MAHopperEnv"
-        create_env_fn = make_create_env(AdvMAHopper)
-    elif rllib_config['env'] == "MACheetahEnv":
-        env_name = "MACheetahEnv"
-        create_env_fn = make_create_env(AdvMAHalfCheetahEnv)
-    elif rllib_config['env'] == "MAAntEnv":
-        env_name = "MAAntEnv"
-        create_env_fn = make_create_env(AdvMAAnt)
+    env_name = rllib_config['env']
+    create_env_fn = get_env_creator(env_name)
 
     register_env(env_name, create_env_fn)
 
     # Instantiate the agent
     # create the agent that will be used to compute the actions
     agent = agent_cls(env=env_name, config=rllib_config)
-    agent.restore(checkpoint)
+    if use_policy_checkpoint:
+        restore_policy_checkpoint(agent, checkpoint, policies)
+    elif checkpoint is not None:
+        agent.restore(checkpoint)
 
     policy_agent_mapping = default_policy_agent_mapping
     if hasattr(agent, "workers"):
@@ -94,13 +109,34 @@ def instantiate_rollout(rllib_config, checkpoint):
     return env, agent, multiagent, use_lstm, policy_agent_mapping, state_init, action_init
 
 
-def run_rollout(env, agent, multiagent, use_lstm, policy_agent_mapping, state_init, action_init, num_rollouts, render, adv_num=None):
+def get_multi_obs(obs, multiagent, adv_num=None):
+    """Map the env observation to the agents that need to act. If `adv_num` is set, the adversary with that index
+    acts (on the agent observation) in the place of adversary0"""
+    if adv_num is not None:
+        return {'agent': obs['agent'], 'adversary{}'.format(adv_num): obs['agent']}
+    else:
+        return {'agent': obs['agent']} if multiagent else {_DUMMY_AGENT_ID: obs}
+
+
+def get_env_action(action_dict, multiagent, adv_num=None):
+    """Inverse of get_multi_obs, turns the per agent actions into what the env expects"""
+    action = action_dict if multiagent else action_dict[_DUMMY_AGENT_ID]
+    if adv_num is not None:
+        action = {'agent': action['agent'], 'adversary0': action['adversary{}'.format(adv_num)]}
+    return action
+
+
+def run_rollout(env, agent, multiagent, use_lstm, policy_agent_mapping, state_init, action_init, num_rollouts, render,
+                adv_num=None, crn_seed=None, rollout_offset=0):
 
     rewards = []
     step_nums = []
 
     # actually do the rollout
     for r_itr in range(num_rollouts):
+        if crn_seed is not None:
+            # the initial state only depends on the rollout index, the action noise is not shared in this path
+            env.seed(crn_seed + rollout_offset + r_itr)
         mapping_cache = {}  # in case policy_agent_mapping is stochastic
         agent_states = DefaultMapping(
             lambda agent_id: state_init[mapping_cache[agent_id]])
@@ -115,10 +151,7 @@ def run_rollout(env, agent, multiagent, use_lstm, policy_agent_mapping, state_in
         step_num = 0
         while not done:
             step_num += 1
-            if adv_num is not None:
-                multi_obs = {'agent': obs['agent'], 'adversary{}'.format(adv_num): obs['agent']}
-            else:
-                multi_obs = {'agent': obs['agent']} if multiagent else {_DUMMY_AGENT_ID: obs}
+            multi_obs = get_multi_obs(obs, multiagent, adv_num)
             action_dict = {}
             for agent_id, a_obs in multi_obs.items():
                 if a_obs is not None:
@@ -148,13 +181,8 @@ def run_rollout(env, agent, multiagent, use_lstm, policy_agent_mapping, state_in
                     action_dict[agent_id] = a_action
                     prev_action = _flatten_action(a_action)  # tuple actions
                     prev_actions[agent_id] = prev_action
-            action = action_dict
+            action = get_env_action(action_dict, multiagent, adv_num)
 
-            action = action if multiagent else action[_DUMMY_AGENT_ID]
-
-            if adv_num is not None:
-                action = {'agent': action['agent'], 'adversary0': action['adversary{}'.format(adv_num)]}
-            
             # we turn the adversaries off so you only send in the pendulum keys
             next_obs, reward, done, info = env.step(action)
             if render:
@@ -178,4 +206,138 @@ def run_rollout(env, agent, multiagent, use_lstm, policy_agent_mapping, state_in
     env.close()
 
     print('the average reward is ', np.mean(rewards))
-    return rewards, step_num
\ No newline at end of file
+    return rewards, step_nums
+
+def can_batch_rollouts(agent, use_lstm, render):
+    """The batched engine steps envs without rendering and does not carry recurrent state"""
+    return hasattr(agent, "workers") and not render and not any(use_lstm.values())
+
+
+def run_batched_rollouts(env_makers, agent, multiagent, policy_agent_mapping, action_init, num_rollouts,
+                         adv_nums=None, max_batch_envs=256, crn_seed=None, rollout_offset=0):
+    """Roll out many tests at once. Up to `max_batch_envs` envs are stepped in lockstep and each policy is queried
+    once per step on the stacked observations of every env it acts in. When an env finishes its episode it is
+    dropped from the batch and its slot is refilled with the next pending (test, rollout) pair.
+
+    Parameters
+    ----------
+    env_makers: (list)
+        One function per test that returns a fresh env with the test modification already applied
+    agent: (Trainer)
+        Restored trainer, see instantiate_rollout
+    multiagent: (bool)
+        Whether the env is a MultiAgentEnv
+    policy_agent_mapping: (function)
+        Map from agent id to policy id
+    action_init: (dict)
+        Initial previous action for each policy
+    num_rollouts: (int)
+        How many rollouts to run for every test
+    adv_nums: (list or None)
+        For each test, the index of the adversary that should be active or None
+    max_batch_envs: (int)
+        Maximum number of envs that are alive at the same time
+    crn_seed: (int or None)
+        If set, evaluate with common random numbers. Rollout k of every test starts from the initial state given by
+        seed crn_seed + k and its actions are sampled as mean + std * eps with eps drawn from a noise stream with
+        the same seed. Results of the same rollout index can then be compared pairwise across tests, checkpoints
+        and training seeds.
+    rollout_offset: (int)
+        Index of the first rollout, used to continue the common random numbers across rounds
+
+    Returns
+    -------
+    results: (list)
+        For each test a tuple (rewards, step_nums) with one entry per rollout, in the order of the rollout index
+    """
+    if adv_nums is None:
+        adv_nums = [None] * len(env_makers)
+    local_worker = agent.workers.local_worker()
+    clip_actions = agent.config["clip_actions"]
+
+    # episodes finish in the order of their length, so every result goes to the index of its rollout
+    rewards = [[None] * num_rollouts for _ in env_makers]
+    step_nums = [[None] * num_rollouts for _ in env_makers]
+    pending = collections.deque((test_idx, r_itr) for test_idx in range(len(env_makers))
+                                for r_itr in range(rollout_offset, rollout_offset + num_rollouts))
+
+    def start_episode():
+        test_idx, r_itr = pending.popleft()
+        env = env_makers[test_idx]()
+        adv_num = adv_nums[test_idx]
+        if adv_num:
+            env.curr_adversary = adv_num
+        noise = None
+        if crn_seed is not None:
+            env.seed(crn_seed + r_itr)
+            noise = np.random.RandomState(crn_seed + r_itr)
+        return {'env': env, 'test_idx': test_idx, 'r_itr': r_itr, 'adv_num': adv_num, 'obs': env.reset(),
+                'reward_total': 0.0, 'step_num': 0, 'prev_actions': {},
+                'prev_rewards': collections.defaultdict(lambda: 0.), 'noise': noise}
+
+    slots = [start_episode() for _ in range(min(max_batch_envs, len(pending)))]
+    mapping_cache = {}
+
+    while slots:
+        # group the observations of every live env by the policy that has to act on them
+        policy_inputs = collections.defaultdict(list)
+        for slot_idx, slot in enumerate(slots):
+            slot['step_num'] += 1
+            for agent_id, a_obs in get_multi_obs(slot['obs'], multiagent, slot['adv_num']).items():
+                if a_obs is not None:
+                    policy_id = mapping_cache.setdefault(agent_id, policy_agent_mapping(agent_id))
+                    # drawn per env in agent order so that the noise only depends on the rollout index
+                    eps = None
+                    if crn_seed is not None:
+                        eps = slot['noise'].standard_normal(agent.get_policy(policy_id).action_space.shape)
+                    policy_inputs[policy_id].append((slot_idx, agent_id, a_obs, eps))
+
+        action_dicts = [{} for _ in slots]
+        for policy_id, inputs in policy_inputs.items():
+            policy = agent.get_policy(policy_id)
+            preprocessor = local_worker.preprocessors[policy_id]
+            obs_filter = local_worker.filters[policy_id]
+            obs_batch = np.stack([obs_filter(preprocessor.transform(a_obs), update=False)
+                                  for _, _, a_obs, _ in inputs])
+            prev_action_batch = np.stack([
+                _flatten_action(slots[slot_idx]['prev_actions'].get(agent_id, action_init[policy_id]))
+                for slot_idx, agent_id, _, _ in inputs])
+            prev_reward_batch = np.array([slots[slot_idx]['prev_rewards'][agent_id]
+                                          for slot_idx, agent_id, _, _ in inputs])
+            actions, _, fetches = policy.compute_actions(obs_batch, prev_action_batch=prev_action_batch,
+                                                         prev_reward_batch=prev_reward_batch)
+            if crn_seed is not None:
+                if not issubclass(policy.dist_class, DiagGaussian):
+                    raise ValueError('Common random numbers are only supported for diagonal gaussian policies')
+                mean, log_std = np.split(fetches[SampleBatch.BEHAVIOUR_LOGITS], 2, axis=1)
+                actions = mean + np.exp(log_std) * np.stack([eps for _, _, _, eps in inputs])
+            if clip_actions:
+                actions = np.clip(actions, policy.action_space.low, policy.action_space.high)
+            for (slot_idx, agent_id, _, _), a_action in zip(inputs, actions):
+                action_dicts[slot_idx][agent_id] = a_action
+                slots[slot_idx]['prev_actions'][agent_id] = _flatten_action(a_action)
+
+        live_slots = []
+        for slot, action_dict in zip(slots, action_dicts):
+            next_obs, reward, done, info = slot['env'].step(get_env_action(action_dict, multiagent, slot['adv_num']))
+            if isinstance(done, dict):
+                done = done['__all__']
+            if multiagent:
+                for agent_id, r in reward.items():
+                    slot['prev_rewards'][agent_id] = r
+            else:
+                slot['prev_rewards'][_DUMMY_AGENT_ID] = reward
+            # we only want the robot reward, not the adversary reward
+            slot['reward_total'] += info['agent']['agent_reward']
+            slot['obs'] = next_obs
+            if not done:
+                live_slots.append(slot)
+                continue
+            rewards[slot['test_idx']][slot['r_itr'] - rollout_offset] = slot['reward_total']
+            step_nums[slot['test_idx']][slot['r_itr'] - rollout_offset] = slot['step_num']
+            slot['env'].close()
+            if pending:
+                live_slots.append(start_episode())
+        slots = live_slots
+
+    return list(zip(rewards, step_nums))
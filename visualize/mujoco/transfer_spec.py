@@ -0,0 +1,104 @@
+"""Declarative description of a single transfer test"""
+
+from copy import deepcopy
+import json
+
+import numpy as np
+
+
+class TransferSpec(object):
+    """A transfer test as data instead of a closure. The spec sets absolute parameter values computed from the
+    original parameters of the env, so applying it twice is the same as applying it once, and it can be pickled,
+    hashed and stored.
+
+    Parameters
+    ----------
+    name: (str)
+        Name of the test, used in the result file names
+    mass_coefs: (dict or None)
+        Map from body name to the coefficient its original mass is scaled by
+    friction_coefs: (float or None)
+        Coefficient the original friction of every geom is scaled by
+    geom_friction_coefs: (dict or None)
+        Map from geom index to a coefficient that replaces friction_coefs for that geom
+    adv_num: (int or None)
+        If set, the adversary with this index is active during the test
+    env_attrs: (dict or None)
+        Attributes that are set on the env as they are
+    """
+
+    def __init__(self, name, mass_coefs=None, friction_coefs=None, geom_friction_coefs=None, adv_num=None,
+                 env_attrs=None):
+        self.name = name
+        self.mass_coefs = {body: float(coef) for body, coef in (mass_coefs or {}).items()}
+        self.friction_coefs = None if friction_coefs is None else float(friction_coefs)
+        # the keys are strings so that the spec survives a round trip through json
+        self.geom_friction_coefs = {str(int(idx)): float(coef) for idx, coef in (geom_friction_coefs or {}).items()}
+        self.adv_num = None if adv_num is None else int(adv_num)
+        self.env_attrs = dict(env_attrs or {})
+
+    def apply(self, env):
+        """Set the env parameters described by the spec, every other mass and friction is reset to its original value"""
+        # not every env caches its original parameters, for those the current ones are the originals
+        if not hasattr(env, 'original_mass_all'):
+            env.original_mass_all = deepcopy(env.model.body_mass)
+        if not hasattr(env, 'original_friction'):
+            env.original_friction = deepcopy(np.array(env.model.geom_friction))
+
+        body_mass = np.array(env.original_mass_all)
+        bnames = env.model.body_names
+        for body, coef in self.mass_coefs.items():
+            bindex = bnames.index(body)
+            body_mass[bindex] = env.original_mass_all[bindex] * coef
+        env.model.body_mass[:] = body_mass
+
+        friction_coefs = np.full(len(env.original_friction), 1.0 if self.friction_coefs is None else self.friction_coefs)
+        for idx, coef in self.geom_friction_coefs.items():
+            friction_coefs[int(idx)] = coef
+        env.model.geom_friction[:] = env.original_friction * friction_coefs[:, np.newaxis]
+
+        for attr, value in self.env_attrs.items():
+            setattr(env, attr, value)
+
+    def grid_coefs(self):
+        """Return the (mass, friction) coefficients if this is a cell of a mass / friction sweep, else (None, None)"""
+        if self.env_attrs or self.geom_friction_coefs or len(self.mass_coefs) > 1:
+            return None, None
+        mass = list(self.mass_coefs.values())[0] if self.mass_coefs else 1.0
+        friction = self.friction_coefs if self.friction_coefs is not None else 1.0
+        return mass, friction
+
+    def to_dict(self):
+        return {'name': self.name, 'mass_coefs': self.mass_coefs, 'friction_coefs': self.friction_coefs,
+                'geom_friction_coefs': self.geom_friction_coefs, 'adv_num': self.adv_num, 'env_attrs': self.env_attrs}
+
+    @classmethod
+    def from_dict(cls, spec_dict):
+        return cls(**spec_dict)
+
+    def key(self):
+        """Everything that changes the env, so two specs with the same key give the same test. The name is left out"""
+        spec_dict = self.to_dict()
+        del spec_dict['name']
+        return json.dumps(spec_dict, sort_keys=True, default=str)
+
+    def __eq__(self, other):
+        return isinstance(other, TransferSpec) and self.name == other.name and self.key() == other.key()
+
+    def __hash__(self):
+        return hash((self.name, self.key()))
+
+    def __repr__(self):
+        return 'TransferSpec({})'.format(self.to_dict())
+
+
+def make_grid_spec(mass_coef, friction_coef, mass_body='torso'):
+    """A cell of a mass / friction sweep, named like the legacy results m_<mass>_f_<friction>"""
+    return TransferSpec('m_{}_f_{}'.format(mass_coef, friction_coef), mass_coefs={mass_body: mass_coef},
+                        friction_coefs=friction_coef)
+
+
+def make_fric_hard_spec(name, max_fric_coeff, min_fric_coeff, high_fric_idx):
+    """The geoms in high_fric_idx get max_fric_coeff times their original friction, all the others min_fric_coeff"""
+    return TransferSpec(name, friction_coefs=min_fric_coeff,
+                        geom_friction_coefs={idx: max_fric_coeff for idx in high_fric_idx})
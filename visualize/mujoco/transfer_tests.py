@@ -2,184 +2,323 @@ import argparse
 import configparser
 from copy import deepcopy
 from datetime import datetime
+from functools import partial
 from gym import spaces
+import hashlib
+import json
 import os
 import pytz
+import shutil
+import tempfile
 
 import numpy as np
-import matplotlib.pyplot as plt
-plt.rcParams["axes.grid"] = False
 import ray
 
 from utils.parsers import replay_parser
+from utils.policy_checkpoint import POLICY_STORE_DIR, is_policy_checkpoint, load_manifest, policy_store_dir, \
+    referenced_files
+from utils.results_store import ResultsStore, parse_checkpoint, parse_trial
 from utils.rllib_utils import get_config
-from visualize.mujoco.run_rollout import run_rollout, instantiate_rollout
-from visualize.plot_heatmap import save_heatmap, hopper_friction_sweep, hopper_mass_sweep, cheetah_friction_sweep, cheetah_mass_sweep, ant_mass_sweep, ant_friction_sweep
+from utils.tracing import configure as configure_tracing, pop_trace_events, span
+from visualize.mujoco.run_rollout import run_rollout, instantiate_rollout, get_env_creator, can_batch_rollouts, \
+    run_batched_rollouts
+from visualize.mujoco.transfer_spec import TransferSpec, make_grid_spec, make_fric_hard_spec
+from envs.mujoco.sweeps import hopper_friction_sweep, hopper_mass_sweep, cheetah_friction_sweep, cheetah_mass_sweep, \
+    ant_mass_sweep, ant_friction_sweep
 import errno
 
 
-def make_set_friction(friction_coef):
-    def set_friction(env):
-        env.model.geom_friction[:] = (env.model.geom_friction * friction_coef)[:]
-        if hasattr(env, 'fric_coef'):
-            env.fric_coef = friction_coef
-    return set_friction
-
-def make_set_mass(mass_coef, mass_body='pole'):
-    def set_mass(env):
-        bnames = env.model.body_names
-        bindex = bnames.index(mass_body)
-        env.model.body_mass[bindex] = (env.model.body_mass[bindex] * mass_coef)
-        if hasattr(env, 'mass_coef'):
-            env.fric_coef = mass_coef
-    return set_mass
-
-def make_set_mass_and_fric(friction_coef, mass_coef, mass_body='pole'):
-    def set_mass(env):
-        mass_bname = mass_body
-        bnames = env.model.body_names
-        bindex = bnames.index(mass_bname)
-        env.model.body_mass[bindex] = (env.model.body_mass[bindex] * mass_coef)
-        env.model.geom_friction[:] = (env.model.geom_friction * friction_coef)[:]
-    return set_mass
-
-
-def make_set_fric_hard(max_fric_coeff, min_fric_coeff, high_fric_idx, mass_body='pole'):
-    def set_mass(env):
-        env.model.geom_friction[high_fric_idx] = (env.model.geom_friction * max_fric_coeff)[high_fric_idx]
-        low_fric_idx = np.ones(len(env.model.geom_friction), np.bool)
-        low_fric_idx[high_fric_idx] = 0
-        env.model.geom_friction[low_fric_idx] = (env.model.geom_friction * min_fric_coeff)[low_fric_idx]
-    return set_mass
-
 #hopper geoms: floor, torso, thigh, leg, foot
 hopper_run_list = [
-    ['base', []]
+    TransferSpec('base')
 ]
 hopper_test_list=[
-    ['friction_hard_torsolegmax_floorthighfootmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [1, 3])],
-    ['friction_hard_floorthighmax_torsolegfootmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [0, 2])],
-    ['friction_hard_footlegmax_floortorsothighmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [3, 4])],
-    ['friction_hard_torsothighfloormax_footlegmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [0, 1, 2])],
-    ['friction_hard_torsofootmax_floorthighlegmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [1, 4])],
-    ['friction_hard_floorthighlegmax_torsofootmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [0, 3, 2])],
-    ['friction_hard_floorfootmax_torsothighlegmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [4, 0])],
-    ['friction_hard_thighlegmax_floortorsofootmin', make_set_fric_hard(max(hopper_friction_sweep), min(hopper_friction_sweep), [2, 3])],
+    make_fric_hard_spec('friction_hard_torsolegmax_floorthighfootmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [1, 3]),
+    make_fric_hard_spec('friction_hard_floorthighmax_torsolegfootmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [0, 2]),
+    make_fric_hard_spec('friction_hard_footlegmax_floortorsothighmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [3, 4]),
+    make_fric_hard_spec('friction_hard_torsothighfloormax_footlegmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [0, 1, 2]),
+    make_fric_hard_spec('friction_hard_torsofootmax_floorthighlegmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [1, 4]),
+    make_fric_hard_spec('friction_hard_floorthighlegmax_torsofootmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [0, 3, 2]),
+    make_fric_hard_spec('friction_hard_floorfootmax_torsothighlegmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [4, 0]),
+    make_fric_hard_spec('friction_hard_thighlegmax_floortorsofootmin', max(hopper_friction_sweep), min(hopper_friction_sweep), [2, 3]),
 ]
 num_hopper_custom_tests = len(hopper_run_list)
 
 #cheetah geoms: ('floor', 'torso', 'head', 'bthigh', 'bshin', 'bfoot', 'fthigh', 'fshin', 'ffoot')
 cheetah_run_list = [
-    ['base', []]
+    TransferSpec('base')
 ]
 cheetah_test_list=[
-    ['friction_hard_torsoheadfthighmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [1, 2, 6])],
-    ['friction_hard_floorheadfshinmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [0, 2, 7])],
-    ['friction_hard_bthighbshinbfootmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [3, 4, 5])],
-    ['friction_hard_floortorsoheadmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [0, 1, 2])],
-    ['friction_hard_floorbshinffootmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [1, 4, 8])],
-    ['friction_hard_bthighbfootffootmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [3, 5, 8])],
-    ['friction_hard_bthighfthighfshinmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [3, 6, 7])],
-    ['friction_hard_headfshinffootmax', make_set_fric_hard(max(cheetah_friction_sweep), min(cheetah_friction_sweep), [2, 7, 8])],
+    make_fric_hard_spec('friction_hard_torsoheadfthighmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [1, 2, 6]),
+    make_fric_hard_spec('friction_hard_floorheadfshinmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [0, 2, 7]),
+    make_fric_hard_spec('friction_hard_bthighbshinbfootmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [3, 4, 5]),
+    make_fric_hard_spec('friction_hard_floortorsoheadmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [0, 1, 2]),
+    make_fric_hard_spec('friction_hard_floorbshinffootmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [1, 4, 8]),
+    make_fric_hard_spec('friction_hard_bthighbfootffootmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [3, 5, 8]),
+    make_fric_hard_spec('friction_hard_bthighfthighfshinmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [3, 6, 7]),
+    make_fric_hard_spec('friction_hard_headfshinffootmax', max(cheetah_friction_sweep), min(cheetah_friction_sweep), [2, 7, 8]),
 ]
 num_cheetah_custom_tests = len(cheetah_test_list)
 
 #ant geoms: ('world', 'torso', 'front_left_leg', 'aux_1', 'front_right_leg', 'aux_2', 'back_leg', 'aux_3', 'right_back_leg', 'aux_4')
 ant_run_list = [
-    ['base', []]
+    TransferSpec('base')
 ]
 ant_test_list=[
-    ['friction_hard_flla1a3max', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [2, 3, 7])],
-    ['friction_hard_torsoa1rblmax', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [1, 3, 8])],
-    ['friction_hard_frla2blmax', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [4, 5, 6])],
-    ['friction_hard_torsoflla1max', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [1, 2, 3])],
-    ['friction_hard_flla2a4max', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [2, 5, 9])],
-    ['friction_hard_frlbla4max', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [4, 6, 9])],
-    ['friction_hard_frla3rblmax', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [4, 7, 8])],
-    ['friction_hard_a1rbla4max', make_set_fric_hard(max(ant_friction_sweep), min(ant_friction_sweep), [3, 8, 9])],
+    make_fric_hard_spec('friction_hard_flla1a3max', max(ant_friction_sweep), min(ant_friction_sweep), [2, 3, 7]),
+    make_fric_hard_spec('friction_hard_torsoa1rblmax', max(ant_friction_sweep), min(ant_friction_sweep), [1, 3, 8]),
+    make_fric_hard_spec('friction_hard_frla2blmax', max(ant_friction_sweep), min(ant_friction_sweep), [4, 5, 6]),
+    make_fric_hard_spec('friction_hard_torsoflla1max', max(ant_friction_sweep), min(ant_friction_sweep), [1, 2, 3]),
+    make_fric_hard_spec('friction_hard_flla2a4max', max(ant_friction_sweep), min(ant_friction_sweep), [2, 5, 9]),
+    make_fric_hard_spec('friction_hard_frlbla4max', max(ant_friction_sweep), min(ant_friction_sweep), [4, 6, 9]),
+    make_fric_hard_spec('friction_hard_frla3rblmax', max(ant_friction_sweep), min(ant_friction_sweep), [4, 7, 8]),
+    make_fric_hard_spec('friction_hard_a1rbla4max', max(ant_friction_sweep), min(ant_friction_sweep), [3, 8, 9]),
 ]
 num_ant_custom_tests = len(ant_test_list)
 
 hopper_grid = np.meshgrid(hopper_mass_sweep, hopper_friction_sweep)
 for mass, fric in np.vstack((hopper_grid[0].ravel(), hopper_grid[1].ravel())).T:
-    hopper_run_list.append(['m_{}_f_{}'.format(mass, fric), make_set_mass_and_fric(fric, mass, mass_body="torso")])
+    hopper_run_list.append(make_grid_spec(mass, fric, mass_body="torso"))
 
 cheetah_grid = np.meshgrid(cheetah_mass_sweep, cheetah_friction_sweep)
 for mass, fric in np.vstack((cheetah_grid[0].ravel(), cheetah_grid[1].ravel())).T:
-    cheetah_run_list.append(['m_{}_f_{}'.format(mass, fric), make_set_mass_and_fric(fric, mass, mass_body="torso")])
+    cheetah_run_list.append(make_grid_spec(mass, fric, mass_body="torso"))
 
 ant_grid = np.meshgrid(ant_mass_sweep, ant_friction_sweep)
 for mass, fric in np.vstack((ant_grid[0].ravel(), ant_grid[1].ravel())).T:
-    ant_run_list.append(['m_{}_f_{}'.format(mass, fric), make_set_mass_and_fric(fric, mass, mass_body="torso")])
+    ant_run_list.append(make_grid_spec(mass, fric, mass_body="torso"))
+
+# the validation (run) and test lists of every env with transfer tests
+transfer_lists = {
+    'MAHopperEnv': (hopper_run_list, hopper_test_list),
+    'MACheetahEnv': (cheetah_run_list, cheetah_test_list),
+    'MAAntEnv': (ant_run_list, ant_test_list),
+}
 
 def reset_env(env, num_active_adv=0):
-    """Undo parameters that need to be off"""
+    """Undo parameters that need to be off. This also stops the env from redrawing its adversary and dynamics at the
+    end of every episode, so an env that is reused for several rollouts runs all of them on the same test"""
+    if hasattr(env, 'train_episodes'):
+        env.train_episodes = False
     if hasattr(env, 'domain_randomization'):
         env.domain_randomization = False
+    if hasattr(env, 'extreme_domain_randomization'):
+        env.extreme_domain_randomization = False
     if num_active_adv > 0:
         env.adversary_range = env.advs_per_strength * env.num_adv_strengths
 
+def load_checkpoint_files(checkpoint, policies=None):
+    """Read every file belonging to a checkpoint (the checkpoint itself and its tune metadata) into memory
+
+    Parameters
+    ----------
+    checkpoint: (str)
+        Path to the checkpoint file, e.g. <trial_dir>/checkpoint_350/checkpoint-350
+    policies: (list or None)
+        If set and the checkpoint is a policy checkpoint, only the policy store files of these policies are read
+
+    Returns
+    -------
+    checkpoint_name: (str)
+        Base name of the checkpoint file
+    checkpoint_files: (dict)
+        Map from file name to the file contents. For a policy checkpoint the policy store files it refers to are
+        included, named relative to the checkpoint dir
+    """
+    checkpoint_dir = os.path.dirname(checkpoint)
+    checkpoint_name = os.path.basename(checkpoint)
+    checkpoint_files = {}
+    for file_name in os.listdir(checkpoint_dir):
+        if file_name.startswith(checkpoint_name):
+            with open(os.path.join(checkpoint_dir, file_name), 'rb') as file:
+                checkpoint_files[file_name] = file.read()
+    if is_policy_checkpoint(checkpoint):
+        store_dir = policy_store_dir(checkpoint)
+        for file_name in sorted(referenced_files(load_manifest(checkpoint), policies)):
+            with open(os.path.join(store_dir, file_name), 'rb') as file:
+                checkpoint_files[os.path.join('..', POLICY_STORE_DIR, file_name)] = file.read()
+    return checkpoint_name, checkpoint_files
+
+
 @ray.remote(memory=1500 * 1024 * 1024)
-def run_test(test_name, outdir, output_file_name, num_rollouts,
-             rllib_config, checkpoint, env_modifier, render, adv_num=None):
-    """Run an individual transfer test
+class TransferTestEvaluator(object):
+    """Restores the trainer once and then runs as many transfer tests as it is handed.
 
     Parameters
     ----------
-    test_name: (str)
-        Name of the test we are running. Used to find which env param to set to True
-    is_env_config: (bool)
-        If true we write the param into the env config so that it is actually updated correctly since some of the
-        env configuration is done through the env_params.config
-    config_value: (bool or str or None)
-        This is the value we will insert into the env config. For example, True, or "every_step" or so on
-    params_name: (str or None)
-        If is_env_config is true, this is the key into which we will store things
-    params_value: (bool or str or None)
-        If is_env_config is true, this is the value we will store into the env_params.config
-    outdir: (str)
-        Directory results are saved to
-    output_file_name: (str)
-        Prefix string for naming the files. Used to uniquely identify experiments
-    save_trajectory: (bool)
-        If true, a video will be saved for this rollout
-    show_images: (bool)
-        If true, a render of the rollout will be displayed on your machine
-    num_rollouts: (int)
-        How many times to rollout the test. Increasing this should yield more stable results
     rllib_config: (dict)
         Passed rllib config
-    checkpoint: (int)
-        Number of the checkpoint we want to replay
+    checkpoint_name: (str or None)
+        Base name of the checkpoint file, e.g. checkpoint-350. If None, the trainer is not restored and the weights
+        are set with set_weights, which is how a trainer that is still training is evaluated.
+    checkpoint_files: (dict or None)
+        Map from file name to file contents for the checkpoint. This is broadcast through the object store
+        so that the checkpoint is only read from disk once per sweep instead of once per test.
+    policies: (list or None)
+        If set and the checkpoint is a policy checkpoint, only these policies are built and restored
     """
-    # First compute a baseline score to compare against
-    print(
-        "**********************************************************\n"
-        "**********************************************************\n"
-        "**********************************************************\n"
-        "Running the {} score!\n"
-        "**********************************************************\n"
-        "**********************************************************\n"
-        "**********************************************************".format(test_name)
-    )
-
-    env, agent, multiagent, use_lstm, policy_agent_mapping, state_init, action_init = instantiate_rollout(rllib_config, checkpoint)
-    if adv_num:
-        reset_env(env, 1)
-    # high = np.array([1.0, 90.0, env.max_cart_vel, env.max_pole_vel])
-    # env.observation_space = spaces.Box(low=-1 * high, high=high, dtype=env.observation_space.dtype)
-    if callable(env_modifier):
-        env_modifier(env)
-    elif type(env) is MultiarmBandit:
-        env.transfer = env_modifier
-    elif len(env_modifier) > 0:
-        setattr(env, env_modifier[0], env_modifier[1])
-    rewards, step_num = run_rollout(env, agent, multiagent, use_lstm, policy_agent_mapping,
-                                 state_init, action_init, num_rollouts, render, adv_num)
-
-    with open('{}/{}_{}_rew.txt'.format(outdir, output_file_name, test_name),
-              'wb') as file:
-        np.savetxt(file, rewards, delimiter=', ')
+
+    def __init__(self, rllib_config, checkpoint_name, checkpoint_files, policies=None):
+        self.create_env_fn = get_env_creator(rllib_config['env'])
+        self.env_config = rllib_config['env_config']
+        configure_tracing(self.env_config.get('trace'), 'evaluator')
+        if checkpoint_name is None:
+            with span('build_trainer', 'evaluator'):
+                _, self.agent, self.multiagent, self.use_lstm, self.policy_agent_mapping, self.state_init, \
+                    self.action_init = instantiate_rollout(rllib_config, None)
+            return
+        trial_dir = tempfile.mkdtemp()
+        # the files of a policy checkpoint are found relative to the trial dir
+        checkpoint_dir = os.path.join(trial_dir, 'checkpoint')
+        try:
+            for file_name, contents in checkpoint_files.items():
+                path = os.path.normpath(os.path.join(checkpoint_dir, file_name))
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as file:
+                    file.write(contents)
+            with span('restore_checkpoint', 'evaluator'):
+                _, self.agent, self.multiagent, self.use_lstm, self.policy_agent_mapping, self.state_init, \
+                    self.action_init = instantiate_rollout(rllib_config,
+                                                           os.path.join(checkpoint_dir, checkpoint_name), policies)
+        finally:
+            shutil.rmtree(trial_dir, ignore_errors=True)
+
+    def set_weights(self, weights, filters=None):
+        """Replace the weights of every policy and, if given, the observation filters of the trainer"""
+        with span('set_weights', 'evaluator'):
+            self.agent.set_weights(weights)
+            if filters is not None:
+                self.agent.workers.local_worker().sync_filters(filters)
+
+    def pop_trace_events(self):
+        """The spans recorded since the last call, see utils/tracing.py"""
+        return pop_trace_events()
+
+    def make_env(self, spec):
+        """Build a fresh env with the transfer spec applied"""
+        env = self.create_env_fn(self.env_config)
+        reset_env(env, 1 if spec.adv_num else 0)
+        spec.apply(env)
+        return env
+
+    def run_tests(self, tests, num_rollouts, render=False, max_batch_envs=256, crn_seed=None, rollout_offset=0):
+        """Run a chunk of transfer tests. Unless we are rendering or the policies are recurrent, all the rollouts
+        of all the tests are stepped together with batched policy inference.
+
+        Parameters
+        ----------
+        tests: (list)
+            The TransferSpec of each test
+        num_rollouts: (int)
+            How many times to rollout each test. Increasing this should yield more stable results
+        render: (bool)
+            If true, a render of the rollout will be displayed on your machine
+        max_batch_envs: (int)
+            Maximum number of envs that are stepped together
+        crn_seed: (int or None)
+            If set, rollout k of every test shares its initial state and action noise, see run_batched_rollouts
+        rollout_offset: (int)
+            Index of the first rollout
+
+        Returns
+        -------
+        results: (list)
+            For each test a tuple (rewards, step_nums)
+        """
+        print('Running the tests {}'.format(', '.join(spec.name for spec in tests)))
+        if can_batch_rollouts(self.agent, self.use_lstm, render):
+            env_makers = [partial(self.make_env, spec) for spec in tests]
+            with span('run_tests', 'evaluator', args={'tests': [spec.name for spec in tests]}):
+                return run_batched_rollouts(env_makers, self.agent, self.multiagent, self.policy_agent_mapping,
+                                            self.action_init, num_rollouts, [spec.adv_num for spec in tests],
+                                            max_batch_envs, crn_seed, rollout_offset)
+
+        results = []
+        for spec in tests:
+            with span('run_test', 'evaluator', args={'test': spec.name}):
+                env = self.make_env(spec)
+                results.append(run_rollout(env, self.agent, self.multiagent, self.use_lstm,
+                                           self.policy_agent_mapping, self.state_init, self.action_init,
+                                           num_rollouts, render, spec.adv_num, crn_seed, rollout_offset))
+        return results
+
+
+def make_evaluator_pool(rllib_config, checkpoint_name, checkpoint_files, num_evaluators, policies=None):
+    """Start `num_evaluators` evaluators that all restore the checkpoint from a single copy in the object store"""
+    checkpoint_ref = ray.put(checkpoint_files)
+    return [TransferTestEvaluator.remote(rllib_config, checkpoint_name, checkpoint_ref, policies)
+            for _ in range(num_evaluators)]
+
+
+def hash_checkpoint_files(checkpoint_files, checkpoint_name):
+    """Hash of the names and contents of a checkpoint, so the cache stays valid when checkpoints are moved or synced
+    again. The checkpoint name is left out of the file names since it only holds the checkpoint number"""
+    checkpoint_hash = hashlib.sha1()
+    for file_name in sorted(checkpoint_files.keys()):
+        if file_name.startswith(checkpoint_name):
+            hash_name = '<checkpoint>' + file_name[len(checkpoint_name):]
+        else:
+            hash_name = file_name
+        contents = checkpoint_files[file_name]
+        # the lengths keep the boundary between a name and the contents before it unambiguous
+        for part in (hash_name.encode(), contents):
+            checkpoint_hash.update('{}:'.format(len(part)).encode())
+            checkpoint_hash.update(part)
+    return checkpoint_hash.hexdigest()
+
+
+def transfer_cache_key(checkpoint_hash, env_name, spec, num_rollouts, crn_seed=None, adaptive_params=None):
+    """Key under which the result of a transfer test is cached. It changes whenever anything that affects the result
+    changes: the checkpoint contents, the transfer spec or how the rollouts are run."""
+    key = {'checkpoint': checkpoint_hash, 'env': env_name, 'spec': spec.key(), 'num_rollouts': num_rollouts,
+           'crn_seed': crn_seed, 'adaptive': adaptive_params}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def stream_pool_results(evaluators, work_items):
+    """Hand the work items out to the evaluators and yield (work item index, result) as soon as each one finishes.
+
+    Parameters
+    ----------
+    evaluators: (list)
+        Handles of TransferTestEvaluator actors
+    work_items: (list)
+        Each item is a dict of keyword arguments to TransferTestEvaluator.run_tests
+    """
+    # reversed so that popping off the end hands out the work in order
+    remaining = list(enumerate(work_items))[::-1]
+    idle = list(evaluators)
+    pending = {}
+    while remaining or pending:
+        while idle and remaining:
+            evaluator = idle.pop()
+            idx, work_item = remaining.pop()
+            pending[evaluator.run_tests.remote(**work_item)] = (idx, evaluator)
+        [ready], _ = ray.wait(list(pending.keys()), num_returns=1)
+        idx, evaluator = pending.pop(ready)
+        idle.append(evaluator)
+        yield idx, ray.get(ready)
+
+
+def save_test_result(outdir, output_file_name, spec, rewards, step_num, store=None, seed=None, checkpoint=None,
+                     save_txt=True, cache_keys=None, trial=''):
+    """Write out the rewards of a single test and return the summary row that goes into the sweep file.
+    If a ResultsStore is passed, every rollout is also added to it and the test is marked as finished under its key
+    in `cache_keys`, a dict from test name to cache key. Both are committed together so a crash never leaves
+    rollouts in the store that a rerun would add again."""
+    test_name = spec.name
+    if save_txt:
+        with open('{}/{}_{}_rew.txt'.format(outdir, output_file_name, test_name),
+                  'wb') as file:
+            np.savetxt(file, rewards, delimiter=', ')
+    if store is not None:
+        mass, friction = spec.grid_coefs()
+        store.add_rollouts(output_file_name, seed, checkpoint, test_name, rewards, step_num, commit=False,
+                           mass=mass, friction=friction, trial=trial)
+        if cache_keys is not None:
+            store.put_cached(cache_keys[test_name], rewards, step_num, commit=False)
+        store.commit()
 
     print('The average reward for task {} is {}'.format(test_name, np.mean(rewards)))
     print('The average step length for task {} is {}'.format(test_name, np.mean(step_num)))
@@ -187,7 +326,131 @@ def run_test(test_name, outdir, output_file_name, num_rollouts,
     return np.mean(rewards), np.std(rewards), np.mean(step_num), np.std(step_num)
 
 
-def run_transfer_tests(rllib_config, checkpoint, num_rollouts, output_file_name, outdir, run_list, is_test=False, render=False):
+def split_into_chunks(tests, num_chunks):
+    """Split the tests into at most `num_chunks` contiguous chunks. Returns the chunks and the chunk size"""
+    chunk_size = int(np.ceil(len(tests) / num_chunks))
+    return [tests[i:i + chunk_size] for i in range(0, len(tests), chunk_size)], chunk_size
+
+
+def run_tests_on_pool(evaluators, tests, num_rollouts, save_fn, render=False, max_batch_envs=256,
+                      crn_seed=None):
+    """Split the tests into one chunk per evaluator so that each evaluator can batch across as many envs as
+    possible, and save each result with save_fn(spec, rewards, step_nums) as it streams back. Returns the summary rows in the same order as the tests
+    and the number of rollouts used for each test."""
+    chunks, chunk_size = split_into_chunks(tests, len(evaluators))
+    work_items = [{'tests': chunk, 'num_rollouts': num_rollouts, 'render': render, 'max_batch_envs': max_batch_envs,
+                   'crn_seed': crn_seed} for chunk in chunks]
+    temp_output = [None] * len(tests)
+    for chunk_idx, results in stream_pool_results(evaluators, work_items):
+        for i, (rewards, step_num) in enumerate(results):
+            test_idx = chunk_idx * chunk_size + i
+            temp_output[test_idx] = save_fn(tests[test_idx], rewards, step_num)
+    return temp_output, [num_rollouts] * len(tests)
+
+
+def confidence_interval(rewards):
+    """Normal approximation of the 95% confidence interval on the mean reward. Returns (lower, upper)"""
+    mean = np.mean(rewards)
+    if len(rewards) < 2:
+        return -np.inf, np.inf
+    half_width = 1.96 * np.std(rewards, ddof=1) / np.sqrt(len(rewards))
+    return mean - half_width, mean + half_width
+
+
+def run_adaptive_tests_on_pool(evaluators, tests, max_rollouts, save_fn, min_rollouts, round_size,
+                               rel_tol, dominance_margin=None, render=False, max_batch_envs=256, crn_seed=None):
+    """Run the tests in rounds and stop each test as soon as its reward estimate is tight enough.
+
+    Every test first gets `min_rollouts` rollouts. After that, the tests that are still running get `round_size`
+    more rollouts per round until they hit `max_rollouts`. A test stops early when the half width of the
+    confidence interval on its mean reward is below `rel_tol` times its mean. It also stops when its upper bound is
+    more than `dominance_margin` below the best lower bound of any test in the sweep (such cells are clearly worse and
+    their value does not need to be pinned down).
+
+    Parameters
+    ----------
+    max_rollouts: (int)
+        Most rollouts any single test can use
+    min_rollouts: (int)
+        Rollouts every test gets before the stopping rules are checked
+    round_size: (int)
+        Rollouts added to every running test per round
+    rel_tol: (float)
+        Relative tolerance on the confidence interval half width
+    dominance_margin: (float or None)
+        If None, tests are never stopped for being dominated
+
+    Returns
+    -------
+    temp_output: (list)
+        Summary rows in the same order as the tests
+    rollouts_used: (list)
+        Number of rollouts each test used
+    """
+    rewards = [[] for _ in tests]
+    step_nums = [[] for _ in tests]
+    temp_output = [None] * len(tests)
+    running = list(range(len(tests)))
+    num_rollouts = min(min_rollouts, max_rollouts)
+    while running:
+        chunks, chunk_size = split_into_chunks([tests[test_idx] for test_idx in running], len(evaluators))
+        # every running test has used the same number of rollouts so far
+        rollout_offset = len(rewards[running[0]])
+        work_items = [{'tests': chunk, 'num_rollouts': num_rollouts, 'render': render,
+                       'max_batch_envs': max_batch_envs, 'crn_seed': crn_seed, 'rollout_offset': rollout_offset}
+                      for chunk in chunks]
+        for chunk_idx, results in stream_pool_results(evaluators, work_items):
+            for i, (new_rewards, new_steps) in enumerate(results):
+                test_idx = running[chunk_idx * chunk_size + i]
+                rewards[test_idx].extend(new_rewards)
+                step_nums[test_idx].extend(np.atleast_1d(new_steps))
+
+        intervals = {test_idx: confidence_interval(rewards[test_idx]) for test_idx in running}
+        best_lower = max(lower for lower, _ in intervals.values())
+        still_running = []
+        for test_idx in running:
+            lower, upper = intervals[test_idx]
+            tight = (upper - lower) / 2 <= rel_tol * max(abs(np.mean(rewards[test_idx])), 1.0)
+            dominated = dominance_margin is not None and upper < best_lower - dominance_margin
+            if tight or dominated or len(rewards[test_idx]) >= max_rollouts:
+                temp_output[test_idx] = save_fn(tests[test_idx], rewards[test_idx], step_nums[test_idx])
+                print('Task {} stopped after {} rollouts'.format(tests[test_idx].name,
+                                                                 len(rewards[test_idx])))
+            else:
+                still_running.append(test_idx)
+        running = still_running
+        num_rollouts = min(round_size, max_rollouts - min(len(rewards[test_idx]) for test_idx in running)) \
+            if running else 0
+
+    rollouts_used = [len(test_rewards) for test_rewards in rewards]
+    print('Used {} rollouts in total instead of {}'.format(sum(rollouts_used), max_rollouts * len(tests)))
+    return temp_output, rollouts_used
+
+
+def run_transfer_tests(rllib_config, checkpoint, num_rollouts, output_file_name, outdir, run_list, is_test=False,
+                       render=False, num_evaluators=None, max_batch_envs=256, min_rollouts=None, round_size=5,
+                       rel_tol=0.05, dominance_margin=None, crn_seed=None, results_store=None, save_txt=True):
+    """Run every test in run_list (and each adversary on its own) and save the results and plots to outdir.
+
+    If `min_rollouts` is set, the tests are run adaptively: `num_rollouts` becomes the most rollouts any test can use
+    and each test stops once its reward estimate is tight enough, see run_adaptive_tests_on_pool. The rollouts used
+    by each test are then saved next to the sweep results.
+
+    If `crn_seed` is set, the tests are evaluated with common random numbers: rollout k of every test, checkpoint and
+    training seed starts from the same initial state and uses the same action noise, so results can be compared
+    pairwise by rollout index.
+
+    If `results_store` (the path of a ResultsStore) is set, every rollout is added to the store under the experiment
+    `output_file_name`, the trial folder and the iteration of the checkpoint, and the per test text files are only
+    written if `save_txt` is true. The store also caches finished tests by the checkpoint contents and test spec, see
+    transfer_cache_key, so rerunning a sweep only runs the tests that are missing, e.g. after a crash. If
+    `results_store` is None or empty there is no store, so there is no cache either and every test is run.
+    """
+
+    # the plots are only made here, so the evaluators that import this module do not load matplotlib
+    import matplotlib.pyplot as plt
+    plt.rcParams["axes.grid"] = False
+    from visualize.plot_heatmap import save_heatmap
 
     output_file_path = os.path.join(outdir, output_file_name)
     if not os.path.exists(os.path.dirname(output_file_path)):
@@ -197,15 +460,82 @@ def run_transfer_tests(rllib_config, checkpoint, num_rollouts, output_file_name,
             if exc.errno != errno.EEXIST:
                 raise
 
-    temp_output = [run_test.remote(test_name=list[0],
-                 outdir=outdir, output_file_name=output_file_name,
-                 num_rollouts=num_rollouts,
-                 rllib_config=rllib_config, checkpoint=checkpoint, env_modifier=list[1], render=render) for list in run_list]
-    temp_output = ray.get(temp_output)
+    num_advs = rllib_config['env_config']['advs_per_strength'] * rllib_config['env_config']['num_adv_strengths']
+    # the evaluators hold a full copy of the trainer so we only start as many as there is work for
+    if num_evaluators is None:
+        num_evaluators = int(ray.cluster_resources().get('CPU', 1))
+    # the sweeps only need the agent, the files of every policy are only read for the per adversary tests. The
+    # manifest of a policy checkpoint is always included, so the hash still changes with any policy
+    checkpoints = {}
+
+    def load_checkpoint(policies):
+        key = None if policies is None else tuple(policies)
+        if key not in checkpoints:
+            checkpoint_name, checkpoint_files = load_checkpoint_files(checkpoint, policies)
+            checkpoints[key] = (checkpoint_name, checkpoint_files, hash_checkpoint_files(checkpoint_files, checkpoint_name))
+        return checkpoints[key]
+
+    # started on the first test that is not cached, for the policies of the tests that are run
+    evaluators = []
+    evaluator_policies = []
+
+    store = ResultsStore(results_store) if results_store else None
+    adaptive_params = [min_rollouts, round_size, rel_tol, dominance_margin] if min_rollouts is not None else None
+
+    def evaluate(tests, output_name):
+        policies = None if any(spec.adv_num is not None for spec in tests) else ['agent']
+        checkpoint_name, checkpoint_files, checkpoint_hash = load_checkpoint(policies)
+        temp_output = [None] * len(tests)
+        rollouts_used = [None] * len(tests)
+        cache_keys = {spec.name: transfer_cache_key(checkpoint_hash, rllib_config['env'], spec, num_rollouts,
+                                                    crn_seed, adaptive_params) for spec in tests}
+        missing = []
+        for i, spec in enumerate(tests):
+            cached = store.get_cached(cache_keys[spec.name]) if store is not None else None
+            if cached is None:
+                missing.append(i)
+                continue
+            rewards, step_num = cached
+            # the weights may be cached under another checkpoint or trial, which still gets its own rows
+            temp_output[i] = save_test_result(outdir, output_file_name, spec, rewards, step_num, store=store,
+                                              seed=rllib_config.get('seed'), checkpoint=parse_checkpoint(checkpoint),
+                                              save_txt=save_txt, trial=parse_trial(checkpoint))
+            rollouts_used[i] = len(rewards)
+        if store is not None:
+            print('{} of {} tests were already in the results store'.format(len(tests) - len(missing), len(tests)))
+
+        if len(missing) > 0:
+            if len(evaluators) == 0 or evaluator_policies != [policies]:
+                # the actors of a previous pool stop once their handles are dropped
+                evaluators[:] = make_evaluator_pool(rllib_config, checkpoint_name, checkpoint_files,
+                                                    max(1, min(num_evaluators, len(missing))), policies)
+                evaluator_policies[:] = [policies]
+            save_fn = partial(save_test_result, outdir, output_file_name, store=store, seed=rllib_config.get('seed'),
+                              checkpoint=parse_checkpoint(checkpoint), save_txt=save_txt or store is None,
+                              cache_keys=cache_keys, trial=parse_trial(checkpoint))
+            missing_tests = [tests[i] for i in missing]
+            if min_rollouts is None:
+                missing_output, missing_rollouts = run_tests_on_pool(evaluators, missing_tests, num_rollouts, save_fn,
+                                                                     render, max_batch_envs, crn_seed)
+            else:
+                missing_output, missing_rollouts = run_adaptive_tests_on_pool(evaluators, missing_tests, num_rollouts,
+                                                                              save_fn, min_rollouts, round_size,
+                                                                              rel_tol, dominance_margin, render,
+                                                                              max_batch_envs, crn_seed)
+            for i, row, used in zip(missing, missing_output, missing_rollouts):
+                temp_output[i] = row
+                rollouts_used[i] = used
+
+        if min_rollouts is not None:
+            with open('{}/{}_{}_rollouts_used.txt'.format(outdir, output_file_name, output_name), 'wb') as file:
+                np.savetxt(file, np.array(rollouts_used), fmt='%d')
+        return temp_output
 
     output_name = "mean_sweep"
     if is_test:
         output_name = "holdout_test_sweep"
+    temp_output = evaluate(run_list, output_name)
+
     with open('{}/{}_{}_rew.txt'.format(outdir, output_file_name, output_name),
               'wb') as file:
         np.savetxt(file, np.array(temp_output))
@@ -261,23 +591,20 @@ def run_transfer_tests(rllib_config, checkpoint, num_rollouts, output_file_name,
                     fig = plt.figure()
                     plt.bar(np.arange(len(means)), means)
                     plt.title("Bandit performance tests")
-                    plt.xticks(ticks=np.arange(len(means)), labels=[transfer[0] for transfer in run_list])
+                    plt.xticks(ticks=np.arange(len(means)), labels=[spec.name for spec in run_list])
                     plt.xlabel("Bandit test name")
                     plt.ylabel("Bandit regret")
                     plt.savefig(transfer_robustness)
                     plt.close(fig)
 
-    num_advs = rllib_config['env_config']['advs_per_strength'] * rllib_config['env_config']['num_adv_strengths']
     if num_advs > 11:
+        if store is not None:
+            store.close()
         return
     adv_names = ["adversary{}".format(adv_num) for adv_num in range(num_advs)]
     if num_advs:
-        temp_output = [run_test.remote(test_name="adversary{}".format(adv_num),
-                    outdir=outdir, output_file_name=output_file_name,
-                    num_rollouts=num_rollouts,
-                    rllib_config=rllib_config, checkpoint=checkpoint, render=render, env_modifier=[], adv_num=adv_num)
-                    for adv_num in range(num_advs)]
-        temp_output = ray.get(temp_output)
+        tests = [TransferSpec("adversary{}".format(adv_num), adv_num=adv_num) for adv_num in range(num_advs)]
+        temp_output = evaluate(tests, "with_adv_mean_sweep")
 
         with open('{}/{}_{}_rew.txt'.format(outdir, output_file_name, "with_adv_mean_sweep"),
                 'wb') as file:
@@ -306,6 +633,9 @@ def run_transfer_tests(rllib_config, checkpoint, num_rollouts, output_file_name,
             plt.savefig(file)
             plt.close(fig)
 
+    if store is not None:
+        store.close()
+
 if __name__ == '__main__':
 
     date = datetime.now(tz=pytz.utc)
@@ -318,6 +648,25 @@ if __name__ == '__main__':
     parser.add_argument('--output_dir', type=str, default=output_path,
                         help='')
     parser.add_argument('--run_holdout',  action='store_true', default=False, help='If true, run holdout tests')
+    parser.add_argument('--max_batch_envs', type=int, default=256,
+                        help='Maximum number of envs each evaluator steps together with batched inference')
+    parser.add_argument('--adaptive', action='store_true', default=False,
+                        help='If true, num_rollouts is the maximum and each test stops once its estimate is tight')
+    parser.add_argument('--min_rollouts', type=int, default=5,
+                        help='Rollouts every test gets before the adaptive stopping rules are checked')
+    parser.add_argument('--round_size', type=int, default=5,
+                        help='Rollouts added per round to the tests that are still running in adaptive mode')
+    parser.add_argument('--rel_tol', type=float, default=0.05,
+                        help='Stop a test once its confidence interval half width is below this fraction of its mean')
+    parser.add_argument('--dominance_margin', type=float, default=None,
+                        help='If set, stop a test once its upper bound is this far below the best lower bound')
+    parser.add_argument('--crn_seed', type=int, default=None,
+                        help='If set, evaluate with common random numbers so that results are paired by rollout index')
+    parser.add_argument('--results_store', type=str, default=None,
+                        help='If set, every rollout is added to the results store at this path and tests already in it '
+                             'are not rerun. Without a store every test is run')
+    parser.add_argument('--no_txt', action='store_true', default=False,
+                        help='If true and a results store is used, do not write a text file per test')
 
     parser = replay_parser(parser)
     args = parser.parse_args()
@@ -348,4 +697,7 @@ if __name__ == '__main__':
     if 'run' not in rllib_config['env_config']:
         rllib_config['env_config'].update({'run': 'PPO'})
     run_transfer_tests(rllib_config, checkpoint, args.num_rollouts, args.output_file_name,
-                       os.path.join(args.output_dir, date), run_list=run_list, render=args.show_images)
\ No newline at end of file
+                       os.path.join(args.output_dir, date), run_list=run_list, render=args.show_images,
+                       max_batch_envs=args.max_batch_envs, min_rollouts=args.min_rollouts if args.adaptive else None,
+                       round_size=args.round_size, rel_tol=args.rel_tol, dominance_margin=args.dominance_margin,
+                       crn_seed=args.crn_seed, results_store=args.results_store, save_txt=not args.no_txt)
\ No newline at end of file
@@ -13,22 +13,18 @@ matplotlib.rc('font', **font)
 
 import numpy as np
 
-hopper_mass_sweep = np.linspace(.7, 1.3, 11)
-hopper_friction_sweep = np.linspace(0.7, 1.3, 11)
+from envs.mujoco.sweeps import hopper_mass_sweep, hopper_friction_sweep, cheetah_mass_sweep, \
+    cheetah_friction_sweep_good, cheetah_friction_sweep, ant_mass_sweep, ant_friction_sweep
+from utils.results_store import ResultsStore, parse_test_name, walk_result_dirs
 
-cheetah_mass_sweep = np.linspace(.5, 1.5, 11)
-cheetah_friction_sweep_good = np.linspace(0.5, 1.5, 11)
-cheetah_friction_sweep = np.linspace(0.1, 0.9, 11)
-
-ant_mass_sweep = np.linspace(.5, 1.5, 11)
-ant_friction_sweep = np.linspace(0.1, 0.9, 11)
-
-def load_data(results_path):
+def load_data(results_path, checkpoint='latest'):
+    """The tags are the trial folders, checkpoint picks the checkpoint folder of every trial, see
+    utils/results_store.py walk_result_dirs"""
     all_file_names = OrderedDict()
-    for (dirpath, dirnames, filenames) in os.walk(results_path):
+    for dirpath, filenames, trial, _, _ in walk_result_dirs(results_path, checkpoint):
         for run in filenames:
             if "sweep_rew.txt" in run and not "adv_mean_sweep_rew" in run:
-                tag = dirpath.split("/")[-1]
+                tag = trial or os.path.basename(dirpath)
                 try:
                     run_results = np.load(os.path.join(dirpath, run))
                 except:
@@ -46,6 +42,24 @@ def load_data(results_path):
 
     return all_file_names
 
+def load_data_from_store(store, experiment, checkpoint='latest'):
+    """Same output as load_data but read from a ResultsStore. The tags are the trial folders (or the seeds of results
+    without one) and the grid cells are ordered like the transfer test run lists (friction major, then mass).
+    checkpoint picks the checkpoint of every trial that is plotted, see ResultsStore.select_rollouts"""
+    all_file_names = OrderedDict()
+    for (trial, seed), test_results in store.load_test_means(experiment, checkpoint=checkpoint).items():
+        grid_tests = sorted([test for test in test_results if test != 'base' and parse_test_name(test)[0] is not None],
+                            key=lambda test: parse_test_name(test)[::-1])
+        if 'base' not in test_results or len(grid_tests) == 0:
+            continue
+        base_score, base_std, base_steps, base_steps_std = test_results['base']
+        run_results = np.array([test_results[test] for test in grid_tests])
+        all_file_names[trial or 'seed={}'.format(seed)] = (base_score, base_std, base_steps, base_steps_std,
+                                                           run_results[:, 0], run_results[:, 1], run_results[:, 2],
+                                                           run_results[:, 3], os.path.dirname(store.path))
+    return all_file_names
+
+
 def load_bandit_data(results_path):
     all_file_names = OrderedDict()
     for (dirpath, dirnames, filenames) in os.walk(results_path):
@@ -57,13 +71,18 @@ def load_bandit_data(results_path):
     return all_file_names
     
 
-def load_data_by_name(results_path, name):
-    """This is used for the test set"""
+def load_data_by_name(results_path, name, store=None, checkpoint='latest'):
+    """This is used for the test set. checkpoint picks the checkpoint of every trial. If a ResultsStore is passed,
+    results_path is the experiment name"""
     all_file_names = OrderedDict()
-    for (dirpath, dirnames, filenames) in os.walk(results_path):
+    if store is not None:
+        for (trial, seed), test_results in store.load_test_means(results_path, [name], checkpoint).items():
+            all_file_names[trial or 'seed={}'.format(seed)] = test_results[name][:2]
+        return all_file_names
+    for dirpath, filenames, trial, _, _ in walk_result_dirs(results_path, checkpoint):
         for run in filenames:
             if name in run and 'png' not in run:
-                tag = dirpath.split("/")[-1]
+                tag = trial or os.path.basename(dirpath)
                 try:
                     run_results = np.load(os.path.join(dirpath, run))
                 except:
@@ -74,8 +93,14 @@ def load_data_by_name(results_path, name):
     return all_file_names
 
 
-def make_heatmap(results_path, exp_type, output_path, show=False, output_file_name=None, fontsize=14, title_fontsize=16):
-    sweep_data = load_data(results_path)
+def make_heatmap(results_path, exp_type, output_path, show=False, output_file_name=None, fontsize=14, title_fontsize=16,
+                 store=None, checkpoint='latest'):
+    """checkpoint picks the checkpoint of every trial. If a ResultsStore is passed, results_path is the experiment
+    name"""
+    if store is not None:
+        sweep_data = load_data_from_store(store, results_path, checkpoint)
+    else:
+        sweep_data = load_data(results_path, checkpoint)
     for file_name in sweep_data:
         print(file_name)
         _, _, _, _, means, _, _, _, dirpath = sweep_data[file_name]
@@ -140,8 +165,15 @@ if __name__ == "__main__":
     parser.add_argument('exp_type', type=str, help='hopper, cheetah, pendulum, ant')
     parser.add_argument('--output_path', type=str, help='Output file location.')
     parser.add_argument('--show_images', action="store_true", help='Show plots as they are created.')
+    parser.add_argument('--results_store', type=str, default=None,
+                        help='If set, read the results from this store and treat results_path as the experiment name')
+    parser.add_argument('--checkpoint', type=str, default='latest',
+                        help='Checkpoint iteration to plot, or latest for the last checkpoint of every trial')
     args = parser.parse_args()
 
-    make_heatmap(args.results_path, args.exp_type, args.output_path, args.show_images)
+    store = ResultsStore(args.results_store) if args.results_store else None
+    checkpoint = args.checkpoint if args.checkpoint == 'latest' else int(args.checkpoint)
+    make_heatmap(args.results_path, args.exp_type, args.output_path, args.show_images, store=store,
+                 checkpoint=checkpoint)
 
 